@@ -1,10 +1,13 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, send_from_directory, abort, url_for
 import os
 import uuid
 import base64
 from io import BytesIO
 import traceback
 import json
+import hashlib
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
 from datetime import datetime
 
@@ -12,119 +15,614 @@ from config import Config
 from models.face_detection import FaceDetector
 from models.image_processing import FaceProcessor
 from models.style_synthesis import StyleSynthesizer
+from models.animation import AnimatedEmojiGenerator
+from models.stream_session import EmojiStreamSession
+from models.sticker_pack import StickerPackExporter
+from models.process_pipeline import ProcessPipeline
 from utils.file_manager import FileManager
+from utils.template_registry import TemplateRegistry
+from utils.template_ingest import TemplateIngestor
+from utils.template_store import TemplateStore
+from utils.perceptual_hash import FaceHashIndex
+from utils.single_flight import SingleFlight, RequestTracker, RequestCancelled
+from utils.profiling import RequestProfile, ProfilingPolicy, profile_stage
+from utils.memory_budget import MemoryBudget, ImageTooLargeError
+from utils.image_pyramid import parse_output_sizes, build_size_variants, encode_variants
+from utils.request_scheduler import CostScheduler, SchedulerBusyError
+from utils.cache_backend import create_cache
+from utils.temp_janitor import TempJanitor
+from utils.static_assets import StaticAssets
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
 
 # 初始化Flask应用
 app = Flask(__name__)
 app.config.from_object(Config)
 
 # 初始化各模块
-face_detector = FaceDetector()
+template_registry = TemplateRegistry()
+template_store = None
+if Config.TEMPLATE_ATLAS_ENABLED:
+    template_store = TemplateStore(template_registry)
+    template_store.ensure_built()
+memory_budget = MemoryBudget()
+shared_cache = create_cache()
+face_detector = FaceDetector(FaceHashIndex() if Config.PERCEPTUAL_HASH['enabled'] else None, memory_budget,
+                             face_cache=shared_cache)
 face_processor = FaceProcessor(face_detector)
-style_synthesizer = StyleSynthesizer()
+style_synthesizer = StyleSynthesizer(template_registry, template_store)
 file_manager = FileManager()
+animation_generator = AnimatedEmojiGenerator(face_detector, face_processor, style_synthesizer)
+sticker_exporter = StickerPackExporter(style_synthesizer)
+encode_executor = ThreadPoolExecutor(max_workers=Config.OUTPUT_SIZES['encode_workers'],
+                                     thread_name_prefix='encode')
+template_ingestor = TemplateIngestor()
+# 系统模板不经过上传流程，启动时补齐缩略图
+for system_template in Config.AVAILABLE_STYLES.values():
+    template_ingestor.ensure_thumbnail(os.path.join(Config.STYLES_FOLDER, system_template), system_template)
+generate_flight = SingleFlight()
+request_tracker = RequestTracker()
+profiling_policy = ProfilingPolicy()
+scheduler = CostScheduler()
+temp_janitor = TempJanitor()
+if Config.TEMP_JANITOR['enabled']:
+    temp_janitor.start()
+static_assets = StaticAssets()
+if Config.STATIC_ASSETS['enabled']:
+    static_assets.build()
+process_pipeline = None
+if Config.PROCESS_PIPELINE['enabled']:
+    process_pipeline = ProcessPipeline(memory_budget)
+    atexit.register(process_pipeline.close)
+
+
+def refresh_template_store():
+    """模板增删后重建共享图集，其他工作进程在下次访问时重新映射"""
+    if template_store is None:
+        return
+    try:
+        template_store.rebuild()
+    except Exception as e:
+        print(f"⚠️ 模板图集重建失败: {e}")
+
+
+def parse_processing_params(form):
+    """从表单读取处理参数 - 所有阈值都是0-100%"""
+    processing_params = {
+        'brighten_factor': float(form.get('brighten_factor', 50)),
+        'darken_factor': float(form.get('darken_factor', 50)),
+        'low_cutoff_percent': float(form.get('low_cutoff_percent', 30)),
+        'high_cutoff_percent': float(form.get('high_cutoff_percent', 70)),
+        'border_cleanup_pixels': int(form.get('border_cleanup_pixels', 2))
+    }
+
+    # 确保参数在有效范围内
+    processing_params['brighten_factor'] = max(0, min(100, processing_params['brighten_factor']))
+    processing_params['darken_factor'] = max(0, min(100, processing_params['darken_factor']))
+    processing_params['low_cutoff_percent'] = max(0, min(100, processing_params['low_cutoff_percent']))
+    processing_params['high_cutoff_percent'] = max(0, min(100, processing_params['high_cutoff_percent']))
+    return processing_params
+
+
+def parse_caption(form):
+    """从表单读取配字 - 没有配字或未启用时返回None，字体不支持其中的字符时抛出 ValueError"""
+    caption_config = Config.CAPTION
+    text = form.get('caption', '').strip()[:caption_config['max_length']]
+    if not text or style_synthesizer.caption_renderer is None:
+        return None
+
+    missing = style_synthesizer.caption_renderer.missing_glyphs(text)
+    if missing:
+        raise ValueError(f"配字字体不支持这些字符: {''.join(missing[:10])}")
+
+    position = form.get('caption_position', 'bottom')
+    return {
+        'text': text,
+        'position': position if position in ('top', 'center', 'bottom') else 'bottom',
+        'size': max(caption_config['min_size'],
+                    min(caption_config['max_size'], int(form.get('caption_size', caption_config['default_size'])))),
+        'stroke_width': max(0, min(caption_config['max_stroke_width'],
+                                   int(form.get('caption_stroke', caption_config['default_stroke_width']))))
+    }
+
+
+def image_to_data_url(image):
+    """PNG编码并转换为base64 data URL"""
+    buffered = BytesIO()
+    with profile_stage('encode'):
+        image.save(buffered, format="PNG")
+    img_str = base64.b64encode(buffered.getvalue()).decode()
+    return f"data:image/png;base64,{img_str}"
+
+
+def encode_result(image, output_sizes=None):
+    """编码合成结果 - 返回(完整尺寸data URL, {尺寸: data URL})
+
+    指定了多个输出尺寸时，各尺寸从同一张合成图逐级缩小得到，并与完整尺寸一起并行编码
+    """
+    if not output_sizes:
+        return image_to_data_url(image), None
+
+    variants = build_size_variants(image, output_sizes)
+    variants['full'] = image
+    encoded = encode_variants(variants, image_to_data_url, encode_executor)
+    full = encoded.pop('full')
+    return full, {str(size): data_url for size, data_url in encoded.items()}
+
+
+def is_truthy(value):
+    """解析表单中的布尔开关"""
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def asset_url(filename):
+    """静态资源地址 - 已生成指纹版本时返回 /assets/ 下带内容哈希的地址，否则返回普通静态地址"""
+    fingerprinted = static_assets.fingerprinted(filename)
+    if fingerprinted is None:
+        return url_for('static', filename=filename)
+    return url_for('serve_asset', filename=fingerprinted)
+
+
+@app.context_processor
+def inject_asset_url():
+    return {'asset_url': asset_url}
+
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """带指纹的静态资源 - 按 Accept-Encoding 返回预压缩版本，内容不会变化，可永久缓存"""
+    resolved = static_assets.resolve(filename, request.headers.get('Accept-Encoding'))
+    if resolved is None:
+        abort(404)
+
+    path, encoding, mimetype = resolved
+    max_age = Config.STATIC_ASSETS['max_age']
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=max_age)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """上传超过 MAX_CONTENT_LENGTH - 返回JSON，前端按普通错误提示"""
+    return jsonify({'status': 'error',
+                    'message': f'文件过大，不能超过 {Config.MAX_CONTENT_LENGTH // 1024 // 1024}MB'}), 413
 
-# 模板管理文件路径
-TEMPLATES_JSON = os.path.join(Config.STYLES_FOLDER, 'custom_templates.json')
 
+@app.route('/')
+def index():
+    # 上传预处理参数下发给前端
+    client_upload = dict(Config.CLIENT_UPLOAD,
+                         max_upload_bytes=Config.MAX_CONTENT_LENGTH,
+                         worker_url=asset_url('js/upload_worker.js'))
+    return render_template('index.html', client_upload=client_upload)
 
-def load_templates():
-    """加载模板配置"""
-    if os.path.exists(TEMPLATES_JSON):
-        try:
-            with open(TEMPLATES_JSON, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            pass
-    return {}
 
+def upload_digest(file_storage):
+    """计算上传文件内容的SHA-256，读取后把流复位以便保存"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file_storage.stream.read(1 << 16), b''):
+        digest.update(chunk)
+    file_storage.stream.seek(0)
+    return digest.hexdigest()
 
-def save_templates(templates):
-    """保存模板配置"""
+
+def upload_megapixels(file_storage):
+    """从上传文件头读取像素数（百万），无法识别时按1估算
+
+    超过像素上限的图片在排队前就抛出ImageTooLargeError（ValueError）
+    """
     try:
-        with open(TEMPLATES_JSON, 'w', encoding='utf-8') as f:
-            json.dump(templates, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception:
-        return False
+        dimensions = memory_budget.read_dimensions(file_storage.stream)
+    finally:
+        file_storage.stream.seek(0)
+    if dimensions is None:
+        return 1.0
+    memory_budget.reduction_for(*dimensions)
+    return dimensions[0] * dimensions[1] / 1e6
 
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+def client_key(session_id, remote_addr):
+    """调度公平性按客户端计算 - 优先使用前端会话ID"""
+    return session_id or remote_addr or ''
 
 
 @app.route('/generate', methods=['POST'])
 def generate_emoji():
-    """生成表情包接口 - 支持新参数"""
+    """生成表情包接口 - 支持新参数
+
+    内容、风格和参数完全相同的并发请求只计算一次并共享结果；
+    客户端取消或同一会话发起新请求后，处理流程在阶段之间停止。
+    ?profile=<令牌> 或请求头 X-Emoji-Profile 开启本次请求的性能分析（需配置允许）。
+    sizes=64,128,512 同时返回多个尺寸（最长边像素），检测、处理和合成只做一次。
+    priority=interactive 标记滑块调参的重新生成，排队时优先执行。
+    """
+    request_id = request.form.get('request_id') or uuid.uuid4().hex
+    session_id = request.form.get('session_id', '')
+    token = request_tracker.register(request_id, session_id)
     try:
         if 'photo' not in request.files:
             return jsonify({'status': 'error', 'message': '请选择要上传的照片'}), 400
 
         photo_file = request.files['photo']
-        style = request.form.get('style', 'panda')
 
         # 检查文件格式
         if photo_file.filename == '' or not file_manager.allowed_file(photo_file.filename):
             return jsonify({'status': 'error', 'message': '不支持的文件格式'}), 400
 
-        # 保存上传的文件
-        upload_path = file_manager.save_upload_file(photo_file)
+        try:
+            flight_key, run = prepare_generation(request.form, photo_file, request_id,
+                                                 request.args.get('profile') or request.headers.get('X-Emoji-Profile'),
+                                                 client_key(session_id, request.remote_addr))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
 
-        # 人脸检测
-        face_image, confidence, ellipse_info = face_detector.detect_face(upload_path)
-        if face_image is None or confidence < Config.FACE_DETECTION_CONFIDENCE:
-            return jsonify({'status': 'error', 'message': '未检测到清晰人脸'}), 400
-
-        # 获取处理参数 - 现在所有阈值都是0-100%
-        processing_params = {
-            'brighten_factor': float(request.form.get('brighten_factor', 50)),
-            'darken_factor': float(request.form.get('darken_factor', 50)),
-            'low_cutoff_percent': float(request.form.get('low_cutoff_percent', 30)),
-            'high_cutoff_percent': float(request.form.get('high_cutoff_percent', 70)),
-            'border_cleanup_pixels': int(request.form.get('border_cleanup_pixels', 2))
-        }
+        payload, status_code = generate_flight.do(flight_key, run, token)
+        return jsonify(payload), status_code
+
+    except SchedulerBusyError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+
+    except RequestCancelled:
+        print(f"⏹️ 生成请求已取消: {request_id}")
+        return jsonify({'status': 'cancelled', 'message': '请求已取消'}), 499
+
+    except Exception as e:
+        print(f"处理过程中出错: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'status': 'error', 'message': '处理过程中出现错误'}), 500
 
-        # 确保参数在有效范围内
-        processing_params['brighten_factor'] = max(0, min(100, processing_params['brighten_factor']))
-        processing_params['darken_factor'] = max(0, min(100, processing_params['darken_factor']))
-        processing_params['low_cutoff_percent'] = max(0, min(100, processing_params['low_cutoff_percent']))
-        processing_params['high_cutoff_percent'] = max(0, min(100, processing_params['high_cutoff_percent']))
+    finally:
+        request_tracker.finish(request_id, session_id)
+
+
+def prepare_generation(form, photo_file, request_id, profile_flag=None, client_id=''):
+    """解析生成请求 - 返回(合并键, 执行函数)，执行函数接收取消令牌并返回(响应数据, 状态码)
+
+    Flask 和 ASGI 两种服务方式共用；参数无效时抛出 ValueError。
+    执行函数先查共享结果缓存，未命中时在调度器中排队，队列已满时抛出 SchedulerBusyError
+    """
+    style = form.get('style', 'panda')
+    multi_face = is_truthy(form.get('multi_face', ''))
+    animated = is_truthy(form.get('animated', ''))
+    animation_format = form.get('animation_format', Config.ANIMATION['output_format'])
+
+    # 获取处理参数 - 现在所有阈值都是0-100%
+    processing_params = parse_processing_params(form)
+    print(f"🎯 使用处理参数: {processing_params}")
+    caption = parse_caption(form)
+
+    output_sizes = parse_output_sizes(form.getlist('sizes'),
+                                      Config.OUTPUT_SIZES['max_count'], Config.OUTPUT_SIZES['max_side'])
+
+    digest = upload_digest(photo_file)
+    flight_key = (digest, style, tuple(sorted(processing_params.items())),
+                  multi_face, animated, animation_format if animated else None, tuple(output_sizes),
+                  tuple(sorted(caption.items())) if caption else None)
+
+    profile_on_demand = profiling_policy.on_demand(profile_flag)
+    profile_name = None
+    if profiling_policy.sampled() or profile_on_demand:
+        profile_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{request_id[:8]}"
+        # 分析的请求单独计算，不与其他请求合并
+        flight_key += (request_id,)
+
+    trace_memory = Config.MEMORY_BUDGET['trace_allocations']
+
+    interactive = form.get('priority') == 'interactive'
+    cost = scheduler.estimate_cost(upload_megapixels(photo_file), digest, sizes=len(output_sizes),
+                                   multi_face=multi_face, animated=animated)
+
+    # 分析的请求不使用结果缓存；键包含模板签名，模板替换后旧结果不再命中
+    result_key = None
+    if profile_name is None:
+        signature = repr((flight_key, style_synthesizer.template_signature(style)))
+        result_key = 'result:' + hashlib.sha256(signature.encode('utf-8')).hexdigest()
+
+    def run(flight_token):
+        def generate():
+            if result_key is not None:
+                cached = shared_cache.get(result_key)
+                if cached is not None:
+                    print("🎯 命中结果缓存")
+                    return json.loads(cached), 200
+
+            with scheduler.slot(client_id, cost, interactive, flight_token):
+                payload, status_code = run_generation(photo_file, style, processing_params, flight_token,
+                                                      multi_face=multi_face, animated=animated,
+                                                      animation_format=animation_format,
+                                                      output_sizes=output_sizes, upload_key=digest,
+                                                      caption=caption)
+
+            if result_key is not None and status_code == 200:
+                shared_cache.set(result_key, json.dumps(payload).encode('utf-8'), Config.CACHE['result_ttl'])
+            return payload, status_code
+
+        if profile_name is None and not trace_memory:
+            return generate()
+
+        with RequestProfile(profile_name or request_id[:8], sample_stacks=profile_name is not None,
+                            trace_memory=trace_memory) as profile:
+            payload, status_code = generate()
+        if profile_name is None:
+            print(f"🧮 分阶段内存峰值: {profile.summary()['stages']}")
+            return payload, status_code
+
+        profile.save()
+        if profile_on_demand:
+            payload = dict(payload, profile=dict(profile.summary(), id=profile_name))
+        return payload, status_code
+
+    return flight_key, run
+
+
+@app.route('/cancel_generate', methods=['POST'])
+def cancel_generate():
+    """取消进行中的生成请求（前端中止请求时调用）"""
+    data = request.get_json(silent=True) or {}
+    request_id = data.get('request_id')
+    if not request_id:
+        return jsonify({'status': 'error', 'message': '缺少参数'}), 400
+
+    cancelled = request_tracker.cancel(request_id)
+    return jsonify({'status': 'success', 'cancelled': cancelled})
+
+
+@app.route('/metrics')
+def metrics():
+    """运行指标 - 调度队列（含排队等待时间）、请求合并、共享缓存、人脸检测各路径、临时文件清理和配字缓存的统计"""
+    data = {'scheduler': scheduler.metrics(), 'single_flight': dict(generate_flight.stats),
+            'cache': shared_cache.metrics(), 'face_detection': dict(face_detector.detection_stats),
+            'temp_janitor': dict(temp_janitor.stats)}
+    if style_synthesizer.caption_renderer is not None:
+        data['caption'] = style_synthesizer.caption_renderer.metrics()
+    if process_pipeline is not None:
+        data['slab_pool'] = dict(process_pipeline.pool.stats)
+    return jsonify(data)
+
+
+@app.route('/profiles/<path:filename>')
+def download_profile(filename):
+    """下载性能分析文件（*.speedscope.json / *.collapsed.txt），仅在允许按需分析时开放"""
+    if not profiling_policy.on_demand(request.args.get('token') or request.headers.get('X-Emoji-Profile')):
+        abort(404)
+    return send_from_directory(Config.PROFILING['output_folder'], filename)
+
+
+def run_generation(photo_file, style, processing_params, cancel_token,
+                   multi_face=False, animated=False, animation_format=None, output_sizes=None, upload_key=None,
+                   caption=None):
+    """执行一次生成 - 返回(响应数据, 状态码)，结果会被合并的请求共享
+
+    output_sizes 只对静态结果生效，动图始终按模板尺寸输出；
+    upload_key 为上传内容摘要，单人脸检测先查共享缓存中的人脸位置；caption 为配字（见 parse_caption）
+    """
+    # 保存上传的文件
+    upload_path = file_manager.save_upload_file(photo_file)
+    try:
+        if multi_face:
+            return generate_multi_face(upload_path, style, processing_params, cancel_token, output_sizes, caption)
+
+        if animated and animation_generator.is_animated(upload_path):
+            return generate_animated(upload_path, style, processing_params, animation_format, cancel_token,
+                                     caption)
+
+        if process_pipeline is not None:
+            # 检测、处理、合成在工作进程中完成，结果图像直接引用共享内存，需在with块内编码
+            with process_pipeline.render(upload_path, style, processing_params, cancel_token,
+                                         upload_key, caption) as rendered:
+                result_image, _ = rendered
+                if result_image is None:
+                    return {'status': 'error', 'message': '未检测到清晰人脸'}, 400
+                return single_face_payload(result_image, processing_params, output_sizes)
 
-        print(f"🎯 使用处理参数: {processing_params}")
+        # 人脸检测
+        face_image, confidence, ellipse_info = face_detector.detect_face(upload_path, upload_key)
+        if face_image is None or confidence < Config.FACE_DETECTION_CONFIDENCE:
+            return {'status': 'error', 'message': '未检测到清晰人脸'}, 400
+        cancel_token.check()
 
         # 人脸处理
         processed_face = face_processor.process_face(face_image,
                                                      processing_params=processing_params,
                                                      ellipse_info=ellipse_info)
+        cancel_token.check()
 
         # 风格合成
-        result_image = style_synthesizer.synthesize_style(processed_face, style)
+        result_image = style_synthesizer.synthesize_style(processed_face, style, caption)
+        cancel_token.check()
+        return single_face_payload(result_image, processing_params, output_sizes)
 
-        # 转换为base64返回给前端
-        buffered = BytesIO()
-        result_image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+    except ImageTooLargeError as e:
+        # 解码时按文件头检查像素数（MemoryBudget.load_bgr / reduce_frame），不单独预先检查
+        return {'status': 'error', 'message': str(e)}, 400
 
-        return jsonify({
-            'status': 'success',
-            'image': f"data:image/png;base64,{img_str}",
-            'message': '表情包生成成功！',
-            'params': processing_params  # 返回使用的参数
-        })
+    finally:
+        # 清理临时文件
+        if os.path.exists(upload_path):
+            file_manager.cleanup_file(upload_path)
+
+
+def single_face_payload(result_image, processing_params, output_sizes=None):
+    """单人脸结果转换为base64返回给前端"""
+    image, sizes = encode_result(result_image, output_sizes)
+    payload = {
+        'status': 'success',
+        'image': image,
+        'message': '表情包生成成功！',
+        'params': processing_params  # 返回使用的参数
+    }
+    if sizes:
+        payload['sizes'] = sizes
+    return payload, 200
+
+
+def generate_multi_face(upload_path, style, processing_params, cancel_token, output_sizes=None, caption=None):
+    """多人脸模式 - 一次检测照片中所有人脸，批量处理并合成为同一风格"""
+    detected_faces = face_detector.detect_faces(upload_path)
+    if not detected_faces:
+        return {'status': 'error', 'message': '未检测到清晰人脸'}, 400
+    cancel_token.check()
+
+    face_images = [face for face, _, _ in detected_faces]
+    ellipse_infos = [info for _, _, info in detected_faces]
+
+    # 尺寸相同的人脸堆叠处理
+    processed_faces = face_processor.process_faces(face_images,
+                                                   processing_params=processing_params,
+                                                   ellipse_infos=ellipse_infos)
+
+    images = []
+    for processed_face, (_, confidence, ellipse_info) in zip(processed_faces, detected_faces):
+        cancel_token.check()
+        result_image = style_synthesizer.synthesize_style(processed_face, style, caption)
+        image, sizes = encode_result(result_image, output_sizes)
+        face_result = {
+            'image': image,
+            'confidence': round(float(confidence), 3),
+            'face_rect': [int(v) for v in ellipse_info['face_rect']]
+        }
+        if sizes:
+            face_result['sizes'] = sizes
+        images.append(face_result)
+
+    return {
+        'status': 'success',
+        'image': images[0]['image'],  # 兼容单人脸前端
+        'images': images,
+        'face_count': len(images),
+        'message': f'成功生成{len(images)}个表情包！',
+        'params': processing_params
+    }, 200
+
+
+def generate_animated(upload_path, style, processing_params, output_format, cancel_token, caption=None):
+    """动图模式 - 逐帧跟踪人脸并输出动画GIF/WebP"""
+    output_format = 'webp' if output_format == 'webp' else 'gif'
+    buffered = BytesIO()
+    stats = animation_generator.generate(upload_path, style, processing_params, buffered, output_format,
+                                         cancel_token=cancel_token, caption=caption)
+    if stats is None:
+        return {'status': 'error', 'message': '未检测到清晰人脸'}, 400
+
+    img_str = base64.b64encode(buffered.getvalue()).decode()
+    return {
+        'status': 'success',
+        'image': f"data:image/{output_format};base64,{img_str}",
+        'animated': True,
+        'frame_count': stats['output_frames'],
+        'tracking': stats,
+        'message': '动图表情包生成成功！',
+        'params': processing_params
+    }, 200
+
+
+@app.route('/export_sticker_pack', methods=['POST'])
+def export_sticker_pack():
+    """导出贴纸包 - 一次检测和处理，合成所选的多个风格并打包为zip"""
+    try:
+        if 'photo' not in request.files:
+            return jsonify({'status': 'error', 'message': '请选择要上传的照片'}), 400
+
+        photo_file = request.files['photo']
+        if photo_file.filename == '' or not file_manager.allowed_file(photo_file.filename):
+            return jsonify({'status': 'error', 'message': '不支持的文件格式'}), 400
+
+        try:
+            buffered = build_sticker_pack(photo_file, request.form,
+                                          client_key(request.form.get('session_id', ''), request.remote_addr))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        except SchedulerBusyError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 503
+
+        return send_file(buffered, mimetype='application/zip', as_attachment=True,
+                         download_name=sticker_pack_filename())
 
     except Exception as e:
-        print(f"处理过程中出错: {str(e)}")
-        import traceback
+        print(f"❌ 贴纸包导出失败: {str(e)}")
         traceback.print_exc()
-        return jsonify({'status': 'error', 'message': '处理过程中出现错误'}), 500
+        return jsonify({'status': 'error', 'message': '贴纸包导出失败'}), 500
+
+
+def sticker_pack_filename():
+    return f"stickers_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+
+
+def build_sticker_pack(photo_file, form, client_id=''):
+    """生成贴纸包zip - 返回定位到开头的BytesIO；照片或参数无效时抛出 ValueError
+
+    贴纸包属于批量导出，按风格数估算成本，排队时让位于交互式请求
+    """
+    # styles 可以重复提交，也可以用逗号分隔；去重并保持顺序
+    styles = []
+    for value in form.getlist('styles'):
+        for style in value.split(','):
+            style = style.strip()
+            if style and style not in styles:
+                styles.append(style)
+    for style in styles:
+        # 未知风格会合成出占位图，直接拒绝
+        if style not in Config.AVAILABLE_STYLES and not template_registry.exists(style):
+            raise ValueError(f'未知的风格: {style}')
+    styles = styles or list(Config.AVAILABLE_STYLES)
+    if len(styles) > Config.STICKER_PACK['max_styles']:
+        print(f"⚠️ 贴纸包风格数超过上限，只导出前{Config.STICKER_PACK['max_styles']}个")
+        styles = styles[:Config.STICKER_PACK['max_styles']]
+
+    processing_params = parse_processing_params(form)
+    caption = parse_caption(form)
+    cost = scheduler.estimate_cost(upload_megapixels(photo_file), styles=len(styles))
+    with scheduler.slot(client_id, cost):
+        return export_sticker_pack_file(photo_file, styles, processing_params, caption)
+
+
+def export_sticker_pack_file(photo_file, styles, processing_params, caption=None):
+    """检测、处理一次并合成所有风格写入zip"""
+    upload_key = upload_digest(photo_file)
+    upload_path = file_manager.save_upload_file(photo_file)
+    try:
+        # 图片过大时 ImageTooLargeError（ValueError）由解码抛出
+        face_image, confidence, ellipse_info = face_detector.detect_face(upload_path, upload_key)
+        if face_image is None or confidence < Config.FACE_DETECTION_CONFIDENCE:
+            raise ValueError('未检测到清晰人脸')
+
+        processed_face = face_processor.process_face(face_image,
+                                                     processing_params=processing_params,
+                                                     ellipse_info=ellipse_info)
+
+        buffered = BytesIO()
+        manifest = sticker_exporter.export(processed_face, styles, buffered, caption=caption)
+        buffered.seek(0)
+        print(f"✅ 贴纸包导出完成: {len(manifest['stickers'])}张, {buffered.getbuffer().nbytes / 1024:.1f}KB")
+        return buffered
 
     finally:
-        # 清理临时文件
-        if 'upload_path' in locals() and os.path.exists(upload_path):
+        if os.path.exists(upload_path):
             file_manager.cleanup_file(upload_path)
 
 
+def stream_emoji(ws):
+    """实时表情流 - 客户端推送JPEG帧，服务端返回合成后的表情帧"""
+    session = EmojiStreamSession(face_detector, face_processor, style_synthesizer,
+                                 style=request.args.get('style', 'panda'))
+    session.serve(ws)
+
+
+if Sock is not None:
+    sock = Sock(app)
+    sock.route('/stream')(stream_emoji)
+else:
+    print("⚠️ 未安装 flask-sock，/stream 实时流接口不可用")
+
+
 @app.route('/upload_style', methods=['POST'])
 def upload_style():
     """上传自定义风格模板"""
@@ -140,54 +638,84 @@ def upload_style():
             return jsonify({'status': 'error', 'message': '无效的参数或文件格式'}), 400
 
         # 检查风格名称是否已存在
-        templates = load_templates()
-        if style_name in templates:
+        if template_registry.exists(style_name):
             return jsonify({'status': 'error', 'message': '该风格名称已存在'}), 400
 
-        # 生成唯一文件名并保存
+        # 生成唯一文件名，规范化后保存（8位RGBA、限制尺寸、去除元数据、预解码文件和缩略图）
         filename = f"custom_{uuid.uuid4().hex}.png"
-        template_path = os.path.join(Config.STYLES_FOLDER, filename)
-        os.makedirs(Config.STYLES_FOLDER, exist_ok=True)
-        template_file.save(template_path)
-
-        # 保存模板信息
-        templates[style_name] = {
-            'filename': filename,
-            'description': description,
-            'created_at': str(datetime.now()),
-            'type': 'custom'
-        }
-
-        if save_templates(templates):
+        try:
+            template_info = template_ingestor.ingest(template_file, filename)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        # 保存模板信息 - 插入是原子的，并发上传同名模板时只有一个成功
+        if template_registry.add(style_name, filename, description,
+                                 width=template_info['width'],
+                                 height=template_info['height'],
+                                 layout=template_info['layout']):
+            refresh_template_store()
             return jsonify({
                 'status': 'success',
                 'message': '模板上传成功',
                 'style_name': style_name
             })
         else:
-            if os.path.exists(template_path):
-                os.remove(template_path)
-            return jsonify({'status': 'error', 'message': '保存模板信息失败'}), 500
+            template_ingestor.remove_template_files(filename)
+            return jsonify({'status': 'error', 'message': '该风格名称已存在'}), 400
 
     except Exception as e:
         print(f"模板上传错误: {str(e)}")
         return jsonify({'status': 'error', 'message': f'上传失败: {str(e)}'}), 500
 
 
+def revalidated(response):
+    """设置强ETag（内容的SHA-256）并处理 If-None-Match，内容未变化时返回304"""
+    if response.get_etag()[0] is None:
+        response.set_etag(hashlib.sha256(response.get_data()).hexdigest())
+    response.headers['Cache-Control'] = f'private, max-age={Config.TEMPLATE_THUMBNAIL_MAX_AGE}, must-revalidate'
+    return response.make_conditional(request)
+
+
+@app.route('/template_thumbnail/<style_name>')
+def template_thumbnail(style_name):
+    """系统或自定义模板的WebP缩略图 - 强ETag，If-None-Match 命中时返回304"""
+    template_path = style_synthesizer.template_path(style_name)
+    if template_path is None:
+        abort(404)
+    thumbnail_path = template_ingestor.ensure_thumbnail(template_path, template_path.name)
+    if thumbnail_path is None:
+        abort(404)
+
+    try:
+        etag = template_ingestor.thumbnail_etag(thumbnail_path)
+    except OSError:
+        abort(404)
+    response = send_file(thumbnail_path, mimetype='image/webp', conditional=False, etag=False)
+    response.set_etag(etag)
+    return revalidated(response)
+
+
 @app.route('/get_custom_templates', methods=['GET'])
 def get_custom_templates():
-    """获取所有自定义模板"""
+    """获取自定义模板 - 支持分页 (page, page_size)，响应带ETag，列表未变化时返回304"""
     try:
-        templates = load_templates()
-        custom_templates = {}
+        page = max(1, request.args.get('page', 1, type=int))
+        page_size = request.args.get('page_size', Config.CUSTOM_TEMPLATES_PAGE_SIZE, type=int)
+        page_size = max(1, min(Config.CUSTOM_TEMPLATES_PAGE_SIZE, page_size))
 
-        for style_name, info in templates.items():
-            if info.get('type') == 'custom':
-                file_path = os.path.join(Config.STYLES_FOLDER, info['filename'])
-                if os.path.exists(file_path):
-                    custom_templates[style_name] = info
+        custom_templates, total = template_registry.list_templates(page, page_size)
+        for style_name, info in custom_templates.items():
+            # 删除后重新上传同名模板时地址随之变化，不会用到浏览器缓存的旧缩略图
+            info['thumbnail_url'] = url_for('template_thumbnail', style_name=style_name, v=info['created_at'])
 
-        return jsonify({'status': 'success', 'templates': custom_templates})
+        return revalidated(jsonify({
+            'status': 'success',
+            'templates': custom_templates,
+            'page': page,
+            'page_size': page_size,
+            'total': total,
+            'has_more': page * page_size < total
+        }))
     except Exception:
         return jsonify({'status': 'error', 'message': '获取模板失败'}), 500
 
@@ -202,21 +730,13 @@ def delete_custom_template():
         if not style_name:
             return jsonify({'status': 'error', 'message': '缺少参数'}), 400
 
-        templates = load_templates()
-
-        if style_name not in templates:
+        # 先从注册表中删除（原子操作），再删除模板及衍生文件
+        info = template_registry.delete(style_name)
+        if info is None:
             return jsonify({'status': 'error', 'message': '模板不存在'}), 404
 
-        # 删除文件
-        filename = templates[style_name]['filename']
-        file_path = os.path.join(Config.STYLES_FOLDER, filename)
-
-        if os.path.exists(file_path):
-            os.remove(file_path)
-
-        # 从配置中删除
-        del templates[style_name]
-        save_templates(templates)
+        template_ingestor.remove_template_files(info['filename'])
+        refresh_template_store()
 
         return jsonify({'status': 'success', 'message': '删除成功'})
 
@@ -229,12 +749,6 @@ if __name__ == '__main__':
     for folder in [Config.STYLES_FOLDER, Config.RESULT_FOLDER]:
         os.makedirs(folder, exist_ok=True)
 
-    # 初始化自定义模板文件
-    templates_file = os.path.join(Config.STYLES_FOLDER, 'custom_templates.json')
-    if not os.path.exists(templates_file):
-        with open(templates_file, 'w', encoding='utf-8') as f:
-            json.dump({}, f)
-
     # 启动服务器
     host = getattr(Config, 'HOST', '0.0.0.0')
     port = getattr(Config, 'PORT', 5000)
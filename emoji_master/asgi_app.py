@@ -0,0 +1,314 @@
+'''
+ASGI异步服务模式 - 与 app.py 提供相同的接口
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+上传接收、响应发送和客户端断开检测都在事件循环中完成，慢速连接不占用线程；
+人脸检测、处理和合成提交到线程池，由调度器（Config.SCHEDULER）控制同时执行的任务数，
+线程池额外容纳排队中的任务，使排队顺序由调度器按成本决定而不是线程池的先来先服务。
+/generate、/export_sticker_pack 和 /stream 为原生异步实现，其余轻量接口转发给 app.py 中的Flask应用。
+需要安装 starlette、python-multipart 和 uvicorn（可选 a2wsgi）。
+'''
+import asyncio
+import uuid
+import traceback
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route, Mount, WebSocketRoute
+from starlette.staticfiles import StaticFiles
+from werkzeug.datastructures import FileStorage
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import app as sync_app
+from config import Config
+from models.stream_session import EmojiStreamSession
+from utils.single_flight import CancellationToken, RequestCancelled
+from utils.request_scheduler import SchedulerBusyError
+
+cpu_executor = ThreadPoolExecutor(max_workers=Config.ASGI['cpu_workers'] + Config.SCHEDULER['max_queue'],
+                                  thread_name_prefix='cpu')
+stream_executor = ThreadPoolExecutor(max_workers=Config.ASGI['max_streams'], thread_name_prefix='stream')
+
+
+class AsyncSingleFlight:
+    """事件循环内的请求合并 - 相同键只向CPU线程池提交一次，等待中的请求不占用线程
+
+    语义与 utils.single_flight.SingleFlight 相同：所有等待者都取消后才取消计算，
+    被放弃的计算立即从表中移除，之后到达的相同请求会重新开始计算
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self._flights = {}
+        self.stats = {'executed': 0, 'coalesced': 0, 'cancelled': 0}
+
+    async def do(self, key, fn, token):
+        loop = asyncio.get_running_loop()
+        flight = self._flights.get(key)
+        if flight is None:
+            flight_token = CancellationToken()
+            future = loop.run_in_executor(self.executor, fn, flight_token)
+            flight = {'future': future, 'token': flight_token, 'waiters': 0}
+            self._flights[key] = flight
+            future.add_done_callback(lambda _, current=flight: self._finish(key, current))
+            self.stats['executed'] += 1
+        else:
+            self.stats['coalesced'] += 1
+            print(f"🔗 合并相同的生成请求，等待中: {flight['waiters']}")
+
+        flight['waiters'] += 1
+        cancelled = loop.create_future()
+
+        def on_cancel():
+            # 取消可能来自其他线程（/cancel_generate 经WSGI在线程中执行）
+            loop.call_soon_threadsafe(lambda: cancelled.done() or cancelled.set_result(None))
+
+        token.add_callback(on_cancel)
+        try:
+            await asyncio.wait({flight['future'], cancelled}, return_when=asyncio.FIRST_COMPLETED)
+            token.check()
+            return flight['future'].result()
+        finally:
+            token.remove_callback(on_cancel)
+            cancelled.cancel()
+            flight['waiters'] -= 1
+            if flight['waiters'] == 0 and not flight['future'].done():
+                self.stats['cancelled'] += 1
+                flight['token'].cancel()
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    def _finish(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # 所有等待者都已离开时没有人读取结果，这里读取一次避免未处理异常的警告
+        if not flight['future'].cancelled():
+            flight['future'].exception()
+
+
+generate_flight = AsyncSingleFlight(cpu_executor)
+
+
+class ContentTooLarge(Exception):
+    """请求体超过 MAX_CONTENT_LENGTH"""
+
+
+async def read_form(request):
+    """解析表单 - 请求体超过 MAX_CONTENT_LENGTH 时抛出ContentTooLarge
+
+    Content-Length 只用于提前拒绝；分块上传没有这个头，也可能与实际长度不符，
+    所以在读取请求体时累计字节数，超过上限立即停止接收
+    """
+    length = request.headers.get('content-length')
+    if length is not None and length.isdigit() and int(length) > Config.MAX_CONTENT_LENGTH:
+        raise ContentTooLarge()
+
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > Config.MAX_CONTENT_LENGTH:
+                raise ContentTooLarge()
+        return message
+
+    return await Request(request.scope, receive).form()
+
+
+async def read_photo(form):
+    """读取表单中的照片 - 返回内存中的FileStorage，供 app.py 中的同步流程使用；没有照片时返回None
+
+    上传大小受 MAX_CONTENT_LENGTH 限制，读入内存后请求结束时即可关闭临时文件，
+    不会影响仍在为合并请求计算的线程
+    """
+    upload = form.get('photo')
+    if upload is None or isinstance(upload, str):
+        return None
+    data = await upload.read()
+    return FileStorage(stream=BytesIO(data), filename=upload.filename or '', content_type=upload.content_type)
+
+
+async def cancel_on_disconnect(request, token):
+    """请求体读取完后等待断开消息，客户端中止请求时取消令牌"""
+    while True:
+        message = await request.receive()
+        if message['type'] == 'http.disconnect':
+            token.cancel()
+            return
+
+
+def error_response(message, status_code):
+    return JSONResponse({'status': 'error', 'message': message}, status_code=status_code)
+
+
+async def generate_emoji(request):
+    """生成表情包接口 - 与 app.py 的 /generate 相同，客户端断开连接也会取消计算"""
+    try:
+        form = await read_form(request)
+    except ContentTooLarge:
+        return error_response('文件过大', 413)
+
+    request_id = form.get('request_id') or uuid.uuid4().hex
+    session_id = form.get('session_id', '')
+    token = sync_app.request_tracker.register(request_id, session_id)
+    watcher = asyncio.ensure_future(cancel_on_disconnect(request, token))
+    try:
+        photo_file = await read_photo(form)
+        if photo_file is None:
+            return error_response('请选择要上传的照片', 400)
+        if photo_file.filename == '' or not sync_app.file_manager.allowed_file(photo_file.filename):
+            return error_response('不支持的文件格式', 400)
+
+        loop = asyncio.get_running_loop()
+        profile_flag = request.query_params.get('profile') or request.headers.get('x-emoji-profile')
+        client_id = sync_app.client_key(session_id, request.client.host if request.client else '')
+        try:
+            flight_key, run = await loop.run_in_executor(cpu_executor, sync_app.prepare_generation,
+                                                         form, photo_file, request_id, profile_flag, client_id)
+        except ValueError as e:
+            return error_response(str(e), 400)
+
+        payload, status_code = await generate_flight.do(flight_key, run, token)
+        return JSONResponse(payload, status_code=status_code)
+
+    except SchedulerBusyError as e:
+        return error_response(str(e), 503)
+
+    except RequestCancelled:
+        print(f"⏹️ 生成请求已取消: {request_id}")
+        return JSONResponse({'status': 'cancelled', 'message': '请求已取消'}, status_code=499)
+
+    except Exception as e:
+        print(f"处理过程中出错: {str(e)}")
+        traceback.print_exc()
+        return error_response('处理过程中出现错误', 500)
+
+    finally:
+        watcher.cancel()
+        sync_app.request_tracker.finish(request_id, session_id)
+        await form.close()
+
+
+async def export_sticker_pack(request):
+    """导出贴纸包 - 与 app.py 的 /export_sticker_pack 相同"""
+    try:
+        form = await read_form(request)
+    except ContentTooLarge:
+        return error_response('文件过大', 413)
+
+    try:
+        photo_file = await read_photo(form)
+        if photo_file is None:
+            return error_response('请选择要上传的照片', 400)
+        if photo_file.filename == '' or not sync_app.file_manager.allowed_file(photo_file.filename):
+            return error_response('不支持的文件格式', 400)
+
+        loop = asyncio.get_running_loop()
+        client_id = sync_app.client_key(form.get('session_id', ''), request.client.host if request.client else '')
+        try:
+            buffered = await loop.run_in_executor(cpu_executor, sync_app.build_sticker_pack, photo_file, form, client_id)
+        except ValueError as e:
+            return error_response(str(e), 400)
+        except SchedulerBusyError as e:
+            return error_response(str(e), 503)
+
+        return Response(buffered.getvalue(), media_type='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename={sync_app.sticker_pack_filename()}'})
+
+    except Exception as e:
+        print(f"❌ 贴纸包导出失败: {str(e)}")
+        traceback.print_exc()
+        return error_response('贴纸包导出失败', 500)
+
+    finally:
+        await form.close()
+
+
+class WebSocketBridge:
+    """把异步WebSocket包装成 EmojiStreamSession.serve 需要的阻塞 receive/send 接口（在会话线程中调用）"""
+
+    def __init__(self, websocket, loop):
+        self.websocket = websocket
+        self.loop = loop
+
+    def receive(self):
+        try:
+            return asyncio.run_coroutine_threadsafe(self._receive(), self.loop).result()
+        except Exception:
+            return None
+
+    async def _receive(self):
+        message = await self.websocket.receive()
+        if message['type'] == 'websocket.disconnect':
+            return None
+        if message.get('bytes') is not None:
+            return message['bytes']
+        return message.get('text')
+
+    def send(self, data):
+        if isinstance(data, str):
+            coroutine = self.websocket.send_text(data)
+        else:
+            coroutine = self.websocket.send_bytes(data)
+        try:
+            future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        except RuntimeError:
+            # 事件循环已关闭（连接结束）
+            coroutine.close()
+            raise
+        future.result()
+
+
+async def stream_emoji(websocket):
+    """实时表情流 - 会话在独立线程中运行，收发通过事件循环完成"""
+    await websocket.accept()
+    session = EmojiStreamSession(sync_app.face_detector, sync_app.face_processor, sync_app.style_synthesizer,
+                                 style=websocket.query_params.get('style', 'panda'))
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(stream_executor, session.serve, WebSocketBridge(websocket, loop))
+    except Exception as e:
+        print(f"⚠️ 流会话异常结束: {e}")
+    finally:
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+
+@asynccontextmanager
+async def lifespan(_):
+    print(f"🚀 ASGI服务启动: CPU线程{Config.ASGI['cpu_workers']}个, 实时流上限{Config.ASGI['max_streams']}个")
+    yield
+    cpu_executor.shutdown(wait=False, cancel_futures=True)
+    stream_executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = Starlette(
+    routes=[
+        Route('/generate', generate_emoji, methods=['POST']),
+        Route('/export_sticker_pack', export_sticker_pack, methods=['POST']),
+        WebSocketRoute('/stream', stream_emoji),
+        Mount('/static', StaticFiles(directory=Config.STATIC_FOLDER), name='static'),
+        # 模板管理、取消、性能分析等轻量接口直接使用Flask应用
+        Mount('/', WSGIMiddleware(sync_app.app))
+    ],
+    lifespan=lifespan
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host=getattr(Config, 'HOST', '0.0.0.0'), port=getattr(Config, 'PORT', 5000))
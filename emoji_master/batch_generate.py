@@ -0,0 +1,229 @@
+'''
+离线批量生成表情包 - 多进程处理整个目录的照片
+
+    python batch_generate.py photos/ output/ --style panda --style dragon --workers 4 --format webp
+
+每个工作进程各自初始化一次人脸检测、处理和合成模块；已完成的输入连同生成设置（风格、格式、处理参数）
+记录在输出目录的 manifest.jsonl 中，中断后重新运行同一命令会跳过已完成的照片，
+换了设置重新运行时按新设置重新生成。
+'''
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter
+from multiprocessing import Pool
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+FORMAT_EXTENSIONS = {'png': 'png', 'webp': 'webp', 'jpeg': 'jpg'}
+
+# 工作进程内的模块实例，由 init_worker 初始化
+_worker = {}
+
+
+def init_worker(styles, processing_params, output_dir, image_format, verbose):
+    """工作进程初始化 - 每个进程只加载一次级联分类器和模板"""
+    if not verbose:
+        # 模块内有大量逐步日志，批量时只保留主进程的进度输出
+        sys.stdout = open(os.devnull, 'w')
+
+    import cv2
+    # 多进程并行时避免OpenCV内部线程超额订阅
+    cv2.setNumThreads(1)
+
+    from models.face_detection import FaceDetector
+    from models.image_processing import FaceProcessor
+    from models.style_synthesis import StyleSynthesizer
+    from utils.file_manager import FileManager
+
+    face_detector = FaceDetector()
+    _worker.update({
+        'face_detector': face_detector,
+        'face_processor': FaceProcessor(face_detector),
+        'style_synthesizer': StyleSynthesizer(),
+        'file_manager': FileManager(),
+        'styles': styles,
+        'processing_params': processing_params,
+        'output_dir': output_dir,
+        'image_format': image_format
+    })
+
+
+def process_photo(task):
+    """处理一张照片，为每个风格生成一个结果 - 返回写入manifest的记录"""
+    input_path, relative_path = task
+    started_at = time.time()
+    record = {'input': relative_path, 'outputs': []}
+
+    try:
+        from config import Config
+
+        face_image, confidence, ellipse_info = _worker['face_detector'].detect_face(input_path)
+        if face_image is None or confidence < Config.FACE_DETECTION_CONFIDENCE:
+            record.update(status='failed', error='no_face')
+            return record
+
+        processed_face = _worker['face_processor'].process_face(face_image,
+                                                                processing_params=_worker['processing_params'],
+                                                                ellipse_info=ellipse_info)
+
+        stem = os.path.splitext(relative_path)[0]
+        extension = FORMAT_EXTENSIONS[_worker['image_format']]
+        for style in _worker['styles']:
+            result_image = _worker['style_synthesizer'].synthesize_style(processed_face, style)
+            filename = f"{stem}_{style}.{extension}"
+            _worker['file_manager'].save_result_file(result_image, style,
+                                                     result_folder=_worker['output_dir'],
+                                                     filename=filename,
+                                                     image_format=_worker['image_format'])
+            record['outputs'].append(filename)
+
+        record.update(status='ok', confidence=round(float(confidence), 3))
+    except Exception as e:
+        record.update(status='failed', error=f'{type(e).__name__}: {e}')
+    finally:
+        record['seconds'] = round(time.time() - started_at, 3)
+
+    return record
+
+
+def find_photos(input_dir, recursive):
+    """列出输入目录中的照片 - 返回[(绝对路径, 相对路径)]，按相对路径排序"""
+    photos = []
+    if recursive:
+        for root, _, files in os.walk(input_dir):
+            for name in files:
+                if name.lower().endswith(PHOTO_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    photos.append((path, os.path.relpath(path, input_dir)))
+    else:
+        for entry in os.scandir(input_dir):
+            if entry.is_file() and entry.name.lower().endswith(PHOTO_EXTENSIONS):
+                photos.append((entry.path, entry.name))
+    return sorted(photos, key=lambda item: item[1])
+
+
+def load_manifest(manifest_path, retry_failed, settings):
+    """读取以相同设置完成的输入 - 默认成功和失败的都跳过，retry_failed时重试失败的
+
+    设置不同（或没有记录设置）的记录不算完成，这些照片会按当前设置重新生成
+    """
+    completed = set()
+    if not os.path.exists(manifest_path):
+        return completed
+
+    # 与从JSON读回的记录比较
+    settings = json.loads(json.dumps(settings))
+
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 上次中断时可能留下半行
+                continue
+            if record.get('settings') != settings:
+                continue
+            if record.get('status') == 'ok':
+                completed.add(record['input'])
+            elif record.get('status') == 'failed' and not retry_failed:
+                completed.add(record['input'])
+            elif record.get('status') == 'failed':
+                completed.discard(record['input'])
+    return completed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='离线批量生成表情包')
+    parser.add_argument('input_dir', help='照片目录')
+    parser.add_argument('output_dir', help='输出目录')
+    parser.add_argument('--style', action='append', dest='styles', help='风格名称，可重复指定，默认panda')
+    parser.add_argument('--format', default='png', choices=sorted(FORMAT_EXTENSIONS), help='输出格式')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='工作进程数')
+    parser.add_argument('--recursive', action='store_true', help='递归处理子目录')
+    parser.add_argument('--manifest', help='完成记录文件，默认 <output_dir>/manifest.jsonl')
+    parser.add_argument('--retry-failed', action='store_true', help='重试manifest中失败的照片')
+    parser.add_argument('--brighten', type=float, help='亮部增强比例 (0-100)')
+    parser.add_argument('--darken', type=float, help='暗部减弱比例 (0-100)')
+    parser.add_argument('--low-cutoff', type=float, help='暗阈值百分比 (0-100)')
+    parser.add_argument('--high-cutoff', type=float, help='亮阈值百分比 (0-100)')
+    parser.add_argument('--border', type=int, help='边界清理像素数')
+    parser.add_argument('--verbose', action='store_true', help='显示工作进程的详细日志')
+    return parser.parse_args()
+
+
+def build_processing_params(args):
+    """命令行参数覆盖默认处理参数"""
+    from config import Config
+
+    processing_params = Config.DEFAULT_PROCESS_PARAMS.copy()
+    overrides = {
+        'brighten_factor': args.brighten,
+        'darken_factor': args.darken,
+        'low_cutoff_percent': args.low_cutoff,
+        'high_cutoff_percent': args.high_cutoff
+    }
+    for key, value in overrides.items():
+        if value is not None:
+            processing_params[key] = max(0, min(100, value))
+    if args.border is not None:
+        processing_params['border_cleanup_pixels'] = max(0, args.border)
+    return processing_params
+
+
+def main():
+    args = parse_args()
+    styles = args.styles or ['panda']
+    output_dir = os.path.abspath(args.output_dir)
+    manifest_path = args.manifest or os.path.join(output_dir, 'manifest.jsonl')
+    os.makedirs(output_dir, exist_ok=True)
+
+    processing_params = build_processing_params(args)
+    settings = {'styles': styles, 'format': args.format, 'processing_params': processing_params}
+
+    photos = find_photos(args.input_dir, args.recursive)
+    completed = load_manifest(manifest_path, args.retry_failed, settings)
+    tasks = [photo for photo in photos if photo[1] not in completed]
+
+    print(f"📂 共{len(photos)}张照片, 已完成{len(photos) - len(tasks)}张, 待处理{len(tasks)}张")
+    print(f"🎨 风格: {', '.join(styles)}, 格式: {args.format}, 进程数: {args.workers}")
+    if not tasks:
+        return
+
+    stats = Counter()
+    failures = Counter()
+    busy_seconds = 0.0
+    started_at = time.time()
+
+    initargs = (styles, processing_params, output_dir, args.format, args.verbose)
+    with Pool(processes=max(1, args.workers), initializer=init_worker, initargs=initargs) as pool, \
+            open(manifest_path, 'a', encoding='utf-8') as manifest:
+        for index, record in enumerate(pool.imap_unordered(process_photo, tasks, chunksize=4), 1):
+            # 只有主进程写manifest，每条记录立即落盘以支持断点续跑
+            record['settings'] = settings
+            manifest.write(json.dumps(record, ensure_ascii=False) + '\n')
+            manifest.flush()
+
+            stats[record['status']] += 1
+            busy_seconds += record['seconds']
+            if record['status'] != 'ok':
+                failures[record['error'].split(':')[0]] += 1
+
+            if index % 50 == 0 or index == len(tasks):
+                elapsed = time.time() - started_at
+                print(f"⏱️ {index}/{len(tasks)} 完成, {index / elapsed:.1f}张/秒, "
+                      f"成功{stats['ok']}, 失败{stats['failed']}")
+
+    elapsed = time.time() - started_at
+    processed = stats['ok'] + stats['failed']
+    print(f"\n📊 批量生成完成: 用时{elapsed:.1f}秒")
+    print(f"   吞吐量: {processed / elapsed:.2f}张/秒, {stats['ok'] * len(styles) / elapsed:.2f}个表情/秒")
+    print(f"   平均单张耗时: {busy_seconds / max(processed, 1):.3f}秒 (进程内)")
+    print(f"   成功{stats['ok']}张, 失败{stats['failed']}张")
+    for reason, count in failures.most_common():
+        print(f"   ❌ {reason}: {count}")
+
+
+if __name__ == '__main__':
+    main()
@@ -34,6 +34,7 @@ class Config:
     # Flask静态文件夹路径
     STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
     STYLES_FOLDER = os.path.join(STATIC_FOLDER, 'styles')  # 图片模板在这里
+    THUMBNAILS_FOLDER = os.path.join(STYLES_FOLDER, 'thumbnails')  # 模板缩略图
 
     # 临时文件夹 - 根据你的要求，uploads和results在temp文件夹里
     TEMP_FOLDER = os.path.join(BASE_DIR, 'temp')
@@ -41,7 +42,7 @@ class Config:
     RESULT_FOLDER = os.path.join(TEMP_FOLDER, 'results')  # 生成结果
 
     # 创建必要的目录
-    for folder in [UPLOAD_FOLDER, RESULT_FOLDER, STYLES_FOLDER]:
+    for folder in [UPLOAD_FOLDER, RESULT_FOLDER, STYLES_FOLDER, THUMBNAILS_FOLDER]:
         os.makedirs(folder, exist_ok=True)
         print(f"  📁 确保目录存在: {folder}")
 
@@ -52,13 +53,68 @@ class Config:
         'dragon': 'dragon_template.png'
     }
 
+    # 自定义模板注册表（SQLite）
+    TEMPLATE_DB_PATH = os.path.join(STYLES_FOLDER, 'custom_templates.db')
+    CUSTOM_TEMPLATES_JSON = os.path.join(STYLES_FOLDER, 'custom_templates.json')  # 旧版配置，仅用于一次性迁移
+    CUSTOM_TEMPLATES_PAGE_SIZE = 50  # /get_custom_templates 每页数量
+
+    # 自定义模板上传规范化
+    TEMPLATE_MAX_SIDE = 1024  # 模板最长边上限，超出则等比缩小
+    TEMPLATE_MAX_INPUT_PIXELS = 40_000_000  # 解码前按文件头检查的像素上限
+    TEMPLATE_THUMBNAIL_SIZE = 128  # 画廊缩略图最长边
+    TEMPLATE_THUMBNAIL_MAX_AGE = 60  # 缩略图和模板列表的缓存秒数，过期后带 If-None-Match 重新验证
+
+    # 共享模板图集 - 解码后的模板写入内存映射文件，多个工作进程共享只读页面
+    TEMPLATE_ATLAS_ENABLED = True
+    TEMPLATE_ATLAS_FOLDER = os.path.join(TEMP_FOLDER, 'atlas')
+
     # 其他配置
-    ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif'}
+    ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp'}
     MAX_CONTENT_LENGTH = 5 * 1024 * 1024
 
+    # 浏览器端上传预处理 - 由首页下发给 main.js，在Web Worker中摆正方向、缩小并重新编码
+    CLIENT_UPLOAD = {
+        'enabled': True,
+        'max_side': 1600,  # 上传前缩小到的最长边（人脸最终只保留 MAX_FACE_SIZE）
+        'format': 'image/jpeg',  # image/jpeg 或 image/webp
+        'quality': 0.9,
+        'skip_below_bytes': 300 * 1024,  # 尺寸未超限且小于该大小的文件直接上传原图
+        'timeout_ms': 15000,  # 预处理超时后上传原图
+        'max_source_bytes': 25 * 1024 * 1024  # 可在浏览器端缩小时允许选择的原图大小
+    }
+
     # 人脸检测相关配置 - 修复人脸过大的问题
     FACE_DETECTION_CONFIDENCE = 0.3
     MAX_FACE_SIZE = 256  # 减小最大尺寸，防止人脸过大
+    MAX_FACES_PER_PHOTO = 10  # 多人脸模式下每张照片最多生成的表情数
+
+    # 级联检测参数 - 可用 tune_detector.py 在标注图片集上评估速度和召回率后调整
+    FACE_DETECTION_PARAMS = {
+        'primary': {'scale_factor': 1.1, 'min_neighbors': 5, 'min_size': (60, 60)},
+        'relaxed': {'scale_factor': 1.05, 'min_neighbors': 3, 'min_size': (40, 40)},  # 未检测到人脸时放宽重试
+        'eye': {'scale_factor': 1.1, 'min_neighbors': 5, 'min_size': (20, 20)},
+        'nose': {'scale_factor': 1.1, 'min_neighbors': 5, 'min_size': None},
+        'mouth': {'scale_factor': 1.1, 'min_neighbors': 15, 'min_size': (30, 15)},
+        'working_side': 0  # 人脸框检测前把灰度图缩小到的最长边，0为不缩小（五官检测仍用原图）
+    }
+
+    # 放宽重试前的预筛 - 没有人脸的图片跳过耗时的放宽参数检测
+    # min_neighbors 越低、skin_min_ratio 越低越保守（召回优先），调高可让更多无人脸图片快速失败
+    FACE_PRESCREEN = {
+        'enabled': True,
+        'side': 320,  # 预筛分辨率（最长边）
+        'scale_factor': 1.1,
+        'min_neighbors': 1,
+        'skin_min_ratio': 0.02  # 肤色像素比例下限
+    }
+
+    # 近重复图片索引 - 感知哈希(dHash)命中时复用人脸位置，跳过级联检测
+    PERCEPTUAL_HASH = {
+        'enabled': True,
+        'max_distance': 6,  # 64位哈希允许的最大汉明距离
+        'max_entries': 10000,  # 每个进程最多保存的记录数
+        'aspect_tolerance': 0.02  # 宽高比相对误差上限，超出视为裁剪过的不同图片
+    }
 
     IMAGE_ENHANCE_PARAMS = {
         'brightness': 1.1,  # 亮度
@@ -87,6 +143,175 @@ class Config:
         'fallback_size': (512, 512)
     }
 
+    # 表情包配字 - 字体按字号、字形按字符、排版按文字缓存
+    CAPTION = {
+        'enabled': True,
+        # 按顺序取第一个存在的字体；static/fonts/caption.ttf 随仓库提供（Noto Sans CJK SC子集，见同目录OFL.txt）
+        'font_paths': [
+            os.path.join(STATIC_FOLDER, 'fonts', 'caption.ttf'),
+            'C:/Windows/Fonts/msyhbd.ttc',
+            'C:/Windows/Fonts/msyh.ttc',
+            '/System/Library/Fonts/PingFang.ttc',
+            '/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc',
+            '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+            '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc'
+        ],
+        'max_length': 40,  # 配字最多字符数
+        'default_size': 36,
+        'min_size': 12,
+        'max_size': 120,
+        'max_stroke_width': 8,
+        'default_stroke_width': 2,
+        'max_lines': 2,  # 超出时缩小字号
+        'margin': 0.04,  # 距图像边缘（短边比例）
+        'fill_color': (0, 0, 0),
+        'stroke_color': (255, 255, 255),
+        'font_cache_size': 16,
+        'glyph_cache_size': 4096,
+        'layout_cache_size': 256
+    }
+
+    # 帧间人脸跟踪 - 动图和视频流共用
+    FACE_TRACKING = {
+        'keyframe_interval': 10,  # 每隔多少帧做一次完整级联检测
+        'search_margin': 0.3,  # 搜索窗口相对人脸尺寸的外扩比例
+        'match_threshold': 0.6  # 模板匹配最低相关系数，低于则重新检测
+    }
+
+    # 动图表情配置
+    ANIMATION = {
+        'max_frames': 300,  # 最多处理的帧数
+        'default_duration': 100,  # 源帧缺少时长信息时的默认值(ms)
+        'output_format': 'gif'  # gif(逐帧增量编码) 或 webp
+    }
+
+    # 多尺寸输出 - /generate 的 sizes 参数（最长边像素），由同一张合成图逐级缩小得到
+    OUTPUT_SIZES = {
+        'max_count': 6,  # 一次请求最多的尺寸数
+        'max_side': 1024,  # 尺寸上限（不会放大超过合成图本身）
+        'encode_workers': 4  # 并行编码线程数
+    }
+
+    # 贴纸包导出 - 聊天软件要求512x512的WebP贴纸和96x96托盘图标，且有大小限制
+    STICKER_PACK = {
+        'size': 512,
+        'tray_size': 96,
+        'max_bytes': 100 * 1024,  # 单张贴纸字节上限
+        'tray_max_bytes': 50 * 1024,
+        'min_quality': 10,  # WebP质量搜索范围
+        'max_quality': 95,
+        'budget_slack': 0.1,  # 结果占满预算90%以上时提前结束搜索
+        'method': 4,  # WebP编码速度/压缩率权衡 (0-6)
+        'min_content_scale': 0.5,  # 最低质量仍超出预算时缩小画布内容重试，缩到该比例仍超出则拒绝导出
+        'max_styles': 30  # 一个包最多包含的贴纸数
+    }
+
+    # 实时表情流（WebSocket /stream）配置
+    STREAM = {
+        'output_format': 'jpeg',  # 返回帧格式: jpeg / png / webp
+        'jpeg_quality': 80,
+        'max_frame_bytes': 2 * 1024 * 1024,  # 单帧最大字节数
+        'stats_interval': 30,  # 每处理多少帧推送一次统计信息
+        'idle_timeout': 30  # 多少秒没有新帧则关闭会话
+    }
+
+    # 请求级性能分析 - /generate?profile=<token> 或请求头 X-Emoji-Profile: <token>
+    PROFILING = {
+        'allow_on_demand': False,  # 是否允许单个请求开启分析
+        'token': '',  # 非空时按需分析必须提供相同的令牌
+        'sample_every': 0,  # 每N个请求采样一次写入分析目录，0为关闭
+        'interval': 0.002,  # 采样间隔(秒)
+        'output_folder': os.path.join(TEMP_FOLDER, 'profiles'),
+        'max_files': 200  # 分析目录最多保留的文件数
+    }
+
+    # 内存预算 - 解码前从文件头读取图片尺寸
+    MEMORY_BUDGET = {
+        'max_pixels': 50_000_000,  # 像素数上限，超过直接拒绝
+        'request_bytes': 192 * 1024 * 1024,  # 单请求整图处理阶段的内存预算，超过则缩小解码
+        'bytes_per_pixel': 8,  # 整图阶段每像素估算开销: BGR解码3 + 灰度1 + 均衡化1 + 临时副本
+        'trace_allocations': False  # 用tracemalloc按阶段统计峰值内存（开销较大且请求串行执行，仅用于诊断）
+    }
+
+    # ASGI异步服务模式（asgi_app.py）
+    ASGI = {
+        'cpu_workers': os.cpu_count() or 1,  # 检测/处理/合成线程数（另加调度队列长度的排队线程，并发由SCHEDULER控制）
+        'max_streams': 32  # 同时进行的 /stream 实时流会话数
+    }
+
+    # 生成请求调度 - 同时执行的任务数上限，排队时按成本和客户端公平排序
+    SCHEDULER = {
+        'max_running': os.cpu_count() or 1,
+        'max_queue': 64,  # 等待队列上限，超出返回503
+        'aging_seconds': 5,  # 普通任务等待超过该时间后与交互式任务同等优先
+        'recent_uploads': 256,  # 记录最近上传内容摘要的数量（重复上传成本打折）
+        'costs': {
+            'base': 0.2,  # 每个任务的固定开销（模板加载、编码等）
+            'multi_face': 1.5,  # 多人脸模式每百万像素的成本倍数
+            'per_style': 0.3,
+            'per_size': 0.05,
+            'animated': 8.0,  # 动图按帧数较多估算
+            'repeat_discount': 0.3  # 重复上传时人脸索引和模板缓存大概率命中
+        }
+    }
+
+    # 共享缓存 - 生成结果和人脸位置，多节点部署时使用redis或tiered让各节点共享
+    CACHE = {
+        'backend': 'memory',  # memory / filesystem / redis / tiered（本地LRU在前，l2_backend在后）
+        'l2_backend': 'redis',
+        'l1_ttl': 60,  # 两级模式下本地缓存的有效期(秒)
+        'result_ttl': 600,  # 生成结果
+        'face_ttl': 24 * 3600,  # 上传内容对应的人脸位置
+        'max_value_bytes': 16 * 1024 * 1024,  # 单个值上限，超出不缓存
+        'memory': {
+            'max_bytes': 256 * 1024 * 1024,
+            'max_entries': 10000
+        },
+        'filesystem': {
+            'folder': os.path.join(TEMP_FOLDER, 'cache'),
+            'max_bytes': 2 * 1024 * 1024 * 1024
+        },
+        'redis': {
+            'host': '127.0.0.1',
+            'port': 6379,
+            'db': 0,
+            'password': '',
+            'prefix': 'emoji_master:',
+            'socket_timeout': 0.5,
+            'retry_seconds': 5  # 连接失败后暂停重试的时间，期间按未命中处理
+        }
+    }
+
+    # 临时文件定期清理 - 上传和结果目录按时间和总大小淘汰
+    TEMP_JANITOR = {
+        'enabled': True,
+        'interval': 600,  # 清理周期(秒)
+        'max_age_hours': 24,
+        'quota_bytes': 2 * 1024 * 1024 * 1024,  # 超出时从最旧的文件开始删除
+        'min_age_seconds': 300,  # 最近写入的文件可能仍在处理中，不删除
+        'folders': [UPLOAD_FOLDER, RESULT_FOLDER],
+        'lock_path': os.path.join(TEMP_FOLDER, '.janitor.lock')  # 多个工作进程之间互斥
+    }
+
+    # 静态资源指纹和预压缩 - 启动时生成，/assets/ 下的地址带内容哈希，可长期缓存
+    STATIC_ASSETS = {
+        'enabled': True,
+        'files': ['css/style.css', 'js/main.js', 'js/upload_worker.js'],  # 相对 STATIC_FOLDER
+        'output_folder': os.path.join(TEMP_FOLDER, 'assets'),
+        'max_age': 365 * 24 * 3600,
+        'gzip_level': 9,
+        'brotli_quality': 11,  # 需要安装 brotli
+        'min_compress_bytes': 1024  # 小于该大小的文件不生成压缩版本
+    }
+
+    # 进程池处理模式 - 单人脸生成在独立进程中完成，图像经共享内存slab传递（不经过pickle）
+    PROCESS_PIPELINE = {
+        'enabled': False,
+        'workers': os.cpu_count() or 1,
+        'slab_count': 2 * (os.cpu_count() or 1),  # 预先创建的slab数，即同时在途的请求上限
+        'slab_bytes': 32 * 1024 * 1024  # 每个slab容纳解码后的上传图片和合成结果
+    }
+
     # 服务器配置
     HOST = '0.0.0.0'
     PORT = 5000
@@ -0,0 +1,90 @@
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
+from config import Config
+from models.face_tracking import FaceTracker
+from utils.animation_writer import create_animation_writer
+
+
+class AnimatedEmojiGenerator:
+    """动图表情生成 - 逐帧流式处理GIF：关键帧检测+帧间跟踪，合成后增量编码输出"""
+
+    def __init__(self, face_detector, face_processor, style_synthesizer):
+        self.face_detector = face_detector
+        self.face_processor = face_processor
+        self.style_synthesizer = style_synthesizer
+        self.animation_config = Config.ANIMATION
+        self.memory_budget = face_detector.memory_budget
+
+    @staticmethod
+    def is_animated(image_path):
+        """检查文件是否为多帧动图"""
+        try:
+            with Image.open(str(image_path)) as image:
+                return getattr(image, 'is_animated', False)
+        except Exception:
+            return False
+
+    def generate(self, image_path, style_name, processing_params, fp, output_format=None, cancel_token=None,
+                 caption=None):
+        """生成动图表情并写入fp - 返回统计信息，没有任何一帧检测到人脸时返回None
+
+        cancel_token 在每帧之间检查，请求取消后停止解码剩余帧；caption 为每帧的配字
+        """
+        output_format = output_format or self.animation_config['output_format']
+        writer = create_animation_writer(fp, output_format)
+        tracker = FaceTracker(self.face_detector)
+
+        print(f"🎞️ 开始生成动图表情: {image_path} -> {output_format}")
+        for composite, duration in self.iter_emoji_frames(image_path, style_name, processing_params, tracker,
+                                                          caption):
+            if cancel_token is not None:
+                cancel_token.check()
+            writer.add_frame(composite, duration)
+
+        if writer.frame_count == 0:
+            print("❌ 动图中未检测到清晰人脸")
+            return None
+
+        writer.close()
+        stats = dict(tracker.stats, output_frames=writer.frame_count, format=output_format)
+        print(f"✅ 动图表情生成完成: {stats}")
+        return stats
+
+    def iter_source_frames(self, image_path):
+        """逐帧解码动图 - 生成(BGR数组, 帧时长ms)，同一时间只解码一帧"""
+        max_frames = self.animation_config['max_frames']
+        default_duration = self.animation_config['default_duration']
+
+        with Image.open(str(image_path)) as image:
+            for index, frame in enumerate(ImageSequence.Iterator(image)):
+                if index >= max_frames:
+                    print(f"⚠️ 动图帧数超过上限，只处理前{max_frames}帧")
+                    break
+                duration = frame.info.get('duration') or default_duration
+                rgb = np.asarray(self.memory_budget.reduce_frame(frame.convert('RGB')))
+                yield cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), duration
+
+    def iter_emoji_frames(self, image_path, style_name, processing_params, tracker, caption=None):
+        """逐帧生成合成结果 - 生成(合成图像, 帧时长ms)
+
+        某帧丢失人脸时沿用上一张处理好的人脸；开头没有人脸的帧时长并入第一张有效帧。
+        """
+        last_face = None
+        pending_duration = 0
+
+        for frame, duration in self.iter_source_frames(image_path):
+            face_image, confidence, ellipse_info = tracker.process_frame(frame)
+
+            if face_image is not None:
+                last_face = self.face_processor.process_face(face_image,
+                                                             processing_params=processing_params,
+                                                             ellipse_info=ellipse_info)
+            elif last_face is None:
+                pending_duration += duration
+                continue
+
+            # 模板和放置布局由StyleSynthesizer缓存，逐帧只做人脸区域混合；配字的排版和字形也只在第一帧生成
+            composite = self.style_synthesizer.synthesize_style(last_face, style_name, caption)
+            yield composite, duration + pending_duration
+            pending_duration = 0
@@ -0,0 +1,229 @@
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+from config import Config
+
+
+class CaptionRenderer:
+    """表情包配字 - 把文字（带描边）绘制到合成结果上
+
+    三级缓存，同一段配字重复生成（动图逐帧、调参重新生成、贴纸包多风格）时只做贴图：
+    1. 字体：每个字号的 ImageFont 只加载一次
+    2. 字形：每个 (字号, 描边宽度, 字符) 的填充和描边蒙版只光栅化一次，中文配字里重复的字很多
+    3. 排版：每个 (文字, 字号, 描边宽度, 最大宽度) 的换行和字符位置只计算一次
+    逐字放置，字距取字体的前进宽度，不处理连字和字偶距调整。
+    字体缺少的字符会画成方框，调用方先用 missing_glyphs 检查。
+    """
+
+    # 字符覆盖检查使用的字号和一个任何字体都不会收录的码位（渲染结果即 .notdef 字形）
+    PROBE_SIZE = 32
+    NOTDEF_PROBE = '\uffff'
+
+    def __init__(self, caption_config=None):
+        self.caption_config = caption_config or Config.CAPTION
+        self.font_path = self._find_font()
+        self._fonts = OrderedDict()
+        self._glyphs = OrderedDict()
+        self._layouts = OrderedDict()
+        # 字符 -> 字体是否收录
+        self._coverage = {}
+        self._notdef = None
+        self._lock = threading.Lock()
+        self.stats = {'glyph_hits': 0, 'glyph_misses': 0, 'layout_hits': 0, 'layout_misses': 0}
+
+    def render(self, image, caption):
+        """绘制配字并返回结果 - RGBA图像原地修改；caption 为 {'text', 'position', 'size', 'stroke_width'}"""
+        text = caption['text']
+        margin = int(min(image.size) * self.caption_config['margin'])
+        max_width = max(1, image.width - 2 * margin)
+        layout = self._layout(text, caption['size'], caption['stroke_width'], max_width)
+
+        left = (image.width - layout['width']) // 2
+        if caption['position'] == 'top':
+            top = margin
+        elif caption['position'] == 'center':
+            top = (image.height - layout['height']) // 2
+        else:
+            top = image.height - margin - layout['height']
+
+        fill_mask = Image.new('L', (layout['width'], layout['height']))
+        stroke_mask = Image.new('L', (layout['width'], layout['height'])) if caption['stroke_width'] else None
+        for char, x, y in layout['glyphs']:
+            glyph = self._glyph(char, layout['size'], caption['stroke_width'])
+            if glyph is None:
+                continue
+            fill, stroke, (offset_x, offset_y) = glyph
+            box = (x + offset_x, y + offset_y)
+            self._merge(fill_mask, fill, box)
+            if stroke_mask is not None:
+                self._merge(stroke_mask, stroke, box)
+
+        result = image if image.mode == 'RGBA' else image.convert('RGBA')
+        if stroke_mask is not None:
+            result.alpha_composite(self._solid(self.caption_config['stroke_color'], stroke_mask), dest=(left, top))
+        result.alpha_composite(self._solid(self.caption_config['fill_color'], fill_mask), dest=(left, top))
+        return result
+
+    def missing_glyphs(self, text):
+        """字体中没有字形的字符（去重，保持出现顺序），空白字符不检查"""
+        missing = []
+        for char in dict.fromkeys(text):
+            if char.isspace():
+                continue
+            covered = self._coverage.get(char)
+            if covered is None:
+                covered = self._render_probe(char) != self._notdef_probe()
+                with self._lock:
+                    if len(self._coverage) >= self.caption_config['glyph_cache_size']:
+                        self._coverage.clear()
+                    self._coverage[char] = covered
+            if not covered:
+                missing.append(char)
+        return missing
+
+    def _notdef_probe(self):
+        if self._notdef is None:
+            self._notdef = self._render_probe(self.NOTDEF_PROBE)
+        return self._notdef
+
+    def _render_probe(self, char):
+        mask = self._font(self.PROBE_SIZE).getmask(char)
+        return mask.size, bytes(mask)
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, fonts=len(self._fonts), glyphs=len(self._glyphs), layouts=len(self._layouts))
+
+    def _find_font(self):
+        """配置的候选字体中第一个存在的（默认为仓库自带的 static/fonts/caption.ttf），
+        都不存在时使用Pillow内置字体，此时中文配字会被 missing_glyphs 拒绝"""
+        for path in self.caption_config['font_paths']:
+            if os.path.exists(path):
+                print(f"🔤 配字字体: {path}")
+                return path
+        print("⚠️ 未找到配字字体，使用Pillow内置字体，中文配字会被拒绝")
+        return None
+
+    def _font(self, size):
+        with self._lock:
+            font = self._fonts.get(size)
+            if font is not None:
+                self._fonts.move_to_end(size)
+                return font
+
+        try:
+            if self.font_path is not None:
+                font = ImageFont.truetype(self.font_path, size)
+            else:
+                font = ImageFont.load_default(size)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 字体加载失败，使用内置字体: {e}")
+            font = ImageFont.load_default()
+
+        with self._lock:
+            self._fonts[size] = font
+            while len(self._fonts) > self.caption_config['font_cache_size']:
+                self._fonts.popitem(last=False)
+        return font
+
+    def _glyph(self, char, size, stroke_width):
+        """单个字符的(填充蒙版, 描边蒙版, 相对笔位的偏移)，空白字符返回None"""
+        key = (size, stroke_width, char)
+        with self._lock:
+            glyph = self._glyphs.get(key, False)
+            if glyph is not False:
+                self._glyphs.move_to_end(key)
+                self.stats['glyph_hits'] += 1
+                return glyph
+            self.stats['glyph_misses'] += 1
+
+        font = self._font(size)
+        left, top, right, bottom = font.getbbox(char, stroke_width=stroke_width)
+        glyph = None
+        if right > left and bottom > top and not char.isspace():
+            fill = Image.new('L', (right - left, bottom - top))
+            ImageDraw.Draw(fill).text((-left, -top), char, font=font, fill=255)
+            stroke = None
+            if stroke_width:
+                stroke = Image.new('L', fill.size)
+                ImageDraw.Draw(stroke).text((-left, -top), char, font=font, fill=255,
+                                            stroke_width=stroke_width, stroke_fill=255)
+            glyph = (fill, stroke, (left, top))
+
+        with self._lock:
+            self._glyphs[key] = glyph
+            while len(self._glyphs) > self.caption_config['glyph_cache_size']:
+                self._glyphs.popitem(last=False)
+        return glyph
+
+    def _layout(self, text, size, stroke_width, max_width):
+        """换行并计算每个字符的笔位 - 超过 max_lines 行时逐步缩小字号"""
+        key = (text, size, stroke_width, max_width)
+        with self._lock:
+            layout = self._layouts.get(key)
+            if layout is not None:
+                self._layouts.move_to_end(key)
+                self.stats['layout_hits'] += 1
+                return layout
+            self.stats['layout_misses'] += 1
+
+        min_size = self.caption_config['min_size']
+        while True:
+            font = self._font(size)
+            lines = self._wrap(text, font, max_width - 2 * stroke_width)
+            if len(lines) <= self.caption_config['max_lines'] or size <= min_size:
+                break
+            size = max(min_size, int(size * 0.85))
+        lines = lines[:self.caption_config['max_lines']]
+
+        ascent, descent = font.getmetrics()
+        line_height = ascent + descent + 2 * stroke_width
+        width = min(max_width, max(line_width for _, line_width in lines) + 2 * stroke_width)
+        glyphs = []
+        for index, (line, line_width) in enumerate(lines):
+            x = stroke_width + max(0, (width - 2 * stroke_width - line_width) // 2)
+            y = stroke_width + index * line_height
+            for char in line:
+                glyphs.append((char, int(round(x)), y))
+                x += font.getlength(char)
+
+        layout = {'size': size, 'width': max(1, int(width)), 'height': line_height * len(lines), 'glyphs': glyphs}
+        with self._lock:
+            self._layouts[key] = layout
+            while len(self._layouts) > self.caption_config['layout_cache_size']:
+                self._layouts.popitem(last=False)
+        return layout
+
+    @staticmethod
+    def _wrap(text, font, max_width):
+        """按宽度换行 - 返回[(行文字, 行宽)]；中文逐字断行，英文优先在空格处断行"""
+        lines = []
+        for paragraph in text.split('\n'):
+            line = ''
+            for char in paragraph:
+                candidate = line + char
+                if line and font.getlength(candidate) > max_width:
+                    space = line.rfind(' ')
+                    if space > 0 and not char.isspace():
+                        lines.append(line[:space])
+                        line = line[space + 1:] + char
+                    else:
+                        lines.append(line.rstrip())
+                        line = char.lstrip()
+                else:
+                    line = candidate
+            lines.append(line)
+        return [(line, int(round(font.getlength(line)))) for line in lines]
+
+    @staticmethod
+    def _merge(mask, glyph, box):
+        """取最大值合并，相邻字符的描边重叠时不会互相覆盖"""
+        region = (box[0], box[1], box[0] + glyph.width, box[1] + glyph.height)
+        mask.paste(ImageChops.lighter(mask.crop(region), glyph), region[:2])
+
+    @staticmethod
+    def _solid(color, mask):
+        layer = Image.new('RGBA', mask.size, tuple(color[:3]) + (255,))
+        layer.putalpha(mask)
+        return layer
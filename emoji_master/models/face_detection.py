@@ -2,13 +2,29 @@ import cv2
 import numpy as np
 from PIL import Image
 import os
+import json
 from config import Config
+from utils.perceptual_hash import FaceHashIndex
+from utils.profiling import profiled_stage
+from utils.memory_budget import MemoryBudget, ImageTooLargeError
 
 
 class FaceDetector:
     """人脸检测模块 - 基于椭圆裁剪的可靠版本"""
 
-    def __init__(self):
+    def __init__(self, face_index=None, memory_budget=None, detection_params=None, face_cache=None):
+        # 近重复图片索引（可选），命中时跳过级联检测
+        self.face_index = face_index
+        # 共享缓存（可选）- 按上传内容摘要保存人脸位置，多节点之间共享
+        self.face_cache = face_cache
+        # 按文件头尺寸决定是否缩小解码
+        self.memory_budget = memory_budget or MemoryBudget()
+        # 级联检测参数，默认取 Config.FACE_DETECTION_PARAMS
+        self.detection_params = detection_params or Config.FACE_DETECTION_PARAMS
+        # 各检测路径的次数统计
+        self.detection_stats = {'primary_hits': 0, 'relaxed_runs': 0, 'relaxed_hits': 0,
+                                'prescreen_passed': 0, 'prescreen_skipped': 0}
+
         # 加载基础人脸检测器
         self.face_cascade = cv2.CascadeClassifier(
             cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
@@ -49,40 +65,83 @@ class FaceDetector:
             else:
                 print(f"⚠️ {name}检测器不可用，将使用估算位置: {filename}")
 
-    def detect_face(self, image_path):
-        """主检测方法 - 返回人脸图像、置信度和椭圆信息"""
+    @profiled_stage('face_detection')
+    def detect_face(self, image_path, cache_key=None):
+        """主检测方法 - 返回人脸图像、置信度和椭圆信息；cache_key 为上传内容摘要时先查共享缓存"""
         try:
             print(f"🔍 开始人脸检测: {image_path}")
 
-            # 读取图像
-            image = cv2.imread(str(image_path))
+            # 读取图像（超过内存预算时缩小解码）
+            image = self.memory_budget.load_bgr(image_path)
             if image is None:
                 print("❌ 无法读取图像")
                 return None, 0, None
 
-            # 转换为灰度图
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-            # 图像增强
-            gray = cv2.equalizeHist(gray)
+            return self.detect_face_image(image, cache_key)
 
-            # 首先检测人脸区域
-            faces = self.face_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.1,
-                minNeighbors=5,
-                minSize=(60, 60)  # 适当的最小尺寸
-            )
+        except ImageTooLargeError:
+            # 由调用方返回给客户端
+            raise
+        except Exception as e:
+            print(f"❌ 人脸检测过程中出错: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return None, 0, None
 
-            if len(faces) == 0:
-                print("❌ 未检测到人脸，尝试放宽参数...")
-                # 尝试放宽参数
-                faces = self.face_cascade.detectMultiScale(
-                    gray,
-                    scaleFactor=1.05,
-                    minNeighbors=3,
-                    minSize=(40, 40)
-                )
+    def detect_face_image(self, image, cache_key=None):
+        """对已解码的BGR图像检测，先查共享缓存和近重复图片索引 - 返回值与detect_face相同"""
+        use_cache = cache_key is not None and self.face_cache is not None
+        if use_cache:
+            cached = self._lookup_face_cache(image, cache_key)
+            if cached is not None:
+                return cached
+
+        face_image, confidence, ellipse_info = self._detect_with_index(image)
+        if use_cache and face_image is not None:
+            record = {'shape': list(image.shape[:2]), 'rect': [int(v) for v in ellipse_info['face_rect']],
+                      'confidence': float(confidence)}
+            self.face_cache.set(f'face:{cache_key}', json.dumps(record).encode('utf-8'), Config.CACHE['face_ttl'])
+        return face_image, confidence, ellipse_info
+
+    def _lookup_face_cache(self, image, cache_key):
+        """共享缓存中同一上传内容的人脸位置 - 解码尺寸一致时直接裁剪，否则返回None"""
+        data = self.face_cache.get(f'face:{cache_key}')
+        if data is None:
+            return None
+        record = json.loads(data)
+        if tuple(record['shape']) != image.shape[:2]:
+            return None
+        face_image, ellipse_info = self.crop_face(image, record['rect'])
+        if face_image is None:
+            return None
+        print(f"🎯 复用缓存的人脸位置: {record['rect']}, 置信度{record['confidence']:.3f}")
+        return face_image, record['confidence'], ellipse_info
+
+    def _detect_with_index(self, image):
+        """先查近重复图片索引，未命中时做级联检测"""
+        if self.face_index is None:
+            return self.detect_face_array(image)
+
+        # 近重复图片（重新压缩、截图）直接复用之前的人脸位置，只重新裁剪
+        raw_gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        hash_value, record = self.face_index.lookup(raw_gray)
+        if record is not None:
+            face_rect = FaceHashIndex.scale_rect(record, image.shape)
+            face_image, ellipse_info = self.crop_face(image, face_rect)
+            if face_image is not None:
+                print(f"🎯 复用人脸检测结果: 位置{face_rect}, 置信度{record['confidence']:.3f}")
+                return face_image, record['confidence'], ellipse_info
+
+        face_image, confidence, ellipse_info = self.detect_face_array(image)
+        if face_image is not None:
+            self.face_index.add(hash_value, raw_gray.shape, ellipse_info['face_rect'], confidence)
+        return face_image, confidence, ellipse_info
+
+    def detect_face_array(self, image):
+        """对已解码的BGR图像做人脸检测 - 返回值与detect_face相同"""
+        try:
+            gray = self._prepare_gray(image)
+            faces = self._detect_face_rects(gray, image)
 
             if len(faces) == 0:
                 print("❌ 最终未检测到人脸")
@@ -90,41 +149,7 @@ class FaceDetector:
 
             # 选择最大的人脸
             faces = sorted(faces, key=lambda rect: rect[2] * rect[3], reverse=True)
-            x, y, w, h = faces[0]
-            print(f"✅ 检测到人脸: 位置({x},{y}), 尺寸({w}x{h})")
-
-            # 在人脸区域内检测五官
-            face_roi_gray = gray[y:y + h, x:x + w]
-
-            # 检测各个面部特征
-            features = self._detect_all_features(face_roi_gray, x, y, w, h)
-
-            # 计算整体置信度
-            confidence = self._calculate_confidence(features, w * h, image.shape[0] * image.shape[1])
-
-            # 获取椭圆裁剪的人脸区域
-            face_region, ellipse_info = self._get_ellipse_face_region_with_info(image, (x, y, w, h), features)
-
-            if face_region is None:
-                print("❌ 椭圆裁剪失败，使用矩形裁剪")
-                face_region = image[y:y + h, x:x + w]
-                # 创建默认椭圆信息
-                center_x = x + w // 2
-                center_y = y + h // 2
-                ellipse_width = int(w * 0.9)
-                ellipse_height = int(h * 0.8)
-                ellipse_info = {
-                    'center': (center_x, center_y),
-                    'size': (ellipse_width, ellipse_height),
-                    'image_size': image.shape[:2],
-                    'face_rect': (x, y, w, h)
-                }
-
-            # 转换为PIL图像
-            face_pil = Image.fromarray(cv2.cvtColor(face_region, cv2.COLOR_BGR2RGB))
-
-            # 调整大小
-            face_resized = self._resize_face_image(face_pil, ellipse_info)
+            face_resized, confidence, ellipse_info = self._extract_face(image, gray, faces[0])
 
             print(f"🎯 人脸检测完成: 尺寸{face_resized.size}, 置信度{confidence:.3f}")
             return face_resized, confidence, ellipse_info
@@ -135,6 +160,191 @@ class FaceDetector:
             traceback.print_exc()
             return None, 0, None
 
+    def crop_face(self, image, face_rect):
+        """按已知人脸矩形直接裁剪（跳过级联检测和五官检测）- 返回(人脸图像, 椭圆信息)"""
+        x, y, w, h = [int(v) for v in face_rect]
+        face_region, ellipse_info = self._get_ellipse_face_region_with_info(image, (x, y, w, h), None)
+        if face_region is None:
+            return None, None
+
+        face_pil = Image.fromarray(cv2.cvtColor(face_region, cv2.COLOR_BGR2RGB))
+        return self._resize_face_image(face_pil, ellipse_info), ellipse_info
+
+    @profiled_stage('face_detection')
+    def detect_faces(self, image_path, min_confidence=None, max_faces=None):
+        """多人脸检测 - 灰度转换、直方图均衡和级联检测每张照片只做一次
+
+        返回按人脸面积从大到小排列的 [(人脸图像, 置信度, 椭圆信息), ...]，
+        只包含置信度不低于 min_confidence 的人脸
+        """
+        if min_confidence is None:
+            min_confidence = Config.FACE_DETECTION_CONFIDENCE
+        if max_faces is None:
+            max_faces = Config.MAX_FACES_PER_PHOTO
+
+        try:
+            print(f"🔍 开始多人脸检测: {image_path}")
+
+            image = self.memory_budget.load_bgr(image_path)
+            if image is None:
+                print("❌ 无法读取图像")
+                return []
+
+            gray = self._prepare_gray(image)
+            faces = self._detect_face_rects(gray, image)
+
+            if len(faces) == 0:
+                print("❌ 最终未检测到人脸")
+                return []
+
+            faces = sorted(faces, key=lambda rect: rect[2] * rect[3], reverse=True)
+
+            results = []
+            for face_rect in faces:
+                if len(results) >= max_faces:
+                    break
+                try:
+                    face_resized, confidence, ellipse_info = self._extract_face(image, gray, face_rect)
+                except Exception as e:
+                    print(f"⚠️ 人脸提取失败 {tuple(face_rect)}: {e}")
+                    continue
+                if confidence >= min_confidence:
+                    results.append((face_resized, confidence, ellipse_info))
+
+            print(f"🎯 多人脸检测完成: 共{len(faces)}个候选, 保留{len(results)}个")
+            return results
+
+        except ImageTooLargeError:
+            raise
+        except Exception as e:
+            print(f"❌ 多人脸检测过程中出错: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return []
+
+    def _prepare_gray(self, image):
+        """转换为灰度图并做直方图均衡"""
+        # 转换为灰度图
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        # 图像增强
+        return cv2.equalizeHist(gray)
+
+    def _detect_face_rects(self, gray, image=None):
+        """级联检测人脸区域，未检测到时放宽参数重试
+
+        配置了 working_side 时在缩小的灰度图上检测，人脸框换算回原图坐标；
+        放宽重试前先做低成本预筛，预筛认为没有人脸时直接返回
+        """
+        scale = 1.0
+        working_side = self.detection_params.get('working_side') or 0
+        if working_side and max(gray.shape) > working_side:
+            scale = working_side / max(gray.shape)
+            gray = cv2.resize(gray, (max(1, round(gray.shape[1] * scale)), max(1, round(gray.shape[0] * scale))),
+                              interpolation=cv2.INTER_AREA)
+
+        # 首先检测人脸区域
+        faces = self._run_cascade(self.face_cascade, gray, self.detection_params['primary'], scale)
+
+        if len(faces) == 0 and not self._prescreen(gray, image, scale):
+            print("❌ 未检测到人脸，预筛未发现人脸迹象，跳过放宽参数重试")
+        elif len(faces) == 0:
+            print("❌ 未检测到人脸，尝试放宽参数...")
+            self.detection_stats['relaxed_runs'] += 1
+            # 尝试放宽参数
+            faces = self._run_cascade(self.face_cascade, gray, self.detection_params['relaxed'], scale)
+            if len(faces) > 0:
+                self.detection_stats['relaxed_hits'] += 1
+        else:
+            self.detection_stats['primary_hits'] += 1
+
+        if scale != 1.0 and len(faces) > 0:
+            faces = np.round(np.asarray(faces) / scale).astype(int)
+        return faces
+
+    def _prescreen(self, gray, image, scale):
+        """放宽重试前的预筛 - 返回是否值得运行放宽参数的检测
+
+        两项检查任一通过即运行放宽检测（宁可多跑，不漏人脸）：
+        1. 在缩小到 side 的灰度图上用更低的 minNeighbors 检测，有候选框即通过
+        2. 彩色图中肤色像素（YCrCb）比例达到 skin_min_ratio 即通过，
+           覆盖缩小后人脸小于检测窗口的情况
+        图片本身不大于 side 时预筛省不了多少时间，直接通过
+        """
+        prescreen = Config.FACE_PRESCREEN
+        if not prescreen['enabled'] or max(gray.shape) <= prescreen['side']:
+            return True
+
+        tiny_scale = prescreen['side'] / max(gray.shape)
+        tiny = cv2.resize(gray, (max(1, round(gray.shape[1] * tiny_scale)), max(1, round(gray.shape[0] * tiny_scale))),
+                          interpolation=cv2.INTER_AREA)
+        params = dict(self.detection_params['relaxed'], scale_factor=prescreen['scale_factor'],
+                      min_neighbors=prescreen['min_neighbors'])
+        passed = len(self._run_cascade(self.face_cascade, tiny, params, scale * tiny_scale)) > 0
+
+        if not passed and image is not None:
+            passed = self._skin_ratio(image, prescreen['side']) >= prescreen['skin_min_ratio']
+
+        self.detection_stats['prescreen_passed' if passed else 'prescreen_skipped'] += 1
+        return passed
+
+    @staticmethod
+    def _skin_ratio(image, side):
+        """肤色像素比例 - 在缩小的图上按YCrCb经典阈值统计"""
+        small_scale = min(1.0, side / max(image.shape[:2]))
+        small = cv2.resize(image, (max(1, round(image.shape[1] * small_scale)),
+                                   max(1, round(image.shape[0] * small_scale))), interpolation=cv2.INTER_AREA)
+        ycrcb = cv2.cvtColor(small, cv2.COLOR_BGR2YCrCb)
+        mask = cv2.inRange(ycrcb, (0, 133, 77), (255, 173, 127))
+        return cv2.countNonZero(mask) / mask.size
+
+    @staticmethod
+    def _run_cascade(cascade, gray, params, scale=1.0):
+        """按参数字典运行级联检测 - min_size 以原图像素计，缩小检测时同比换算"""
+        kwargs = {'scaleFactor': params['scale_factor'], 'minNeighbors': params['min_neighbors']}
+        if params.get('min_size'):
+            kwargs['minSize'] = tuple(max(1, round(v * scale)) for v in params['min_size'])
+        return cascade.detectMultiScale(gray, **kwargs)
+
+    def _extract_face(self, image, gray, face_rect):
+        """根据人脸矩形检测五官、计算置信度并裁剪缩放 - 返回(人脸图像, 置信度, 椭圆信息)"""
+        x, y, w, h = face_rect
+        print(f"✅ 检测到人脸: 位置({x},{y}), 尺寸({w}x{h})")
+
+        # 在人脸区域内检测五官
+        face_roi_gray = gray[y:y + h, x:x + w]
+
+        # 检测各个面部特征
+        features = self._detect_all_features(face_roi_gray, x, y, w, h)
+
+        # 计算整体置信度
+        confidence = self._calculate_confidence(features, w * h, image.shape[0] * image.shape[1])
+
+        # 获取椭圆裁剪的人脸区域
+        face_region, ellipse_info = self._get_ellipse_face_region_with_info(image, (x, y, w, h), features)
+
+        if face_region is None:
+            print("❌ 椭圆裁剪失败，使用矩形裁剪")
+            face_region = image[y:y + h, x:x + w]
+            # 创建默认椭圆信息
+            center_x = x + w // 2
+            center_y = y + h // 2
+            ellipse_width = int(w * 0.9)
+            ellipse_height = int(h * 0.8)
+            ellipse_info = {
+                'center': (center_x, center_y),
+                'size': (ellipse_width, ellipse_height),
+                'image_size': image.shape[:2],
+                'face_rect': (x, y, w, h)
+            }
+
+        # 转换为PIL图像
+        face_pil = Image.fromarray(cv2.cvtColor(face_region, cv2.COLOR_BGR2RGB))
+
+        # 调整大小
+        face_resized = self._resize_face_image(face_pil, ellipse_info)
+        return face_resized, confidence, ellipse_info
+
     def _detect_all_features(self, face_gray, face_x, face_y, face_w, face_h):
         """检测所有可用的面部特征"""
         features = {
@@ -145,12 +355,7 @@ class FaceDetector:
 
         # 检测眼睛（通常最可靠）
         try:
-            eyes = self.eye_cascade.detectMultiScale(
-                face_gray,
-                scaleFactor=1.1,
-                minNeighbors=5,
-                minSize=(20, 20)
-            )
+            eyes = self._run_cascade(self.eye_cascade, face_gray, self.detection_params['eye'])
             for (ex, ey, ew, eh) in eyes:
                 # 调整到原图坐标
                 abs_x = face_x + ex
@@ -163,11 +368,7 @@ class FaceDetector:
         # 如果鼻子检测器可用则检测鼻子
         if self.nose_cascade is not None:
             try:
-                noses = self.nose_cascade.detectMultiScale(
-                    face_gray,
-                    scaleFactor=1.1,
-                    minNeighbors=5
-                )
+                noses = self._run_cascade(self.nose_cascade, face_gray, self.detection_params['nose'])
                 for (nx, ny, nw, nh) in noses:
                     abs_x = face_x + nx
                     abs_y = face_y + ny
@@ -181,12 +382,7 @@ class FaceDetector:
             try:
                 # 在脸部下半部分检测嘴巴
                 mouth_region = face_gray[int(face_gray.shape[0] * 0.6):, :]
-                mouths = self.mouth_cascade.detectMultiScale(
-                    mouth_region,
-                    scaleFactor=1.1,
-                    minNeighbors=15,
-                    minSize=(30, 15)
-                )
+                mouths = self._run_cascade(self.mouth_cascade, mouth_region, self.detection_params['mouth'])
                 for (mx, my, mw, mh) in mouths:
                     abs_x = face_x + mx
                     abs_y = face_y + int(face_gray.shape[0] * 0.6) + my
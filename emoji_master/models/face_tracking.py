@@ -0,0 +1,88 @@
+import cv2
+from config import Config
+
+
+class FaceTracker:
+    """帧间人脸跟踪 - 关键帧做完整级联检测，中间帧只在上一帧人脸附近的小窗口内模板匹配
+
+    每个视频/动图/连接各自持有一个实例，内部保存上一帧的人脸位置和灰度模板。
+    """
+
+    def __init__(self, face_detector, keyframe_interval=None, search_margin=None, match_threshold=None):
+        tracking_config = Config.FACE_TRACKING
+        self.face_detector = face_detector
+        self.keyframe_interval = keyframe_interval or tracking_config['keyframe_interval']
+        self.search_margin = search_margin if search_margin is not None else tracking_config['search_margin']
+        self.match_threshold = match_threshold if match_threshold is not None else tracking_config['match_threshold']
+        self.reset()
+
+    def reset(self):
+        """清空跟踪状态，下一帧重新做完整检测"""
+        self.face_rect = None
+        self.face_patch = None
+        self.confidence = 0
+        self.frames_since_detection = 0
+        self.stats = {'frames': 0, 'detections': 0, 'tracked': 0, 'lost': 0}
+
+    def process_frame(self, image):
+        """处理一帧BGR图像 - 返回(人脸图像, 置信度, 椭圆信息)，未找到人脸时返回(None, 0, None)"""
+        self.stats['frames'] += 1
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        if self.face_rect is not None and self.frames_since_detection < self.keyframe_interval:
+            face_rect = self._track(gray)
+            if face_rect is not None:
+                face_image, ellipse_info = self.face_detector.crop_face(image, face_rect)
+                if face_image is not None:
+                    self.frames_since_detection += 1
+                    self.stats['tracked'] += 1
+                    return face_image, self.confidence, ellipse_info
+            self.stats['lost'] += 1
+
+        return self._detect(image, gray)
+
+    def _detect(self, image, gray):
+        """关键帧：完整级联检测并更新跟踪模板"""
+        self.stats['detections'] += 1
+        face_image, confidence, ellipse_info = self.face_detector.detect_face_array(image)
+
+        if face_image is None or confidence < Config.FACE_DETECTION_CONFIDENCE:
+            self.face_rect = None
+            self.face_patch = None
+            return None, 0, None
+
+        self._update_template(gray, ellipse_info['face_rect'])
+        self.confidence = confidence
+        self.frames_since_detection = 0
+        return face_image, confidence, ellipse_info
+
+    def _track(self, gray):
+        """在上一帧人脸周围的搜索窗口内做模板匹配，匹配度不足时返回None"""
+        x, y, w, h = self.face_rect
+        margin_x = int(w * self.search_margin)
+        margin_y = int(h * self.search_margin)
+
+        height, width = gray.shape[:2]
+        x1 = max(0, x - margin_x)
+        y1 = max(0, y - margin_y)
+        x2 = min(width, x + w + margin_x)
+        y2 = min(height, y + h + margin_y)
+
+        window = gray[y1:y2, x1:x2]
+        if window.shape[0] < h or window.shape[1] < w:
+            return None
+
+        scores = cv2.matchTemplate(window, self.face_patch, cv2.TM_CCOEFF_NORMED)
+        _, best_score, _, best_loc = cv2.minMaxLoc(scores)
+        if best_score < self.match_threshold:
+            return None
+
+        face_rect = (x1 + best_loc[0], y1 + best_loc[1], w, h)
+        self._update_template(gray, face_rect)
+        return face_rect
+
+    def _update_template(self, gray, face_rect):
+        """保存当前人脸区域作为下一帧的匹配模板"""
+        x, y, w, h = [int(v) for v in face_rect]
+        self.face_rect = (x, y, w, h)
+        self.face_patch = gray[y:y + h, x:x + w].copy()
@@ -1,6 +1,7 @@
 import numpy as np
 from PIL import Image, ImageEnhance
 from config import Config
+from utils.profiling import profiled_stage
 
 
 class FaceProcessor:
@@ -10,6 +11,7 @@ class FaceProcessor:
         self.face_detector = face_detector
         self.enhance_params = Config.IMAGE_ENHANCE_PARAMS
 
+    @profiled_stage('face_processing')
     def process_face(self, face_image, processing_params=None, ellipse_info=None):
         """处理人脸图像 - 完全支持亮暗参数调整"""
         if processing_params is None:
@@ -36,25 +38,7 @@ class FaceProcessor:
                 high_cutoff_percent=processing_params['high_cutoff_percent']
             )
 
-            # 步骤2: 应用完整图像增强
-            enhanced_rgb = self._enhance_image(adjusted_rgb)
-
-            # 步骤3: 转换为黑白表情包风格
-            bw_rgb = self._convert_to_emoji_style(enhanced_rgb)
-
-            # 重新组合RGB和Alpha通道
-            bw_rgba = Image.merge('RGBA', (*bw_rgb.split(), alpha_channel))
-
-            # 步骤4: 应用边界清理
-            border_pixels = processing_params.get('border_cleanup_pixels', 2)
-            if ellipse_info and border_pixels > 0:
-                final_face = self.face_detector.apply_border_cleanup(
-                    bw_rgba, ellipse_info, border_pixels
-                )
-                print(f"✅ 边界清理完成: {border_pixels}像素")
-            else:
-                final_face = bw_rgba
-                print("⚠️ 未进行边界清理")
+            final_face = self._finish_face(adjusted_rgb, alpha_channel, processing_params, ellipse_info)
 
             print(f"✅ 人脸处理完成: 输出尺寸{final_face.size}")
             return final_face
@@ -65,6 +49,107 @@ class FaceProcessor:
             traceback.print_exc()
             return face_image
 
+    @profiled_stage('face_processing')
+    def process_faces(self, face_images, processing_params=None, ellipse_infos=None):
+        """批量处理多张人脸 - 尺寸相同的人脸堆叠后一次完成亮暗调整"""
+        if processing_params is None:
+            processing_params = Config.DEFAULT_PROCESS_PARAMS.copy()
+        if ellipse_infos is None:
+            ellipse_infos = [None] * len(face_images)
+
+        results = [None] * len(face_images)
+
+        # 按尺寸分组，同组人脸可以堆叠成一个数组处理
+        buckets = {}
+        for index, face_image in enumerate(face_images):
+            buckets.setdefault(face_image.size, []).append(index)
+
+        for size, indices in buckets.items():
+            if len(indices) == 1:
+                index = indices[0]
+                results[index] = self.process_face(face_images[index], processing_params, ellipse_infos[index])
+                continue
+
+            try:
+                print(f"🎨 批量处理人脸: {len(indices)}张, 尺寸{size}")
+                rgba_faces = [face_images[i].convert('RGBA') if face_images[i].mode != 'RGBA'
+                              else face_images[i] for i in indices]
+                stacked = np.stack([np.asarray(face.convert('RGB')) for face in rgba_faces])
+
+                adjusted = self._batch_brightness_adjustment(
+                    stacked,
+                    brighten_factor=processing_params['brighten_factor'],
+                    darken_factor=processing_params['darken_factor'],
+                    low_cutoff_percent=processing_params['low_cutoff_percent'],
+                    high_cutoff_percent=processing_params['high_cutoff_percent']
+                )
+
+                for batch_index, index in enumerate(indices):
+                    results[index] = self._finish_face(
+                        Image.fromarray(adjusted[batch_index]),
+                        rgba_faces[batch_index].getchannel('A'),
+                        processing_params,
+                        ellipse_infos[index]
+                    )
+            except Exception as e:
+                print(f"⚠️ 批量处理失败，逐张处理: {e}")
+                for index in indices:
+                    results[index] = self.process_face(face_images[index], processing_params, ellipse_infos[index])
+
+        print(f"✅ 批量人脸处理完成: {len(results)}张")
+        return results
+
+    def _finish_face(self, adjusted_rgb, alpha_channel, processing_params, ellipse_info):
+        """亮暗调整之后的处理步骤：增强、黑白化、合并透明通道和边界清理"""
+        # 步骤2: 应用完整图像增强
+        enhanced_rgb = self._enhance_image(adjusted_rgb)
+
+        # 步骤3: 转换为黑白表情包风格
+        bw_rgb = self._convert_to_emoji_style(enhanced_rgb)
+
+        # 重新组合RGB和Alpha通道
+        bw_rgba = Image.merge('RGBA', (*bw_rgb.split(), alpha_channel))
+
+        # 步骤4: 应用边界清理
+        border_pixels = processing_params.get('border_cleanup_pixels', 2)
+        if ellipse_info and border_pixels > 0:
+            final_face = self.face_detector.apply_border_cleanup(
+                bw_rgba, ellipse_info, border_pixels
+            )
+            print(f"✅ 边界清理完成: {border_pixels}像素")
+        else:
+            final_face = bw_rgba
+            print("⚠️ 未进行边界清理")
+
+        return final_face
+
+    def _batch_brightness_adjustment(self, images, low_cutoff_percent=30, high_cutoff_percent=20,
+                                     darken_factor=50, brighten_factor=50):
+        """批量亮暗调整 - images为(N, H, W, 3) uint8，与_new_brightness_adjustment逐张结果一致"""
+        img_array = images.astype(np.float32)
+
+        # 每张图各自的灰度和阈值
+        gray = np.mean(img_array, axis=3)
+        flat_gray = gray.reshape(len(images), -1)
+        dark_threshold = np.percentile(flat_gray, low_cutoff_percent, axis=1)[:, None, None]
+        bright_threshold = np.percentile(flat_gray, 100 - high_cutoff_percent, axis=1)[:, None, None]
+
+        dark_mask = (gray <= dark_threshold)[..., None]
+        bright_mask = (gray >= bright_threshold)[..., None]
+
+        darken_factor_dec = darken_factor / 100.0
+        brighten_factor_dec = brighten_factor / 100.0
+
+        # 暗部：暗参数 × (像素值 - 0)；亮部：亮参数 × (255 - 像素值)，重叠像素以亮部为准
+        darkened = np.clip(img_array - img_array * darken_factor_dec, 0, 255)
+        brightened = np.clip(img_array + (255 - img_array) * brighten_factor_dec, 0, 255)
+
+        result = np.where(dark_mask, darkened, img_array)
+        result = np.where(bright_mask, brightened, result)
+
+        print(f"📊 批量亮暗调整完成: {len(images)}张")
+        return np.clip(result, 0, 255).astype(np.uint8)
+
     def _new_brightness_adjustment(self, image, low_cutoff_percent=30, high_cutoff_percent=20,
                                    darken_factor=50, brighten_factor=50):
         """新的亮暗调整算法：按公式调整像素值"""
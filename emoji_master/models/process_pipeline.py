@@ -0,0 +1,150 @@
+import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from config import Config
+from utils.shared_slabs import SlabPool, attach_shared_memory, SlabView
+from utils.profiling import profile_stage
+from utils.single_flight import RequestCancelled
+from utils.cache_backend import create_cache
+
+# 工作进程内的模块实例，由 init_worker 初始化
+_worker = {}
+# 工作进程内已映射的slab: 名称 -> SlabView（池中的slab长期复用，只映射一次）
+_attached = {}
+
+
+def init_worker():
+    """工作进程初始化 - 每个进程只加载一次级联分类器和模板"""
+    import cv2
+    # 多进程并行时避免OpenCV内部线程超额订阅
+    cv2.setNumThreads(1)
+
+    from models.face_detection import FaceDetector
+    from models.image_processing import FaceProcessor
+    from models.style_synthesis import StyleSynthesizer
+    from utils.template_registry import TemplateRegistry
+    from utils.template_store import TemplateStore
+    from utils.perceptual_hash import FaceHashIndex
+
+    # 模板注册表基于SQLite，图集为共享映射文件，主进程中新增的模板在这里同样可见
+    template_registry = TemplateRegistry()
+    template_store = TemplateStore(template_registry) if Config.TEMPLATE_ATLAS_ENABLED else None
+    face_detector = FaceDetector(FaceHashIndex() if Config.PERCEPTUAL_HASH['enabled'] else None,
+                                 face_cache=create_cache())
+    _worker.update({
+        'face_detector': face_detector,
+        'face_processor': FaceProcessor(face_detector),
+        'style_synthesizer': StyleSynthesizer(template_registry, template_store)
+    })
+
+
+def _attach(name, pooled):
+    if not pooled:
+        return SlabView(attach_shared_memory(name))
+    if name not in _attached:
+        _attached[name] = SlabView(attach_shared_memory(name))
+    return _attached[name]
+
+
+def render_task(descriptor, pooled, style, processing_params, cache_key=None, caption=None):
+    """工作进程任务 - 从slab读取上传图片，检测、处理、合成后把RGBA结果写回同一slab
+
+    只返回小的描述符；slab剩余空间放不下结果时退回到直接返回数组
+    """
+    slab = _attach(descriptor['slab'], pooled)
+    image = slab.array(descriptor)
+    try:
+        face_image, confidence, ellipse_info = _worker['face_detector'].detect_face_image(image, cache_key)
+        if face_image is None or confidence < Config.FACE_DETECTION_CONFIDENCE:
+            return {'result': None, 'confidence': confidence}
+
+        processed_face = _worker['face_processor'].process_face(face_image,
+                                                                processing_params=processing_params,
+                                                                ellipse_info=ellipse_info)
+        result_image = _worker['style_synthesizer'].synthesize_style(processed_face, style, caption)
+        result = np.asarray(result_image.convert('RGBA'))
+
+        result_descriptor = slab.write(result, slab.end_of(descriptor))
+        if result_descriptor is None:
+            print(f"⚠️ slab剩余空间不足，结果经pickle返回: {result.shape}")
+            return {'array': result, 'confidence': confidence}
+        return {'result': result_descriptor, 'confidence': confidence}
+
+    finally:
+        del image
+        if not pooled:
+            try:
+                slab.shm.close()
+            except BufferError:
+                pass
+
+
+class ProcessPipeline:
+    """进程池处理 - 单人脸的检测、处理和合成在独立进程中完成，绕开GIL
+
+    上传图片在服务进程解码后写入共享内存slab，进程间只传递slab名称、偏移、形状和类型；
+    合成结果写回同一slab，服务进程直接基于slab内存构造图像并编码。
+    slab在请求结束后归还到池中，请求被取消时等工作进程处理完才归还。
+    """
+
+    def __init__(self, memory_budget, pipeline_config=None):
+        self.pipeline_config = pipeline_config or Config.PROCESS_PIPELINE
+        self.memory_budget = memory_budget
+        self.pool = SlabPool(self.pipeline_config['slab_count'], self.pipeline_config['slab_bytes'])
+        self.executor = ProcessPoolExecutor(max_workers=self.pipeline_config['workers'], initializer=init_worker)
+        # 为合成结果预留的空间（模板最长边不超过 TEMPLATE_MAX_SIDE）
+        self.result_reserve = Config.TEMPLATE_MAX_SIDE * Config.TEMPLATE_MAX_SIDE * 4
+        print(f"✅ 进程池处理模式: {self.pipeline_config['workers']}个工作进程")
+
+    @contextmanager
+    def render(self, upload_path, style, processing_params, cancel_token, cache_key=None, caption=None):
+        """with pipeline.render(...) as (result_image, confidence): ...
+
+        result_image 直接引用slab内存，只在with块内有效；未检测到人脸时为None
+        """
+        cancel_token.check()
+        image = self.memory_budget.load_bgr(upload_path)
+        if image is None:
+            print("❌ 无法读取图像")
+            yield None, 0
+            return
+
+        slab = self.pool.acquire(image.nbytes + self.result_reserve)
+        handed_off = False
+        try:
+            descriptor = slab.write(image)
+            del image
+            future = self.executor.submit(render_task, descriptor, self.pool.is_pooled(slab),
+                                          style, processing_params, cache_key, caption)
+
+            with profile_stage('process_worker'):
+                while True:
+                    try:
+                        outcome = future.result(timeout=0.05)
+                        break
+                    except TimeoutError:
+                        if not cancel_token.cancelled:
+                            continue
+                        if not future.cancel():
+                            # 工作进程仍在读写slab，完成后再归还
+                            future.add_done_callback(lambda _: self.pool.release(slab))
+                            handed_off = True
+                        raise RequestCancelled()
+
+            if outcome.get('array') is not None:
+                result_image = Image.fromarray(outcome['array'])
+            elif outcome['result'] is not None:
+                result = slab.array(outcome['result'])
+                result_image = Image.frombuffer('RGBA', (result.shape[1], result.shape[0]), result, 'raw', 'RGBA', 0, 1)
+            else:
+                result_image = None
+            yield result_image, outcome['confidence']
+
+        finally:
+            if not handed_off:
+                self.pool.release(slab)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.pool.close()
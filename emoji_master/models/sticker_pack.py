@@ -0,0 +1,132 @@
+import json
+import zipfile
+from io import BytesIO
+from PIL import Image
+from werkzeug.utils import secure_filename
+from config import Config
+
+
+class StickerPackExporter:
+    """贴纸包导出 - 同一张处理好的人脸合成多个风格，输出符合聊天软件要求的WebP贴纸zip包
+
+    每张贴纸是 size x size 的透明画布，合成结果等比缩放后居中；
+    按字节预算二分查找WebP质量，同一张画布的不同质量编码结果会被复用；
+    最低质量仍超出预算时缩小画布上的内容重试（画布尺寸不变），仍然超出时抛出ValueError。
+    """
+
+    def __init__(self, style_synthesizer, pack_config=None):
+        self.style_synthesizer = style_synthesizer
+        self.pack_config = pack_config or Config.STICKER_PACK
+
+    def export(self, processed_face, styles, fp, pack_name='emoji_master', caption=None):
+        """合成并写入zip包 - 返回包清单（每张贴纸的文件名、字节数和质量），caption 为每张贴纸的配字"""
+        size = self.pack_config['size']
+        tray_size = self.pack_config['tray_size']
+        stickers = []
+
+        with zipfile.ZipFile(fp, 'w', compression=zipfile.ZIP_STORED) as pack:
+            tray_source = None
+            for index, style in enumerate(styles, 1):
+                result_image = self.style_synthesizer.synthesize_style(processed_face, style, caption)
+                canvas = self.fit_canvas(result_image, size)
+                if tray_source is None:
+                    tray_source = canvas
+
+                data, quality = self.encode_under_budget(canvas, self.pack_config['max_bytes'])
+                # 风格名可能含路径分隔符或非ASCII字符，zip条目名只用清理后的名称
+                filename = f"{index:02d}_{secure_filename(style) or 'sticker'}.webp"
+                pack.writestr(filename, data)
+                stickers.append({'file': filename, 'style': style, 'bytes': len(data), 'quality': quality})
+                print(f"🏷️ 贴纸 {filename}: {len(data) / 1024:.1f}KB, 质量{quality}")
+
+            # 托盘图标由第一张贴纸的画布缩小得到，不再重新合成
+            tray_canvas = tray_source.resize((tray_size, tray_size), Image.LANCZOS)
+            tray_data, tray_quality = self.encode_under_budget(tray_canvas, self.pack_config['tray_max_bytes'])
+            pack.writestr('tray.webp', tray_data)
+
+            manifest = {
+                'name': pack_name,
+                'tray': {'file': 'tray.webp', 'bytes': len(tray_data), 'quality': tray_quality},
+                'stickers': stickers
+            }
+            pack.writestr('contents.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+
+        return manifest
+
+    @staticmethod
+    def fit_canvas(image, size):
+        """等比缩放到 size x size 以内并居中放到透明画布上"""
+        image = image.convert('RGBA') if image.mode != 'RGBA' else image
+        scale = size / max(image.size)
+        resized = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                               Image.LANCZOS)
+
+        canvas = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+        canvas.paste(resized, ((size - resized.width) // 2, (size - resized.height) // 2))
+        return canvas
+
+    def encode_under_budget(self, canvas, max_bytes):
+        """在字节预算内取最高的WebP质量 - 返回(数据, 质量)
+
+        最低质量仍超出预算时把内容每次缩小到0.8倍后重试，
+        缩小到 min_content_scale 以下仍超出时抛出ValueError（超出上限的贴纸无法导入聊天软件）
+        """
+        source = canvas
+        content_scale = 1.0
+        while True:
+            result = self._search_quality(canvas, max_bytes)
+            if result is not None:
+                if content_scale < 1:
+                    print(f"📉 贴纸超出预算，内容缩小到{content_scale:.0%}后编码")
+                return result
+
+            content_scale *= 0.8
+            if content_scale < self.pack_config['min_content_scale']:
+                raise ValueError(f"贴纸无法压缩到{max_bytes // 1024}KB以内")
+            canvas = self.shrink_content(source, content_scale)
+
+    def _search_quality(self, canvas, max_bytes):
+        """先试最高质量，放得下直接返回；否则在[min_quality, max_quality)二分查找，
+        找到的结果已经占满预算的 (1 - slack) 以上时提前结束。最低质量仍超出预算时返回None
+        """
+        min_quality = self.pack_config['min_quality']
+        max_quality = self.pack_config['max_quality']
+        slack = self.pack_config['budget_slack']
+        encoded = {}
+
+        def encode(quality):
+            if quality not in encoded:
+                buffered = BytesIO()
+                canvas.save(buffered, format='WEBP', quality=quality, method=self.pack_config['method'])
+                encoded[quality] = buffered.getvalue()
+            return encoded[quality]
+
+        data = encode(max_quality)
+        if len(data) <= max_bytes:
+            return data, max_quality
+
+        best = None
+        low, high = min_quality, max_quality - 1
+        while low <= high:
+            quality = (low + high) // 2
+            data = encode(quality)
+            if len(data) <= max_bytes:
+                best = (data, quality)
+                if len(data) >= max_bytes * (1 - slack):
+                    break
+                low = quality + 1
+            else:
+                high = quality - 1
+
+        if best is None:
+            print(f"⚠️ 最低质量{min_quality}仍超出预算{max_bytes}字节")
+        return best
+
+    @staticmethod
+    def shrink_content(canvas, scale):
+        """画布尺寸不变，内容缩小到 scale 倍后居中"""
+        content = canvas.resize((max(1, round(canvas.width * scale)), max(1, round(canvas.height * scale))),
+                                Image.LANCZOS)
+        shrunk = Image.new('RGBA', canvas.size, (0, 0, 0, 0))
+        shrunk.paste(content, ((canvas.width - content.width) // 2, (canvas.height - content.height) // 2))
+        return shrunk
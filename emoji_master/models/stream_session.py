@@ -0,0 +1,220 @@
+import json
+import time
+import threading
+from io import BytesIO
+import cv2
+import numpy as np
+from PIL import Image
+from config import Config
+from models.face_tracking import FaceTracker
+
+
+class LatestFrameSlot:
+    """只保留最新一帧的缓冲区 - 客户端发送速度超过处理速度时丢弃旧帧"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        with self._condition:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """取出最新一帧 - 连接关闭且没有待处理帧时返回None"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._frame is not None or self._closed, timeout)
+            frame, self._frame = self._frame, None
+            return frame
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class EmojiStreamSession:
+    """实时表情视频流会话 - 每个连接一个实例
+
+    客户端发送JPEG帧（二进制消息）和设置（JSON文本消息），服务端返回合成后的表情帧。
+    会话内保存人脸跟踪状态、当前风格和处理参数；模板由StyleSynthesizer缓存。
+    设置由接收线程更新：每次更新生成新的设置快照整体替换，处理线程每帧开始时读取一次，
+    同一帧内不会混用新旧设置；上一帧的人脸处理结果记录生成时的设置版本，版本变化后不再沿用。
+    """
+
+    def __init__(self, face_detector, face_processor, style_synthesizer, style='panda', processing_params=None):
+        self.face_processor = face_processor
+        self.style_synthesizer = style_synthesizer
+        self.tracker = FaceTracker(face_detector)
+        self.stream_config = Config.STREAM
+
+        self._settings_lock = threading.Lock()
+        self._settings = {
+            'version': 0,
+            'style': style,
+            'processing_params': dict(processing_params or Config.DEFAULT_PROCESS_PARAMS),
+            'output_format': self.stream_config['output_format']
+        }
+
+        # (设置版本, 处理好的人脸) - 只由处理线程读写
+        self._last_face = None
+        self.stats = {'received': 0, 'processed': 0, 'dropped': 0, 'no_face': 0, 'rejected': 0}
+
+    @property
+    def settings(self):
+        """当前设置快照 {'version', 'style', 'processing_params', 'output_format'}，不要修改"""
+        return self._settings
+
+    def update_settings(self, settings):
+        """更新风格、处理参数或输出格式 - 在副本上修改后整体替换，不影响正在处理的帧"""
+        with self._settings_lock:
+            current = self._settings
+            style = current['style']
+            output_format = current['output_format']
+            processing_params = dict(current['processing_params'])
+
+            if 'style' in settings:
+                style = str(settings['style'])
+            if 'format' in settings and settings['format'] in ('jpeg', 'png', 'webp'):
+                output_format = settings['format']
+
+            params = settings.get('params') or {}
+            for key in Config.DEFAULT_PROCESS_PARAMS:
+                if key in params:
+                    value = float(params[key])
+                    if key == 'border_cleanup_pixels':
+                        processing_params[key] = max(0, int(value))
+                    else:
+                        processing_params[key] = max(0, min(100, value))
+
+            # 版本号变化后，旧设置下处理的人脸不再沿用
+            self._settings = {
+                'version': current['version'] + 1,
+                'style': style,
+                'processing_params': processing_params,
+                'output_format': output_format
+            }
+        print(f"🎛️ 流会话设置更新: 风格{style}, 格式{output_format}, 参数{processing_params}")
+
+    def process_frame_bytes(self, data):
+        """处理一帧JPEG数据 - 返回编码后的结果帧，无法生成时返回None"""
+        if len(data) > self.stream_config['max_frame_bytes']:
+            self.stats['rejected'] += 1
+            return None
+
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            self.stats['rejected'] += 1
+            return None
+
+        # 整帧使用同一份设置
+        settings = self._settings
+        composite = self.process_frame(image, settings)
+        return self.encode(composite, settings['output_format']) if composite is not None else None
+
+    def process_frame(self, image, settings=None):
+        """处理一帧BGR图像 - 返回合成图像；丢失人脸时沿用同一设置版本下上一帧的人脸"""
+        settings = settings or self._settings
+        face_image, confidence, ellipse_info = self.tracker.process_frame(image)
+
+        if face_image is not None:
+            face = self.face_processor.process_face(face_image,
+                                                    processing_params=settings['processing_params'],
+                                                    ellipse_info=ellipse_info)
+            self._last_face = (settings['version'], face)
+        elif self._last_face is None or self._last_face[0] != settings['version']:
+            self.stats['no_face'] += 1
+            return None
+
+        self.stats['processed'] += 1
+        return self.style_synthesizer.synthesize_style(self._last_face[1], settings['style'])
+
+    def encode(self, image, output_format=None):
+        """编码结果帧 - JPEG不支持透明，铺白色背景"""
+        output_format = output_format or self._settings['output_format']
+        buffered = BytesIO()
+        if output_format == 'jpeg':
+            if image.mode == 'RGBA':
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            image.save(buffered, format='JPEG', quality=self.stream_config['jpeg_quality'])
+        elif output_format == 'webp':
+            image.save(buffered, format='WEBP', quality=self.stream_config['jpeg_quality'], method=0)
+        else:
+            image.save(buffered, format='PNG', compress_level=1)
+        return buffered.getvalue()
+
+    def get_stats(self):
+        """会话统计信息（含跟踪统计）"""
+        return dict(self.stats, tracking=dict(self.tracker.stats), style=self._settings['style'])
+
+    def serve(self, transport):
+        """驱动一个连接直到关闭
+
+        transport 需要提供 receive() 和 send(data)：receive返回bytes(帧)、str(JSON设置)
+        或None(连接关闭)。接收在独立线程中进行，处理线程总是取最新一帧，过时的帧被丢弃。
+        """
+        slot = LatestFrameSlot()
+        receiver = threading.Thread(target=self._receive_loop, args=(transport, slot), daemon=True)
+        receiver.start()
+
+        stats_interval = self.stream_config['stats_interval']
+        # 上次发送统计时的已处理帧数 - 没有新的处理结果时不重复发送
+        stats_sent_at = 0
+        started_at = time.time()
+        print("📡 流会话开始")
+
+        try:
+            while True:
+                frame = slot.get(timeout=self.stream_config['idle_timeout'])
+                if frame is None:
+                    break
+
+                result = self.process_frame_bytes(frame)
+                if result is not None:
+                    transport.send(result)
+
+                self.stats['dropped'] = slot.dropped
+                processed = self.stats['processed']
+                if processed and processed % stats_interval == 0 and processed != stats_sent_at:
+                    stats_sent_at = processed
+                    transport.send(json.dumps(dict(self.get_stats(), type='stats')))
+        finally:
+            slot.close()
+            elapsed = max(time.time() - started_at, 1e-6)
+            self.stats['dropped'] = slot.dropped
+            print(f"📡 流会话结束: {self.get_stats()}, 平均{self.stats['processed'] / elapsed:.1f}帧/秒")
+
+    def _receive_loop(self, transport, slot):
+        """接收线程：帧放入最新帧缓冲区，文本消息作为设置立即生效"""
+        try:
+            while not slot.closed:
+                message = transport.receive()
+                if message is None:
+                    break
+                if isinstance(message, str):
+                    try:
+                        settings = json.loads(message)
+                        if not isinstance(settings, dict):
+                            print(f"⚠️ 流会话设置必须是JSON对象，已忽略: {message[:100]}")
+                            continue
+                        self.update_settings(settings)
+                    except (ValueError, TypeError) as e:
+                        print(f"⚠️ 无效的流会话设置: {e}")
+                    continue
+                self.stats['received'] += 1
+                slot.put(bytes(message))
+        except Exception as e:
+            print(f"⚠️ 流连接接收结束: {e}")
+        finally:
+            slot.close()
@@ -1,36 +1,51 @@
 import os
-import json
 import numpy as np
 from PIL import Image, ImageDraw
 from config import Config
-from datetime import datetime
 from pathlib import Path
+from utils.template_registry import TemplateRegistry
+from utils.profiling import profiled_stage
+from models.caption_renderer import CaptionRenderer
 
 
 class StyleSynthesizer:
     """风格合成模块 - 支持自定义模板"""
 
-    def __init__(self):
+    def __init__(self, template_registry=None, template_store=None):
         # 将路径转换为Path对象以便使用/运算符
         self.styles_folder = Path(Config.STYLES_FOLDER)  # 转换为Path对象
         self.available_styles = Config.AVAILABLE_STYLES
         self.synthesis_config = Config.STYLE_SYNTHESIS
-        self.custom_templates_file = self.styles_folder / 'custom_templates.json'
-
-    def synthesize_style(self, face_image, style_name):
-        """合成风格表情包 - 支持系统模板和自定义模板"""
+        self.template_registry = template_registry or TemplateRegistry()
+        # 共享模板图集（可选），模板像素直接映射自图集文件
+        self.template_store = template_store
+
+        # 已解码模板缓存: style_name -> {'path', 'mtime', 'atlas_version', 'image', 'layout'}
+        self._template_cache = {}
+        # 配字渲染（字体、字形和排版缓存在多次合成间共享）
+        self.caption_renderer = CaptionRenderer() if Config.CAPTION['enabled'] else None
+
+    @profiled_stage('style_synthesis')
+    def synthesize_style(self, face_image, style_name, caption=None):
+        """合成风格表情包 - 支持系统模板和自定义模板，caption 为配字（见 CaptionRenderer.render）"""
         try:
-            # 获取模板
-            template = self._load_template(style_name)
-            if template is None:
+            # 获取模板（已缓存的解码结果和预计算的放置布局）
+            entry = self._get_template_entry(style_name)
+            if entry is None:
                 print(f"❌ 模板加载失败: {style_name}")
                 return self._create_fallback(face_image, style_name)
 
+            template = entry['image']
+            layout = entry['layout']
+
             # 调整人脸尺寸 - 使用新的尺寸计算方法
-            face_resized = self._resize_face_for_template_new(face_image, template.size)
+            face_resized = self._resize_face_for_template_new(face_image, template.size, layout)
 
-            # 合成图像
-            result = self._blend_images(template, face_resized)
+            # 合成图像 - 只混合人脸所在区域
+            position = self._calculate_face_position(layout, face_resized.size)
+            result = self._blend_images(template, face_resized, position)
+            if caption and self.caption_renderer is not None:
+                result = self.caption_renderer.render(result, caption)
 
             print(f"✅ 风格合成成功: {style_name}")
             return result
@@ -43,59 +58,160 @@ class StyleSynthesizer:
 
     def _load_template(self, style_name):
         """加载风格模板 - 支持系统模板和自定义模板"""
+        entry = self._get_template_entry(style_name)
+        return entry['image'] if entry else None
+
+    def _resolve_template(self, style_name):
+        """解析模板文件路径 - 返回(路径, 自定义模板信息)"""
         # 先检查是否是系统模板
         if style_name in self.available_styles:
             template_filename = self.available_styles[style_name]
-            template_path = self.styles_folder / template_filename
-        else:
-            # 检查是否是自定义模板
-            template_path = self._get_custom_template_path(style_name)
-            if not template_path:
-                print(f"❌ 未找到模板: {style_name}")
-                return None
+            return self.styles_folder / template_filename, None
+
+        # 检查是否是自定义模板
+        info = self._get_custom_template_info(style_name)
+        if not info:
+            return None, None
+        return self.styles_folder / info['filename'], info
+
+    def template_path(self, style_name):
+        """系统或自定义模板的文件路径，未知风格返回None"""
+        template_path, _ = self._resolve_template(style_name)
+        return template_path
+
+    def template_signature(self, style_name):
+        """模板文件名和修改时间 - 用作结果缓存键的一部分，模板替换后旧结果不再命中"""
+        template_path = self.template_path(style_name)
+        if not template_path:
+            return None
+        try:
+            return f'{template_path.name}:{template_path.stat().st_mtime_ns}'
+        except OSError:
+            return None
+
+    def _get_template_entry(self, style_name):
+        """获取缓存的模板及其放置布局，文件变化时重新加载"""
+        template_path, info = self._resolve_template(style_name)
+        if not template_path:
+            print(f"❌ 未找到模板: {style_name}")
+            return None
 
-        if not template_path.exists():
+        try:
+            mtime = template_path.stat().st_mtime
+        except OSError:
             print(f"❌ 模板文件不存在: {template_path}")
+            self._template_cache.pop(style_name, None)
             return None
 
+        if self.template_store is not None:
+            self.template_store.refresh()
+        atlas_version = self.template_store.version if self.template_store is not None else None
+
+        entry = self._template_cache.get(style_name)
+        if (entry and entry['path'] == template_path and entry['mtime'] == mtime
+                and entry['atlas_version'] == atlas_version):
+            return entry
+
         try:
-            template = Image.open(str(template_path))
-            if template.mode != 'RGBA':
-                template = template.convert('RGBA')
-            print(f"✅ 加载模板成功: {style_name} ({template.size})")
-            return template
+            template = self._decode_template(template_path, style_name, mtime)
         except Exception as e:
             print(f"❌ 模板加载失败 {template_path}: {e}")
             return None
 
+        # 上传时已预计算布局的自定义模板直接使用
+        layout = info.get('layout') if info else None
+        if not layout or tuple(layout['template_size']) != template.size:
+            layout = self._compute_template_layout(template.size)
+
+        entry = {
+            'path': template_path,
+            'mtime': mtime,
+            'atlas_version': atlas_version,
+            'image': template,
+            'layout': layout
+        }
+        self._template_cache[style_name] = entry
+        print(f"✅ 加载模板成功: {style_name} ({template.size})")
+        return entry
+
+    def _decode_template(self, template_path, style_name=None, mtime=None):
+        """解码模板 - 优先使用共享图集中的零拷贝视图，其次是预解码文件(.npy)"""
+        if self.template_store is not None and style_name is not None:
+            template = self.template_store.get_image(style_name, template_path, mtime)
+            if template is not None:
+                return template
+
+        raw_path = template_path.with_suffix('.npy')
+        if raw_path.exists():
+            pixels = np.load(str(raw_path))
+            if pixels.ndim == 3 and pixels.shape[2] == 4 and pixels.dtype == np.uint8:
+                return Image.fromarray(pixels, 'RGBA')
+
+        template = Image.open(str(template_path))
+        if template.mode != 'RGBA':
+            template = template.convert('RGBA')
+        # 一次性解码，后续请求只读使用
+        template.load()
+        return template
+
+    def _compute_template_layout(self, template_size):
+        """预计算模板的人脸放置布局（每个模板只计算一次）"""
+        return self.compute_template_layout(template_size)
+
+    @staticmethod
+    def compute_template_layout(template_size):
+        """计算模板的人脸放置布局 - 上传模板时也会调用并保存结果"""
+        synthesis_config = Config.STYLE_SYNTHESIS
+        template_width, template_height = template_size
+
+        # 使用更小的比例，防止人脸过大
+        base_size = int(min(template_width, template_height) * synthesis_config['face_size_ratio'])
+
+        # 限制最大尺寸
+        base_size = min(base_size, Config.MAX_FACE_SIZE)
+
+        # 额外限制：不能超过模板的60%
+        max_template_percent = 0.6
+
+        return {
+            'template_size': (template_width, template_height),
+            'base_size': base_size,
+            'min_size': synthesis_config['min_face_size'],
+            'max_width': int(template_width * max_template_percent),
+            'max_height': int(template_height * max_template_percent)
+        }
+
+    def _calculate_face_position(self, layout, face_size):
+        """根据预计算的布局计算人脸放置位置（居中）"""
+        template_width, template_height = layout['template_size']
+        face_width, face_height = face_size
+
+        # 确保位置有效
+        pos_x = max(0, (template_width - face_width) // 2)
+        pos_y = max(0, (template_height - face_height) // 2)
+        return pos_x, pos_y
+
     def _get_custom_template_path(self, style_name):
         """获取自定义模板路径"""
-        if not self.custom_templates_file.exists():
-            return None
+        info = self._get_custom_template_info(style_name)
+        if info:
+            return self.styles_folder / info['filename']
+        return None
 
+    def _get_custom_template_info(self, style_name):
+        """获取自定义模板信息"""
         try:
-            with open(self.custom_templates_file, 'r', encoding='utf-8') as f:
-                templates = json.load(f)
-
-            if style_name in templates:
-                filename = templates[style_name]['filename']
-                return self.styles_folder / filename
+            return self.template_registry.get(style_name)
         except Exception as e:
             print(f"❌ 读取自定义模板配置失败: {e}")
-
         return None
 
-    def _resize_face_for_template_new(self, face_image, template_size):
+    def _resize_face_for_template_new(self, face_image, template_size, layout=None):
         """新的调整人脸尺寸方法，防止人脸过大"""
-        template_width, template_height = template_size
-
-        # 使用更小的比例，防止人脸过大
-        base_size = int(min(template_width, template_height) * self.synthesis_config['face_size_ratio'])
+        if layout is None:
+            layout = self._compute_template_layout(template_size)
 
-        # 限制最大尺寸
-        max_face_size = Config.MAX_FACE_SIZE
-        if base_size > max_face_size:
-            base_size = max_face_size
+        base_size = layout['base_size']
 
         print(f"📏 基础尺寸计算: 模板{template_size} -> 基础{base_size}")
 
@@ -111,13 +227,12 @@ class StyleSynthesizer:
             new_width = new_height = base_size
 
         # 确保最小尺寸
-        new_width = max(new_width, self.synthesis_config['min_face_size'])
-        new_height = max(new_height, self.synthesis_config['min_face_size'])
+        new_width = max(new_width, layout['min_size'])
+        new_height = max(new_height, layout['min_size'])
 
         # 额外限制：不能超过模板的60%
-        max_template_percent = 0.6
-        new_width = min(new_width, int(template_width * max_template_percent))
-        new_height = min(new_height, int(template_height * max_template_percent))
+        new_width = min(new_width, layout['max_width'])
+        new_height = min(new_height, layout['max_height'])
 
         face_resized = face_image.resize((new_width, new_height), Image.LANCZOS)
 
@@ -132,8 +247,8 @@ class StyleSynthesizer:
         """调整人脸尺寸以适应模板 - 保留旧方法兼容性"""
         return self._resize_face_for_template_new(face_image, template_size)
 
-    def _blend_images(self, template, face_image):
-        """混合模板和人脸图像"""
+    def _blend_images(self, template, face_image, position=None):
+        """混合模板和人脸图像 - 只在人脸矩形区域内混合"""
         try:
             # 确保模板和人脸都是RGBA
             if template.mode != 'RGBA':
@@ -141,26 +256,16 @@ class StyleSynthesizer:
             if face_image.mode != 'RGBA':
                 face_image = face_image.convert('RGBA')
 
-            # 创建新的合成图像
-            result = template.copy()
-
             # 计算放置位置（居中）
-            template_width, template_height = template.size
-            face_width, face_height = face_image.size
-
-            pos_x = (template_width - face_width) // 2
-            pos_y = (template_height - face_height) // 2
-
-            # 确保位置有效
-            pos_x = max(0, pos_x)
-            pos_y = max(0, pos_y)
+            if position is None:
+                layout = self._compute_template_layout(template.size)
+                position = self._calculate_face_position(layout, face_image.size)
 
-            # 创建临时图像用于混合
-            temp_image = Image.new('RGBA', template.size, (0, 0, 0, 0))
-            temp_image.paste(face_image, (pos_x, pos_y))
+            # 缓存的模板只读，结果在副本上修改
+            result = template.copy()
 
-            # Alpha混合
-            result = Image.alpha_composite(result, temp_image)
+            # Alpha混合 - 只处理人脸所在矩形，耗时与人脸尺寸成正比
+            result.alpha_composite(face_image, dest=position)
 
             print("✅ 图像混合成功")
             return result
@@ -206,21 +311,11 @@ class StyleSynthesizer:
             # 保存模板文件（PIL的save方法）
             template_file.save(str(template_path))
 
-            # 更新配置文件
-            templates = {}
-            if self.custom_templates_file.exists():
-                with open(self.custom_templates_file, 'r', encoding='utf-8') as f:
-                    templates = json.load(f)
-
-            templates[style_name] = {
-                'filename': filename,
-                'description': description,
-                'created_at': str(datetime.now()),
-                'type': 'custom'
-            }
-
-            with open(self.custom_templates_file, 'w', encoding='utf-8') as f:
-                json.dump(templates, f, ensure_ascii=False, indent=2)
+            # 写入注册表
+            if not self.template_registry.add(style_name, filename, description):
+                template_path.unlink(missing_ok=True)
+                print(f"❌ 风格名称已存在: {style_name}")
+                return False
 
             print(f"✅ 自定义模板保存成功: {style_name}")
             return True
@@ -231,12 +326,8 @@ class StyleSynthesizer:
 
     def get_custom_templates(self):
         """获取所有自定义模板"""
-        if not self.custom_templates_file.exists():
-            return {}
-
         try:
-            with open(self.custom_templates_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return self.template_registry.get_all()
         except Exception as e:
             print(f"❌ 读取自定义模板失败: {e}")
             return {}
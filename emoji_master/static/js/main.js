@@ -15,8 +15,18 @@ class EmojiMaster {
         this.rotation = 0;
         this.scale = 1;
         this.currentStyle = 'panda'; // 默认选中熊猫风格
+        this.sessionId = this.createRequestId(); // 同一页面的新生成请求会取代旧请求
+        this.activeGenerate = null;
+
+        // 上传预处理（服务端在页面中下发参数），每个文件只处理一次
+        this.uploadConfig = window.EMOJI_UPLOAD_CONFIG || { enabled: false, max_upload_bytes: 5 * 1024 * 1024 };
+        this.uploadWorker = null;
+        this.uploadRequests = new Map();
+        this.uploadRequestSeq = 0;
+        this.preparedUploads = new WeakMap();
 
         this.initializeEventListeners();
+        window.addEventListener('pagehide', () => this.abortGenerateRequest());
         this.loadCustomStyles();
 
         // 初始选择熊猫风格
@@ -127,6 +137,11 @@ class EmojiMaster {
             this.downloadResult();
         });
 
+        // 贴纸包导出按钮
+        document.getElementById('stickerPackBtn')?.addEventListener('click', () => {
+            this.exportStickerPack();
+        });
+
         // 新图片按钮 - 修复：清除所有状态
         newImageBtn.addEventListener('click', () => {
             this.resetToUploadSection();
@@ -172,6 +187,12 @@ class EmojiMaster {
             document.getElementById('highThresholdValue').textContent = this.highCutoffPercent + '%';
         });
 
+        ['captionSize', 'captionStroke'].forEach(name => {
+            document.getElementById(`${name}Slider`).addEventListener('input', (e) => {
+                document.getElementById(`${name}Value`).textContent = e.target.value + 'px';
+            });
+        });
+
         borderCleanupSlider.addEventListener('input', (e) => {
             this.borderCleanupPixels = parseInt(e.target.value);
             document.getElementById('borderCleanupValue').textContent = this.borderCleanupPixels + 'px';
@@ -392,18 +413,22 @@ class EmojiMaster {
     }
 
     validateAndSetFile(file) {
-        const allowedTypes = ['image/jpeg', 'image/jpg', 'image/png', 'image/gif'];
+        const allowedTypes = ['image/jpeg', 'image/jpg', 'image/png', 'image/gif', 'image/webp'];
         if (!allowedTypes.includes(file.type)) {
-            this.showError('请上传 JPG、PNG 或 GIF 格式的图片');
+            this.showError('请上传 JPG、PNG、WebP 或 GIF 格式的图片');
             return;
         }
 
-        if (file.size > 5 * 1024 * 1024) {
-            this.showError('文件大小不能超过 5MB');
+        // 能在浏览器端缩小的照片允许选择更大的原图
+        const maxBytes = this.canPrepareUpload(file) ?
+            this.uploadConfig.max_source_bytes : this.uploadConfig.max_upload_bytes;
+        if (file.size > maxBytes) {
+            this.showError(`文件大小不能超过 ${Math.round(maxBytes / 1024 / 1024)}MB`);
             return;
         }
 
         this.currentFile = file;
+        this.prepareUpload(file); // 提前在后台处理，点击生成时通常已完成
         this.displayFilePreview(file);
         document.getElementById('generateBtn').disabled = false;
         this.showSuccess(`已选择文件: ${file.name}`);
@@ -425,7 +450,7 @@ class EmojiMaster {
                         <span>点击重新选择</span>
                     </div>
                 </div>
-                <input type="file" id="photoInput" accept=".jpg,.jpeg,.png,.gif" hidden>
+                <input type="file" id="photoInput" accept=".jpg,.jpeg,.png,.gif,.webp" hidden>
             `;
 
             const newPhotoInput = uploadArea.querySelector('#photoInput');
@@ -524,38 +549,191 @@ class EmojiMaster {
         this.showLoading('AI正在创作中...');
         this.startLoadingAnimation();
 
+        const photo = await this.uploadWithinLimit(this.currentFile);
+        if (!photo) return;
+
         const formData = new FormData();
-        formData.append('photo', this.currentFile);
+        formData.append('photo', photo);
         formData.append('style', this.getSelectedStyle());
         formData.append('brighten_factor', this.brightenFactor);
         formData.append('darken_factor', this.darkenFactor);
         formData.append('low_cutoff_percent', this.lowCutoffPercent);
         formData.append('high_cutoff_percent', this.highCutoffPercent);
         formData.append('border_cleanup_pixels', this.borderCleanupPixels);
+        this.appendCaption(formData);
 
         try {
             const startTime = Date.now();
-            const response = await fetch('/generate', {
-                method: 'POST',
-                body: formData
-            });
-
-            const result = await response.json();
+            const result = await this.requestGenerate(formData);
             const endTime = Date.now();
             const timeTaken = ((endTime - startTime) / 1000).toFixed(1);
 
             if (result.status === 'success') {
                 this.showResult(result.image, timeTaken);
                 this.showSuccess('表情包生成成功！');
+            } else if (result.status === 'cancelled') {
+                this.showSelectedPhoto();
             } else {
                 this.showError(result.message);
             }
         } catch (error) {
+            if (error.name === 'AbortError') {
+                console.log('⏹️ 旧的生成请求已取消');
+                return;
+            }
             console.error('生成表情包失败:', error);
             this.showError('网络错误，请稍后重试');
         }
     }
 
+    // ====== 上传预处理 ======
+    canPrepareUpload(file) {
+        // GIF保留原文件（动图模式需要全部帧）
+        return Boolean(this.uploadConfig.enabled && window.Worker && window.OffscreenCanvas &&
+            window.createImageBitmap && file.type !== 'image/gif');
+    }
+
+    prepareUpload(file) {
+        // 返回用于上传的文件：缩小重新编码后的照片，或无法处理时的原图
+        if (!this.canPrepareUpload(file)) {
+            return Promise.resolve(file);
+        }
+
+        let prepared = this.preparedUploads.get(file);
+        if (!prepared) {
+            prepared = this.runUploadWorker(file)
+                .then(result => {
+                    if (!result.blob) return file;
+
+                    const extension = result.blob.type === 'image/webp' ? 'webp' : 'jpg';
+                    const baseName = file.name.replace(/\.[^.]+$/, '') || 'photo';
+                    console.log(`📉 上传预处理: ${(file.size / 1024).toFixed(0)}KB -> ` +
+                        `${(result.blob.size / 1024).toFixed(0)}KB, ${result.width}x${result.height}`);
+                    return new File([result.blob], `${baseName}.${extension}`, { type: result.blob.type });
+                })
+                .catch(error => {
+                    console.warn('上传预处理失败，使用原图:', error);
+                    return file;
+                });
+            this.preparedUploads.set(file, prepared);
+        }
+        return prepared;
+    }
+
+    async uploadWithinLimit(file) {
+        // 预处理失败、超时或未缩小时上传的是原图，可能超过服务端上限；超出时提示错误并返回null
+        const upload = await this.prepareUpload(file);
+        const maxBytes = this.uploadConfig.max_upload_bytes;
+        if (upload.size > maxBytes) {
+            this.showError(`文件大小不能超过 ${Math.round(maxBytes / 1024 / 1024)}MB，请压缩后重试`);
+            return null;
+        }
+        return upload;
+    }
+
+    runUploadWorker(file) {
+        if (!this.uploadWorker) {
+            this.uploadWorker = new Worker(this.uploadConfig.worker_url);
+            this.uploadWorker.onmessage = (event) => {
+                const request = this.uploadRequests.get(event.data.id);
+                if (!request) return;
+                this.uploadRequests.delete(event.data.id);
+                clearTimeout(request.timer);
+                if (event.data.error) {
+                    request.reject(new Error(event.data.error));
+                } else {
+                    request.resolve(event.data);
+                }
+            };
+            // 脚本加载失败或消息无法反序列化时不会有回复，等待中的请求全部按失败处理
+            this.uploadWorker.onerror = (event) => {
+                event.preventDefault();
+                this.resetUploadWorker(new Error(event.message || '上传预处理线程出错'));
+            };
+            this.uploadWorker.onmessageerror = () => {
+                this.resetUploadWorker(new Error('上传预处理结果无法读取'));
+            };
+        }
+
+        const id = ++this.uploadRequestSeq;
+        return new Promise((resolve, reject) => {
+            // 解码卡住时工作线程不会再处理后续请求，超时后重建工作线程
+            const timer = setTimeout(() => {
+                this.resetUploadWorker(new Error('上传预处理超时'));
+            }, this.uploadConfig.timeout_ms);
+            this.uploadRequests.set(id, { resolve, reject, timer });
+            this.uploadWorker.postMessage({
+                id,
+                file,
+                maxSide: this.uploadConfig.max_side,
+                type: this.uploadConfig.format,
+                quality: this.uploadConfig.quality,
+                skipBelowBytes: this.uploadConfig.skip_below_bytes
+            });
+        });
+    }
+
+    resetUploadWorker(error) {
+        // 终止工作线程并让等待中的请求失败（调用方改为上传原图），下次预处理时重新创建
+        if (this.uploadWorker) {
+            this.uploadWorker.terminate();
+            this.uploadWorker = null;
+        }
+        const requests = [...this.uploadRequests.values()];
+        this.uploadRequests.clear();
+        requests.forEach(request => {
+            clearTimeout(request.timer);
+            request.reject(error);
+        });
+    }
+
+    // ====== 生成请求管理 ======
+    async requestGenerate(formData) {
+        // 新请求取代尚未完成的旧请求，旧请求的结果不再显示
+        this.abortGenerateRequest();
+
+        const controller = new AbortController();
+        const requestId = this.createRequestId();
+        this.activeGenerate = { controller, requestId };
+
+        formData.append('session_id', this.sessionId);
+        formData.append('request_id', requestId);
+
+        try {
+            const response = await fetch('/generate', {
+                method: 'POST',
+                body: formData,
+                signal: controller.signal
+            });
+            return await response.json();
+        } finally {
+            if (this.activeGenerate && this.activeGenerate.requestId === requestId) {
+                this.activeGenerate = null;
+            }
+        }
+    }
+
+    abortGenerateRequest() {
+        if (!this.activeGenerate) return;
+
+        const { controller, requestId } = this.activeGenerate;
+        this.activeGenerate = null;
+        controller.abort();
+
+        // 服务端感知不到连接中断，显式通知停止处理
+        const payload = new Blob([JSON.stringify({ request_id: requestId })], { type: 'application/json' });
+        if (!navigator.sendBeacon || !navigator.sendBeacon('/cancel_generate', payload)) {
+            fetch('/cancel_generate', { method: 'POST', body: payload, keepalive: true }).catch(() => {});
+        }
+    }
+
+    createRequestId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return Date.now().toString(36) + Math.random().toString(36).slice(2);
+    }
+
     startLoadingAnimation() {
         let progress = 0;
         const steps = ['人脸检测', '图像处理', '风格合成', '完成生成'];
@@ -674,22 +852,44 @@ class EmojiMaster {
     }
 
     // ====== 自定义模板管理方法 ======
-    loadCustomStyles() {
+    appendCaption(formData) {
+        const text = document.getElementById('captionInput').value.trim();
+        if (!text) return;
+        formData.append('caption', text);
+        formData.append('caption_position', document.getElementById('captionPosition').value);
+        formData.append('caption_size', document.getElementById('captionSizeSlider').value);
+        formData.append('caption_stroke', document.getElementById('captionStrokeSlider').value);
+    }
+
+    async loadCustomStyles() {
         console.log('🔄 加载自定义风格...');
-        fetch('/get_custom_templates')
-            .then(response => response.json())
-            .then(data => {
-                if (data.status === 'success') {
-                    this.customStyles = new Map(Object.entries(data.templates));
-                    this.renderCustomStyles();
-                    console.log(`✅ 加载了 ${Object.keys(data.templates).length} 个自定义风格`);
-                } else {
+        try {
+            // 服务端分页返回，逐页加载直到没有更多
+            const templates = new Map();
+            let page = 1;
+            let hasMore = true;
+
+            while (hasMore) {
+                // 每次都向服务端验证，列表未变化时服务端返回304，浏览器使用缓存的内容
+                const response = await fetch(`/get_custom_templates?page=${page}`, { cache: 'no-cache' });
+                const data = await response.json();
+
+                if (data.status !== 'success') {
                     console.warn('⚠️ 加载自定义风格失败:', data.message);
+                    return;
                 }
-            })
-            .catch(error => {
-                console.error('❌ 加载自定义风格失败:', error);
-            });
+
+                Object.entries(data.templates).forEach(([name, info]) => templates.set(name, info));
+                hasMore = Boolean(data.has_more);
+                page += 1;
+            }
+
+            this.customStyles = templates;
+            this.renderCustomStyles();
+            console.log(`✅ 加载了 ${templates.size} 个自定义风格`);
+        } catch (error) {
+            console.error('❌ 加载自定义风格失败:', error);
+        }
     }
 
     renderCustomStyles() {
@@ -710,8 +910,12 @@ class EmojiMaster {
         styleOption.dataset.style = styleName;
         styleOption.title = styleData.description || styleName;
 
+        const icon = styleData.thumbnail_url
+            ? `<img class="style-thumbnail" src="${styleData.thumbnail_url}" alt="" loading="lazy">`
+            : '🎨';
+
         styleOption.innerHTML = `
-            <div class="style-icon">🎨</div>
+            <div class="style-icon">${icon}</div>
             <span>${styleName}</span>
             <div class="style-badge">自定义</div>
             <div class="style-actions">
@@ -1008,34 +1212,44 @@ class EmojiMaster {
 
         this.showLoading('正在重新生成表情包...');
 
+        const photo = await this.uploadWithinLimit(this.originalFile);
+        if (!photo) {
+            this.showResultSection();
+            return;
+        }
+
         const formData = new FormData();
-        formData.append('photo', this.originalFile);
+        formData.append('photo', photo);
         formData.append('style', this.originalStyle);
         formData.append('brighten_factor', this.brightenFactor);
         formData.append('darken_factor', this.darkenFactor);
         formData.append('low_cutoff_percent', this.lowCutoffPercent);
         formData.append('high_cutoff_percent', this.highCutoffPercent);
         formData.append('border_cleanup_pixels', this.borderCleanupPixels);
+        this.appendCaption(formData);
+        // 滑块调参的重新生成对延迟敏感，服务端排队时优先处理
+        formData.append('priority', 'interactive');
 
         try {
             const startTime = Date.now();
-            const response = await fetch('/generate', {
-                method: 'POST',
-                body: formData
-            });
-
-            const result = await response.json();
+            const result = await this.requestGenerate(formData);
             const endTime = Date.now();
             const timeTaken = ((endTime - startTime) / 1000).toFixed(1);
 
             if (result.status === 'success') {
                 this.showResult(result.image, timeTaken);
                 this.showSuccess('表情包已重新生成！');
+            } else if (result.status === 'cancelled') {
+                this.showResultSection();
             } else {
                 this.showError(result.message);
                 this.showResultSection();
             }
         } catch (error) {
+            if (error.name === 'AbortError') {
+                console.log('⏹️ 旧的重新生成请求已取消');
+                return;
+            }
             console.error('重新生成失败:', error);
             this.showError('重新生成失败，请重试');
             this.showResultSection();
@@ -1156,6 +1370,12 @@ class EmojiMaster {
         });
     }
 
+    showSelectedPhoto() {
+        // 回到已选择照片的上传界面（保留预览）
+        this.hideAllSections();
+        document.getElementById('uploadSection').style.display = 'block';
+    }
+
     showResultSection() {
         this.hideAllSections();
         const resultSection = document.getElementById('resultSection');
@@ -1176,6 +1396,58 @@ class EmojiMaster {
         this.showSuccess('表情包下载成功！');
     }
 
+    async exportStickerPack() {
+        if (!this.originalFile) {
+            this.showError('没有找到原始图片，请重新上传');
+            return;
+        }
+
+        // 当前风格排在第一张（托盘图标取自第一张），其余为全部系统和自定义风格
+        const styles = [this.originalStyle, 'panda', 'mushroom', 'dragon', ...this.customStyles.keys()]
+            .filter((style, index, all) => style && all.indexOf(style) === index);
+
+        const photo = await this.uploadWithinLimit(this.originalFile);
+        if (!photo) return;
+
+        const formData = new FormData();
+        formData.append('photo', photo);
+        formData.append('styles', styles.join(','));
+        formData.append('session_id', this.sessionId);
+        formData.append('brighten_factor', this.brightenFactor);
+        formData.append('darken_factor', this.darkenFactor);
+        formData.append('low_cutoff_percent', this.lowCutoffPercent);
+        formData.append('high_cutoff_percent', this.highCutoffPercent);
+        formData.append('border_cleanup_pixels', this.borderCleanupPixels);
+        this.appendCaption(formData);
+
+        try {
+            this.showSuccess('正在生成贴纸包...');
+            const response = await fetch('/export_sticker_pack', {
+                method: 'POST',
+                body: formData
+            });
+
+            if (!response.ok) {
+                const result = await response.json();
+                this.showError(result.message || '贴纸包导出失败');
+                return;
+            }
+
+            const url = URL.createObjectURL(await response.blob());
+            const link = document.createElement('a');
+            link.href = url;
+            link.download = `贴纸包_${new Date().getTime()}.zip`;
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+            URL.revokeObjectURL(url);
+            this.showSuccess('贴纸包导出成功！');
+        } catch (error) {
+            console.error('贴纸包导出失败:', error);
+            this.showError('贴纸包导出失败，请重试');
+        }
+    }
+
     closeImageViewer() {
         document.getElementById('imageViewer').style.display = 'none';
     }
@@ -0,0 +1,45 @@
+// 上传预处理工作线程 - 解码照片、按EXIF方向摆正、缩小到服务端下发的最长边并重新编码
+// 不阻塞页面主线程；返回 blob 为 null 时表示直接上传原图
+
+self.onmessage = async (event) => {
+    const { id, file, maxSide, type, quality, skipBelowBytes } = event.data;
+
+    try {
+        // imageOrientation: 'from-image' 按EXIF方向旋转，重新编码后的图片不再依赖EXIF
+        const bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+        const scale = Math.min(1, maxSide / Math.max(bitmap.width, bitmap.height));
+
+        if (scale === 1 && file.size <= skipBelowBytes) {
+            bitmap.close();
+            self.postMessage({ id, blob: null });
+            return;
+        }
+
+        const width = Math.max(1, Math.round(bitmap.width * scale));
+        const height = Math.max(1, Math.round(bitmap.height * scale));
+        const canvas = new OffscreenCanvas(width, height);
+        const ctx = canvas.getContext('2d');
+        ctx.imageSmoothingEnabled = true;
+        ctx.imageSmoothingQuality = 'high';
+
+        // JPEG没有透明通道，透明区域铺白色背景（与服务端JPEG输出一致）
+        if (type === 'image/jpeg') {
+            ctx.fillStyle = '#ffffff';
+            ctx.fillRect(0, 0, width, height);
+        }
+        ctx.drawImage(bitmap, 0, 0, width, height);
+        bitmap.close();
+
+        const blob = await canvas.convertToBlob({ type, quality });
+
+        // 没有缩小且重新编码后更大时沿用原图
+        if (scale === 1 && blob.size >= file.size) {
+            self.postMessage({ id, blob: null });
+            return;
+        }
+
+        self.postMessage({ id, blob, width, height });
+    } catch (error) {
+        self.postMessage({ id, blob: null, error: String(error) });
+    }
+};
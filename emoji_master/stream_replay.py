@@ -0,0 +1,190 @@
+'''
+实时表情流回放工具 - 将目录中的图片帧按指定帧率回放
+
+本地模式（默认）：不启动服务器，直接用 EmojiStreamSession.serve 处理，与 /stream 接口走同一条流程
+    python stream_replay.py frames/ --fps 15 --style panda --output out/
+    python stream_replay.py frames/ --fps 0 --output out/   # 逐帧处理，不丢帧
+
+远程模式：连接正在运行的服务器 /stream 接口（需要 simple-websocket）
+    python stream_replay.py frames/ --url ws://127.0.0.1:5000/stream
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+FRAME_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def list_frames(frames_dir):
+    """按文件名顺序列出帧文件"""
+    names = sorted(name for name in os.listdir(frames_dir) if name.lower().endswith(FRAME_EXTENSIONS))
+    return [os.path.join(frames_dir, name) for name in names]
+
+
+def read_frame(path):
+    """读取帧文件，非JPEG的帧重新编码为JPEG（与浏览器发送的数据一致）"""
+    if path.lower().endswith(('.jpg', '.jpeg')):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    import cv2
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    ok, encoded = cv2.imencode('.jpg', image)
+    return encoded.tobytes() if ok else None
+
+
+class ReplayTransport:
+    """按帧率回放的本地传输层 - 提供与WebSocket相同的receive/send接口"""
+
+    def __init__(self, frame_paths, fps, settings, output_dir=None):
+        self.frame_paths = frame_paths
+        self.interval = 1.0 / fps if fps > 0 else 0
+        self.settings = settings
+        self.output_dir = output_dir
+        self.sent_settings = False
+        self.index = 0
+        self.next_time = time.time()
+        self.results = 0
+        self.stats_messages = []
+
+    def receive(self):
+        if not self.sent_settings:
+            self.sent_settings = True
+            return json.dumps(self.settings)
+
+        while self.index < len(self.frame_paths):
+            # 按帧率节流，模拟摄像头实时发送
+            delay = self.next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_time += self.interval
+
+            data = read_frame(self.frame_paths[self.index])
+            self.index += 1
+            if data is not None:
+                return data
+        return None
+
+    def send(self, data):
+        if isinstance(data, str):
+            self.stats_messages.append(json.loads(data))
+            return
+
+        self.results += 1
+        if self.output_dir:
+            extension = self.settings.get('format', 'jpeg')
+            path = os.path.join(self.output_dir, f'emoji_{self.results:05d}.{extension}')
+            with open(path, 'wb') as f:
+                f.write(data)
+
+
+def replay_local(frame_paths, args, settings):
+    """本地回放：直接驱动流会话"""
+    from models.face_detection import FaceDetector
+    from models.image_processing import FaceProcessor
+    from models.style_synthesis import StyleSynthesizer
+    from models.stream_session import EmojiStreamSession
+
+    face_detector = FaceDetector()
+    session = EmojiStreamSession(face_detector, FaceProcessor(face_detector), StyleSynthesizer())
+    transport = ReplayTransport(frame_paths, args.fps, settings, args.output)
+
+    started_at = time.time()
+    if args.fps > 0:
+        session.serve(transport)
+    else:
+        # 不限速时逐帧处理，每一帧都有结果，便于离线比对
+        session.update_settings(settings)
+        for path in frame_paths:
+            data = read_frame(path)
+            if data is None:
+                continue
+            session.stats['received'] += 1
+            result = session.process_frame_bytes(data)
+            if result is not None:
+                transport.send(result)
+    elapsed = time.time() - started_at
+
+    stats = session.get_stats()
+    print(f"\n📊 回放完成: 发送{len(frame_paths)}帧, 返回{transport.results}帧, 用时{elapsed:.1f}秒")
+    print(f"   输出帧率: {transport.results / max(elapsed, 1e-6):.1f}帧/秒, 丢弃过时帧: {stats['dropped']}")
+    print(f"   跟踪统计: {stats['tracking']}")
+
+
+def replay_remote(frame_paths, args, settings):
+    """远程回放：通过WebSocket发送到服务器"""
+    try:
+        from simple_websocket import Client
+    except ImportError:
+        print("❌ 远程模式需要安装 simple-websocket")
+        sys.exit(1)
+
+    ws = Client.connect(args.url)
+    ws.send(json.dumps(settings))
+    results = {'frames': 0}
+
+    def receive_results():
+        try:
+            while True:
+                message = ws.receive()
+                if isinstance(message, str):
+                    print(f"📊 服务端统计: {message}")
+                    continue
+                results['frames'] += 1
+                if args.output:
+                    path = os.path.join(args.output, f"emoji_{results['frames']:05d}.{settings['format']}")
+                    with open(path, 'wb') as f:
+                        f.write(message)
+        except Exception:
+            pass
+
+    receiver = threading.Thread(target=receive_results, daemon=True)
+    receiver.start()
+
+    started_at = time.time()
+    interval = 1.0 / args.fps if args.fps > 0 else 0
+    for index, path in enumerate(frame_paths):
+        delay = started_at + index * interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        data = read_frame(path)
+        if data is not None:
+            ws.send(data)
+
+    # 等待最后几帧返回
+    time.sleep(1.0)
+    ws.close()
+    elapsed = time.time() - started_at
+    print(f"\n📊 回放完成: 发送{len(frame_paths)}帧, 返回{results['frames']}帧, "
+          f"输出帧率{results['frames'] / max(elapsed, 1e-6):.1f}帧/秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回放图片帧目录，测试实时表情流')
+    parser.add_argument('frames_dir', help='帧图片目录（按文件名排序）')
+    parser.add_argument('--fps', type=float, default=15, help='发送帧率；本地模式下0表示逐帧处理不丢帧')
+    parser.add_argument('--style', default='panda', help='风格名称')
+    parser.add_argument('--format', default='jpeg', choices=['jpeg', 'png', 'webp'], help='返回帧格式')
+    parser.add_argument('--output', help='保存返回帧的目录')
+    parser.add_argument('--url', help='服务器地址，如 ws://127.0.0.1:5000/stream；不指定则本地回放')
+    args = parser.parse_args()
+
+    frame_paths = list_frames(args.frames_dir)
+    if not frame_paths:
+        print(f"❌ 目录中没有图片帧: {args.frames_dir}")
+        sys.exit(1)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    settings = {'style': args.style, 'format': args.format}
+    if args.url:
+        replay_remote(frame_paths, args, settings)
+    else:
+        replay_local(frame_paths, args, settings)
+
+
+if __name__ == '__main__':
+    main()
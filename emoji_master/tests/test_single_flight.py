@@ -0,0 +1,45 @@
+import threading
+import time
+import unittest
+
+from utils.single_flight import SingleFlight, RequestTracker, RequestCancelled
+
+
+class SupersedeIdenticalRequestTest(unittest.TestCase):
+    """同一会话双击：新请求取代内容完全相同的旧请求"""
+
+    def test_new_request_starts_fresh_flight(self):
+        flight = SingleFlight(poll_interval=0.01)
+        tracker = RequestTracker()
+        started = threading.Event()
+        outcome = {}
+
+        def slow(flight_token):
+            started.set()
+            while not flight_token.cancelled:
+                time.sleep(0.01)
+            flight_token.check()
+
+        def first():
+            token = tracker.register('a', 'session')
+            try:
+                flight.do('same-key', slow, token)
+            except RequestCancelled:
+                outcome['a'] = 'cancelled'
+
+        thread = threading.Thread(target=first)
+        thread.start()
+        self.assertTrue(started.wait(5))
+
+        # 取代旧请求：旧请求离开后计算被放弃，新请求必须重新计算而不是加入已取消的计算
+        token_b = tracker.register('b', 'session')
+        self.assertEqual(flight.do('same-key', lambda flight_token: 'result', token_b), 'result')
+
+        thread.join(5)
+        self.assertEqual(outcome.get('a'), 'cancelled')
+        self.assertEqual(flight.stats['executed'], 2)
+        self.assertEqual(flight.stats['cancelled'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+'''
+人脸检测参数调优 - 在本地标注图片集上对检测参数做网格评估，输出速度/召回率的帕累托前沿
+
+    python tune_detector.py fixtures/ --scale-factors 1.05,1.1,1.2 --min-neighbors 3,5,7 \
+        --min-sizes 40,60,80 --working-sides 0,640,960 --output tuning/
+
+放宽重试的参数用 --relaxed-scale-factors / --relaxed-min-neighbors / --relaxed-min-sizes 加入网格，
+未指定时沿用当前配置（放宽参数决定 fallback_rate 对应的那部分耗时和召回）。
+
+标注文件默认为 <图片目录>/labels.json，格式为 {"文件名": [[x, y, w, h], ...]}，
+空列表表示图片中没有人脸（用于统计误检）。每张图片只解码一次，所有参数组合共用。
+
+每个组合统计：单张检测耗时(p50/p95)、召回率（最大人脸与任一标注框IoU达到阈值且置信度达标）、
+平均IoU、无人脸图片的误检率、放宽参数重试的比例和预筛跳过重试的比例。结果写入 results.json / results.csv，
+帕累托前沿（耗时更低且召回率不更差的组合不存在）打印为可直接写入 Config.FACE_DETECTION_PARAMS 的参数
+（primary、relaxed 和 working_side）。
+'''
+import os
+import io
+import csv
+import sys
+import json
+import time
+import copy
+import argparse
+import itertools
+import contextlib
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def parse_list(value, cast):
+    return [cast(item) for item in value.split(',') if item.strip()]
+
+
+def load_fixtures(fixtures_dir, labels_path):
+    """读取标注和图片 - 返回[(文件名, BGR图像, 标注框列表)]，未标注的图片跳过"""
+    import cv2
+
+    with open(labels_path, 'r', encoding='utf-8') as f:
+        labels = json.load(f)
+
+    fixtures = []
+    for name in sorted(labels):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        image = cv2.imread(os.path.join(fixtures_dir, name), cv2.IMREAD_COLOR)
+        if image is None:
+            print(f"⚠️ 无法读取图片，跳过: {name}")
+            continue
+        fixtures.append((name, image, [tuple(box) for box in labels[name]]))
+    return fixtures
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = inter_w * inter_h
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+def build_grid(args, base_params):
+    """参数网格 - 只替换人脸框检测的主参数、放宽参数和工作分辨率，其余沿用当前配置"""
+    relaxed = base_params['relaxed']
+    relaxed_scale_factors = args.relaxed_scale_factors or [relaxed['scale_factor']]
+    relaxed_min_neighbors = args.relaxed_min_neighbors or [relaxed['min_neighbors']]
+    relaxed_min_sizes = args.relaxed_min_sizes or [relaxed['min_size'][0]]
+
+    grid = []
+    for (scale_factor, min_neighbors, min_size, working_side,
+         relaxed_scale_factor, relaxed_neighbors, relaxed_min_size) in itertools.product(
+            args.scale_factors, args.min_neighbors, args.min_sizes, args.working_sides,
+            relaxed_scale_factors, relaxed_min_neighbors, relaxed_min_sizes):
+        params = copy.deepcopy(base_params)
+        params['primary'] = dict(params['primary'], scale_factor=scale_factor, min_neighbors=min_neighbors,
+                                 min_size=(min_size, min_size))
+        params['relaxed'] = dict(params['relaxed'], scale_factor=relaxed_scale_factor,
+                                 min_neighbors=relaxed_neighbors, min_size=(relaxed_min_size, relaxed_min_size))
+        params['working_side'] = working_side
+        grid.append(params)
+    return grid
+
+
+def evaluate(detector, fixtures, params, iou_threshold, min_confidence, repeat):
+    """用一组参数检测所有图片 - 返回统计结果"""
+    detector.detection_params = params
+    detector.detection_stats = dict.fromkeys(detector.detection_stats, 0)
+
+    latencies = []
+    hits, labelled, ious = 0, 0, []
+    false_positives, negatives = 0, 0
+
+    for name, image, boxes in fixtures:
+        best_seconds = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            # 模块内有大量逐步日志，评估时丢弃
+            with contextlib.redirect_stdout(io.StringIO()):
+                face_image, confidence, ellipse_info = detector.detect_face_array(image)
+            seconds = time.perf_counter() - started
+            best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+        latencies.append(best_seconds)
+
+        detected = face_image is not None and confidence >= min_confidence
+        if not boxes:
+            negatives += 1
+            false_positives += int(detected)
+            continue
+
+        labelled += 1
+        if detected:
+            overlap = max(iou(ellipse_info['face_rect'], box) for box in boxes)
+            if overlap >= iou_threshold:
+                hits += 1
+                ious.append(overlap)
+
+    latencies.sort()
+    stats = detector.detection_stats
+    return {
+        'primary': params['primary'],
+        'relaxed': params['relaxed'],
+        'working_side': params['working_side'],
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'recall': round(hits / labelled, 4) if labelled else None,
+        'mean_iou': round(sum(ious) / len(ious), 4) if ious else None,
+        'false_positive_rate': round(false_positives / negatives, 4) if negatives else None,
+        # 每次重复都会计数，按重复次数折算回单张图片
+        'fallback_rate': round(stats['relaxed_runs'] / repeat / len(fixtures), 4),
+        'prescreen_skip_rate': round(stats['prescreen_skipped'] / repeat / len(fixtures), 4)
+    }
+
+
+def pareto_frontier(results, latency_key):
+    """耗时越低、召回率越高越好 - 返回不被其他组合支配的结果，按耗时升序"""
+    frontier = []
+    for result in sorted(results, key=lambda r: (r[latency_key], -(r['recall'] or 0))):
+        if not frontier or (result['recall'] or 0) > (frontier[-1]['recall'] or 0):
+            frontier.append(result)
+    return frontier
+
+
+def write_results(output_dir, results, frontier):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'results.json'), 'w', encoding='utf-8') as f:
+        json.dump({'results': results, 'frontier': frontier}, f, ensure_ascii=False, indent=2)
+
+    columns = ['scale_factor', 'min_neighbors', 'min_size', 'relaxed_scale_factor', 'relaxed_min_neighbors',
+               'relaxed_min_size', 'working_side', 'p50_ms', 'p95_ms', 'mean_ms', 'recall', 'mean_iou',
+               'false_positive_rate', 'fallback_rate', 'prescreen_skip_rate', 'pareto']
+    with open(os.path.join(output_dir, 'results.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for result in results:
+            primary, relaxed = result['primary'], result['relaxed']
+            writer.writerow([primary['scale_factor'], primary['min_neighbors'], primary['min_size'][0],
+                             relaxed['scale_factor'], relaxed['min_neighbors'], relaxed['min_size'][0],
+                             result['working_side'], result['p50_ms'], result['p95_ms'], result['mean_ms'],
+                             result['recall'], result['mean_iou'], result['false_positive_rate'],
+                             result['fallback_rate'], result['prescreen_skip_rate'], int(result in frontier)])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='人脸检测参数调优')
+    parser.add_argument('fixtures_dir', help='标注图片目录')
+    parser.add_argument('--labels', help='标注文件，默认 <fixtures_dir>/labels.json')
+    parser.add_argument('--scale-factors', type=lambda v: parse_list(v, float), default=[1.05, 1.1, 1.2],
+                        help='scaleFactor候选，逗号分隔')
+    parser.add_argument('--min-neighbors', type=lambda v: parse_list(v, int), default=[3, 5, 7],
+                        help='minNeighbors候选，逗号分隔')
+    parser.add_argument('--min-sizes', type=lambda v: parse_list(v, int), default=[40, 60, 80],
+                        help='最小人脸边长候选（原图像素），逗号分隔')
+    parser.add_argument('--working-sides', type=lambda v: parse_list(v, int), default=[0, 640, 960],
+                        help='检测分辨率（最长边）候选，0为原图，逗号分隔')
+    parser.add_argument('--relaxed-scale-factors', type=lambda v: parse_list(v, float),
+                        help='放宽重试的scaleFactor候选，逗号分隔，默认沿用当前配置')
+    parser.add_argument('--relaxed-min-neighbors', type=lambda v: parse_list(v, int),
+                        help='放宽重试的minNeighbors候选，逗号分隔，默认沿用当前配置')
+    parser.add_argument('--relaxed-min-sizes', type=lambda v: parse_list(v, int),
+                        help='放宽重试的最小人脸边长候选（原图像素），逗号分隔，默认沿用当前配置')
+    parser.add_argument('--iou', type=float, default=0.5, help='判定命中的IoU阈值')
+    parser.add_argument('--repeat', type=int, default=1, help='每张图片重复检测次数，耗时取最小值')
+    parser.add_argument('--latency', default='p50_ms', choices=['p50_ms', 'p95_ms', 'mean_ms'],
+                        help='帕累托前沿使用的耗时指标')
+    parser.add_argument('--output', help='结果输出目录（results.json / results.csv）')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    labels_path = args.labels or os.path.join(args.fixtures_dir, 'labels.json')
+    if not os.path.exists(labels_path):
+        print(f"❌ 标注文件不存在: {labels_path}")
+        sys.exit(1)
+
+    import cv2
+    # 单线程计时，避免OpenCV内部线程让耗时不稳定
+    cv2.setNumThreads(1)
+
+    from config import Config
+    from models.face_detection import FaceDetector
+
+    fixtures = load_fixtures(args.fixtures_dir, labels_path)
+    if not fixtures:
+        print("❌ 没有可用的标注图片")
+        sys.exit(1)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        detector = FaceDetector()
+
+    grid = build_grid(args, Config.FACE_DETECTION_PARAMS)
+    labelled = sum(1 for _, _, boxes in fixtures if boxes)
+    print(f"🔍 {len(fixtures)}张图片（{labelled}张有人脸），{len(grid)}组参数")
+
+    results = []
+    for index, params in enumerate(grid, 1):
+        result = evaluate(detector, fixtures, params, args.iou, Config.FACE_DETECTION_CONFIDENCE, max(1, args.repeat))
+        results.append(result)
+        primary, relaxed = result['primary'], result['relaxed']
+        print(f"⏱️ [{index}/{len(grid)}] scale={primary['scale_factor']} neighbors={primary['min_neighbors']} "
+              f"min={primary['min_size'][0]} relaxed={relaxed['scale_factor']}/{relaxed['min_neighbors']}/"
+              f"{relaxed['min_size'][0]} side={result['working_side']}: "
+              f"{result[args.latency]}ms, 召回{result['recall']}, 误检{result['false_positive_rate']}, "
+              f"放宽重试{result['fallback_rate']}")
+
+    frontier = pareto_frontier(results, args.latency)
+    print(f"\n📈 帕累托前沿（{args.latency} / recall）:")
+    for result in frontier:
+        print(f"   {result[args.latency]}ms 召回{result['recall']} 误检{result['false_positive_rate']}: "
+              f"'primary': {result['primary']}, 'relaxed': {result['relaxed']}, "
+              f"'working_side': {result['working_side']}")
+
+    if args.output:
+        write_results(args.output, results, frontier)
+        print(f"📁 结果已写入: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
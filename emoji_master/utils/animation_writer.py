@@ -0,0 +1,92 @@
+from PIL import Image, GifImagePlugin
+
+
+class GifStreamWriter:
+    """增量GIF编码器 - 每帧量化后立即写出，内存中只保留当前帧"""
+
+    TRANSPARENT_INDEX = 255
+
+    def __init__(self, fp, loop=0):
+        self.fp = fp
+        self.loop = loop
+        self.size = None
+        self.frame_count = 0
+
+    def add_frame(self, frame, duration):
+        """写入一帧（RGBA/RGB图像，duration为毫秒）"""
+        if self.size is None:
+            self.size = frame.size
+        elif frame.size != self.size:
+            frame = frame.resize(self.size, Image.LANCZOS)
+
+        paletted = self._quantize(frame)
+        params = {
+            'duration': duration,
+            'transparency': self.TRANSPARENT_INDEX,
+            'disposal': 2,  # 每帧绘制前恢复背景，避免透明区域残留上一帧
+            'include_color_table': True
+        }
+
+        if self.frame_count == 0:
+            header, _ = GifImagePlugin.getheader(paletted, info={'loop': self.loop, 'duration': duration})
+            for chunk in header:
+                self.fp.write(chunk)
+
+        for chunk in GifImagePlugin.getdata(paletted, **params):
+            self.fp.write(chunk)
+        self.frame_count += 1
+
+    def close(self):
+        """写入GIF结束标记"""
+        if self.frame_count:
+            self.fp.write(b';')
+
+    def _quantize(self, frame):
+        """量化为255色调色板，半透明以下的像素映射到透明索引"""
+        frame = frame.convert('RGBA') if frame.mode != 'RGBA' else frame
+        paletted = frame.convert('RGB').quantize(colors=self.TRANSPARENT_INDEX)
+
+        palette = paletted.getpalette()[:self.TRANSPARENT_INDEX * 3]
+        palette += [0] * (256 * 3 - len(palette))
+        paletted.putpalette(palette)
+
+        transparent_mask = frame.getchannel('A').point(lambda a: 255 if a < 128 else 0)
+        paletted.paste(self.TRANSPARENT_INDEX, mask=transparent_mask)
+        return paletted
+
+
+class WebPAnimationWriter:
+    """动画WebP编码器 - Pillow的动画WebP接口需要一次性提供所有帧，这里缓存已合成的帧"""
+
+    def __init__(self, fp, loop=0, quality=80):
+        self.fp = fp
+        self.loop = loop
+        self.quality = quality
+        self.frames = []
+        self.durations = []
+        self.frame_count = 0
+
+    def add_frame(self, frame, duration):
+        """缓存一帧（RGBA/RGB图像，duration为毫秒）"""
+        if self.frames and frame.size != self.frames[0].size:
+            frame = frame.resize(self.frames[0].size, Image.LANCZOS)
+        self.frames.append(frame)
+        self.durations.append(duration)
+        self.frame_count += 1
+
+    def close(self):
+        """编码并写出所有帧"""
+        if not self.frames:
+            return
+        first, rest = self.frames[0], self.frames[1:]
+        first.save(self.fp, format='WEBP', save_all=True, append_images=rest,
+                   duration=self.durations, loop=self.loop, quality=self.quality)
+        self.frames = []
+        self.durations = []
+
+
+def create_animation_writer(fp, output_format='gif', loop=0):
+    """按输出格式创建编码器"""
+    if output_format == 'webp':
+        return WebPAnimationWriter(fp, loop=loop)
+    return GifStreamWriter(fp, loop=loop)
@@ -0,0 +1,383 @@
+import os
+import time
+import socket
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from config import Config
+
+
+class CacheBackend:
+    """缓存接口 - 键为字符串，值为bytes（二进制原样保存，不做base64）
+
+    所有后端出错时只打印警告并按未命中处理，缓存不可用不影响生成流程
+    """
+
+    def __init__(self, max_value_bytes=None):
+        self.max_value_bytes = max_value_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0, 'errors': 0, 'too_large': 0}
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def metrics(self):
+        return dict(self.stats)
+
+    def _accepts(self, value):
+        if self.max_value_bytes and len(value) > self.max_value_bytes:
+            self.stats['too_large'] += 1
+            return False
+        return True
+
+    @staticmethod
+    def _expiry(ttl):
+        return time.time() + ttl if ttl else 0.0
+
+
+class MemoryLRUCache(CacheBackend):
+    """进程内LRU缓存 - 按条目数和总字节数淘汰最久未使用的条目"""
+
+    def __init__(self, max_bytes, max_entries, max_value_bytes=None):
+        super().__init__(max_value_bytes)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (过期时间, 值)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] and entry[0] < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        if not self._accepts(value):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._expiry(ttl), value)
+            self._total_bytes += len(value)
+            self.stats['sets'] += 1
+            while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        """调用方持有锁"""
+        _, value = self._entries.pop(key)
+        self._total_bytes -= len(value)
+
+
+class FileSystemCache(CacheBackend):
+    """本地文件缓存 - 同一台机器上的多个进程共享，重启后保留
+
+    文件名为键的SHA-256，文件头8字节为过期时间；先写临时文件再原子替换，
+    读取时更新修改时间，总大小超过上限时按修改时间淘汰最旧的文件（降到上限的90%）
+    """
+
+    HEADER = struct.Struct('<d')
+
+    def __init__(self, folder, max_bytes, max_value_bytes=None):
+        super().__init__(max_value_bytes)
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._total_bytes = sum(size for _, size, _ in self._scan())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.stats['misses'] += 1
+            return None
+
+        try:
+            expiry, = self.HEADER.unpack_from(data)
+        except struct.error:
+            # 文件被截断或不是缓存写入的，按未命中处理
+            self.stats['errors'] += 1
+            self.stats['misses'] += 1
+            self._unlink(path)
+            return None
+        if expiry and expiry < time.time():
+            self._unlink(path)
+            self.stats['misses'] += 1
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.stats['hits'] += 1
+        return data[self.HEADER.size:]
+
+    def set(self, key, value, ttl=None):
+        if not self._accepts(value):
+            return
+        path = self._path(key)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(self.HEADER.pack(self._expiry(ttl)))
+                f.write(value)
+            os.replace(temp_path, path)
+        except OSError as e:
+            self.stats['errors'] += 1
+            print(f"⚠️ 文件缓存写入失败: {e}")
+            self._unlink(temp_path)
+            return
+
+        self.stats['sets'] += 1
+        with self._lock:
+            self._total_bytes += self.HEADER.size + len(value)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def delete(self, key):
+        self._unlink(self._path(key))
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, digest[:2], digest)
+
+    def _scan(self):
+        """列出缓存文件 - [(路径, 大小, 修改时间)]"""
+        files = []
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict(self):
+        """调用方持有锁 - 重新统计实际大小（其他进程也在写入），淘汰最旧的文件"""
+        files = sorted(self._scan(), key=lambda item: item[2])
+        self._total_bytes = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for path, size, _ in files:
+            if self._total_bytes <= target:
+                break
+            if self._unlink(path):
+                self._total_bytes -= size
+                self.stats['evictions'] += 1
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+class RedisError(Exception):
+    """Redis返回的错误回复"""
+
+
+class RedisCache(CacheBackend):
+    """Redis协议缓存 - 多个节点共享，兼容Redis及实现了RESP协议的服务（KeyDB、Dragonfly等）
+
+    只用到 GET / SET PX / DEL，直接走RESP协议不依赖客户端库；
+    每个线程各自持有一个连接。连接失败后 retry_seconds 内不再重试，期间全部按未命中处理。
+    总容量由服务端的 maxmemory 策略控制。
+    """
+
+    def __init__(self, host, port, db=0, password='', prefix='', socket_timeout=0.5, retry_seconds=5,
+                 max_value_bytes=None):
+        super().__init__(max_value_bytes)
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.socket_timeout = socket_timeout
+        self.retry_seconds = retry_seconds
+        self._local = threading.local()
+        self._down_until = 0.0
+
+    def get(self, key):
+        value = self._execute(b'GET', self._key(key))
+        self.stats['hits' if value is not None else 'misses'] += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if not self._accepts(value):
+            return
+        args = [b'SET', self._key(key), value]
+        if ttl:
+            args += [b'PX', str(int(ttl * 1000)).encode()]
+        if self._execute(*args) is not None:
+            self.stats['sets'] += 1
+
+    def delete(self, key):
+        self._execute(b'DEL', self._key(key))
+
+    def _key(self, key):
+        return (self.prefix + key).encode('utf-8')
+
+    def _execute(self, *args):
+        """执行命令 - 出错时断开连接并返回None"""
+        if time.time() < self._down_until:
+            return None
+        try:
+            connection = self._connection()
+            connection['socket'].sendall(self._encode(args))
+            return self._read_reply(connection['reader'])
+        except (OSError, RedisError, ValueError) as e:
+            self.stats['errors'] += 1
+            self._close()
+            if isinstance(e, OSError):
+                self._down_until = time.time() + self.retry_seconds
+            print(f"⚠️ Redis缓存不可用: {e}")
+            return None
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            sock = socket.create_connection(self.address, timeout=self.socket_timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = {'socket': sock, 'reader': sock.makefile('rb')}
+            self._local.connection = connection
+            if self.password:
+                self._handshake(b'AUTH', self.password.encode('utf-8'))
+            if self.db:
+                self._handshake(b'SELECT', str(self.db).encode())
+        return connection
+
+    def _handshake(self, *args):
+        connection = self._local.connection
+        connection['socket'].sendall(self._encode(args))
+        self._read_reply(connection['reader'])
+
+    def _close(self):
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None:
+            try:
+                connection['reader'].close()
+                connection['socket'].close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _encode(args):
+        """编码为RESP数组（参数均为bulk string，二进制安全）"""
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            parts.append(b'$%d\r\n' % len(arg))
+            parts.append(arg)
+            parts.append(b'\r\n')
+        return b''.join(parts)
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('连接被关闭')
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body
+        if kind == b'-':
+            raise RedisError(body.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError('连接被关闭')
+            return data[:-2]
+        if kind == b'*':
+            count = int(body)
+            return None if count < 0 else [self._read_reply(reader) for _ in range(count)]
+        raise ValueError(f'无法解析的回复: {line[:32]!r}')
+
+
+class TwoTierCache(CacheBackend):
+    """两级缓存 - 本地L1（进程内）在前，共享L2在后
+
+    L2命中的值以较短的 l1_ttl 写入L1，其他节点更新后本地最多在 l1_ttl 秒内读到旧值
+    """
+
+    def __init__(self, l1, l2, l1_ttl):
+        super().__init__()
+        self.l1 = l1
+        self.l2 = l2
+        self.l1_ttl = l1_ttl
+
+    def get(self, key):
+        value = self.l1.get(key)
+        if value is None:
+            value = self.l2.get(key)
+            if value is not None:
+                self.l1.set(key, value, self.l1_ttl)
+        self.stats['hits' if value is not None else 'misses'] += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.l2.set(key, value, ttl)
+        self.l1.set(key, value, min(ttl, self.l1_ttl) if ttl else self.l1_ttl)
+        self.stats['sets'] += 1
+
+    def delete(self, key):
+        self.l2.delete(key)
+        self.l1.delete(key)
+
+    def metrics(self):
+        return dict(self.stats, l1=self.l1.metrics(), l2=self.l2.metrics())
+
+
+def create_cache(cache_config=None, backend=None):
+    """按配置创建缓存后端: memory / filesystem / redis / tiered（memory在前，l2_backend在后）"""
+    cache_config = cache_config or Config.CACHE
+    backend = backend or cache_config['backend']
+    max_value_bytes = cache_config['max_value_bytes']
+
+    if backend == 'memory':
+        memory = cache_config['memory']
+        return MemoryLRUCache(memory['max_bytes'], memory['max_entries'], max_value_bytes)
+
+    if backend == 'filesystem':
+        filesystem = cache_config['filesystem']
+        return FileSystemCache(filesystem['folder'], filesystem['max_bytes'], max_value_bytes)
+
+    if backend == 'redis':
+        redis = cache_config['redis']
+        return RedisCache(redis['host'], redis['port'], redis['db'], redis['password'], redis['prefix'],
+                          redis['socket_timeout'], redis['retry_seconds'], max_value_bytes)
+
+    if backend == 'tiered':
+        return TwoTierCache(create_cache(cache_config, 'memory'),
+                            create_cache(cache_config, cache_config['l2_backend']),
+                            cache_config['l1_ttl'])
+
+    raise ValueError(f"未知的缓存后端: {backend}")
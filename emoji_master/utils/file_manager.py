@@ -2,6 +2,7 @@ import os
 import uuid
 from datetime import datetime
 from pathlib import Path
+from PIL import Image
 from werkzeug.utils import secure_filename
 from config import Config
 
@@ -58,21 +59,36 @@ class FileManager:
             print(f"❌ 文件保存失败: {e}")
             raise
 
-    def save_result_file(self, image, style_name):
-        """保存生成的结果文件"""
+    # 结果文件格式 -> 扩展名
+    RESULT_FORMATS = {'PNG': 'png', 'WEBP': 'webp', 'JPEG': 'jpg'}
+
+    def save_result_file(self, image, style_name, result_folder=None, filename=None, image_format='PNG'):
+        """保存生成的结果文件 - 可指定输出目录、文件名和格式(PNG/WEBP/JPEG)"""
         try:
+            image_format = image_format.upper()
+            if image_format not in self.RESULT_FORMATS:
+                raise ValueError(f"不支持的结果格式: {image_format}")
+
             # 生成结果文件名
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"emoji_{style_name}_{timestamp}.png"
+            if filename is None:
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                filename = f"emoji_{style_name}_{timestamp}.{self.RESULT_FORMATS[image_format]}"
 
             # 使用 os.path.join 而不是 /
-            file_path = os.path.join(self.result_folder, filename)
+            result_folder = result_folder or self.result_folder
+            file_path = os.path.join(result_folder, filename)
 
             # 确保目录存在
-            os.makedirs(self.result_folder, exist_ok=True)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+            # JPEG不支持透明通道，铺白色背景
+            if image_format == 'JPEG' and image.mode == 'RGBA':
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
 
             # 保存图像
-            image.save(file_path, format='PNG')
+            image.save(file_path, format=image_format)
 
             print(f"✅ 结果文件保存成功: {file_path}")
             return filename
@@ -98,7 +114,7 @@ class FileManager:
             return False
 
     def cleanup_old_files(self, folder, max_age_hours=24):
-        """清理指定文件夹中的旧文件"""
+        """清理指定文件夹中的旧文件（定期清理和磁盘配额见 utils/temp_janitor.py）"""
         try:
             if isinstance(folder, Path):
                 folder = str(folder)
@@ -107,20 +123,18 @@ class FileManager:
                 return 0
 
             deleted_count = 0
-            current_time = datetime.now()
-
-            for filename in os.listdir(folder):
-                file_path = os.path.join(folder, filename)
-                if os.path.isfile(file_path):
-                    # 检查文件年龄
-                    file_age = current_time - datetime.fromtimestamp(os.path.getmtime(file_path))
-                    if file_age.total_seconds() > max_age_hours * 3600:
+            cutoff = datetime.now().timestamp() - max_age_hours * 3600
+
+            # scandir 的目录项自带stat信息，不必每个文件再调用一次 getmtime
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
                         try:
-                            os.remove(file_path)
+                            os.remove(entry.path)
                             deleted_count += 1
-                            print(f"🧹 清理旧文件: {file_path}")
+                            print(f"🧹 清理旧文件: {entry.path}")
                         except Exception as e:
-                            print(f"⚠️ 无法删除文件 {file_path}: {e}")
+                            print(f"⚠️ 无法删除文件 {entry.path}: {e}")
 
             return deleted_count
 
@@ -0,0 +1,63 @@
+from PIL import Image
+
+
+def parse_output_sizes(values, max_count, max_side):
+    """解析请求中的输出尺寸（最长边像素）- 支持重复提交或逗号分隔，返回去重后的升序列表
+
+    非正整数、超过 max_side 或种类超过 max_count 时抛出 ValueError
+    """
+    sizes = set()
+    for value in values:
+        for item in str(value).split(','):
+            item = item.strip()
+            if not item:
+                continue
+            if not item.isdigit() or int(item) <= 0:
+                raise ValueError(f"无效的输出尺寸: {item}")
+            size = int(item)
+            if size > max_side:
+                raise ValueError(f"输出尺寸不能超过{max_side}: {item}")
+            sizes.add(size)
+
+    if len(sizes) > max_count:
+        raise ValueError(f"最多支持{max_count}种输出尺寸")
+    return sorted(sizes)
+
+
+def build_size_variants(image, sizes):
+    """逐级减半的重采样金字塔 - 从一张完整合成图生成多个尺寸，返回{尺寸: 图像}
+
+    从大到小处理：每个尺寸先在上一层的基础上用2x2盒式滤波不断减半，
+    直到再减半会小于目标，最后一步用LANCZOS精确缩放。小尺寸复用大尺寸的中间层，
+    总计算量约为一次完整缩放。不放大，超过原图的尺寸直接返回原图。
+    透明图在预乘alpha空间中缩放，避免透明边缘出现暗色杂边。
+    """
+    premultiplied = image.mode == 'RGBA'
+    source = image.convert('RGBa') if premultiplied else image
+    source_side = max(source.size)
+
+    variants = {}
+    current = source
+    for size in sorted(sizes, reverse=True):
+        if size >= source_side:
+            variants[size] = image
+            continue
+
+        while max(current.size) // 2 >= size:
+            current = current.reduce(2)
+
+        scale = size / source_side
+        target = (max(1, round(source.width * scale)), max(1, round(source.height * scale)))
+        resized = current if current.size == target else current.resize(target, Image.LANCZOS)
+        variants[size] = resized.convert('RGBA') if premultiplied else resized
+
+    return variants
+
+
+def encode_variants(variants, encode, executor=None):
+    """并行编码各尺寸 - encode(image)返回编码结果，返回{尺寸: 编码结果}"""
+    if executor is None or len(variants) <= 1:
+        return {size: encode(image) for size, image in variants.items()}
+
+    futures = {size: executor.submit(encode, image) for size, image in variants.items()}
+    return {size: future.result() for size, future in futures.items()}
@@ -0,0 +1,75 @@
+import cv2
+from PIL import Image
+from config import Config
+from utils.profiling import profile_stage
+
+
+class ImageTooLargeError(ValueError):
+    """图片像素数超过上限（可能是解压炸弹）"""
+
+
+class MemoryBudget:
+    """按内存预算解码图片 - 解码前从文件头读取尺寸
+
+    像素数超过 max_pixels 的图片直接拒绝；整图处理阶段（解码、灰度、均衡化、哈希）
+    的估算内存超过单请求预算时，使用缩小解码（JPEG在DCT阶段直接按1/2、1/4、1/8解码）。
+    人脸最终会缩放到 MAX_FACE_SIZE，缩小解码对结果质量影响很小。
+    """
+
+    REDUCED_FLAGS = {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8
+    }
+
+    def __init__(self, budget_config=None):
+        budget_config = budget_config or Config.MEMORY_BUDGET
+        self.max_pixels = budget_config['max_pixels']
+        self.request_bytes = budget_config['request_bytes']
+        self.bytes_per_pixel = budget_config['bytes_per_pixel']
+
+    @staticmethod
+    def read_dimensions(image_path):
+        """只解析文件头获取(宽, 高)，无法识别时返回None；也可以传入已打开的文件对象
+
+        像素数超过Pillow解压炸弹阈值时Pillow拒绝打开，抛出ImageTooLargeError
+        """
+        try:
+            with Image.open(image_path if hasattr(image_path, 'read') else str(image_path)) as image:
+                return image.size
+        except Image.DecompressionBombError:
+            raise ImageTooLargeError("图片尺寸过大（超过解压炸弹阈值）")
+        except Exception:
+            return None
+
+    def check(self, image_path):
+        """检查图片尺寸 - 返回解码缩小倍数(1/2/4/8)，超过像素上限时抛出ImageTooLargeError"""
+        dimensions = self.read_dimensions(image_path)
+        if dimensions is None:
+            return 1
+        return self.reduction_for(*dimensions)
+
+    def reduction_for(self, width, height):
+        pixels = width * height
+        if pixels > self.max_pixels:
+            raise ImageTooLargeError(f"图片尺寸过大: {width}x{height}")
+
+        for factor in sorted(self.REDUCED_FLAGS):
+            if pixels / (factor * factor) * self.bytes_per_pixel <= self.request_bytes:
+                return factor
+        return max(self.REDUCED_FLAGS)
+
+    def load_bgr(self, image_path):
+        """按预算解码为BGR数组，无法读取时返回None"""
+        with profile_stage('decode'):
+            factor = self.check(image_path)
+            image = cv2.imread(str(image_path), self.REDUCED_FLAGS[factor])
+            if image is not None and factor > 1:
+                print(f"📉 图片超过内存预算，缩小{factor}倍解码: {image.shape[1]}x{image.shape[0]}")
+            return image
+
+    def reduce_frame(self, frame):
+        """动图帧按预算缩小（PIL图像）"""
+        factor = self.reduction_for(*frame.size)
+        return frame.reduce(factor) if factor > 1 else frame
@@ -0,0 +1,141 @@
+import threading
+from collections import OrderedDict
+import cv2
+from config import Config
+
+
+class BKTree:
+    """BK树 - 按汉明距离组织64位哈希，支持半径查询"""
+
+    def __init__(self):
+        self.root = None  # [hash, values, {distance: child}]
+        self.size = 0
+
+    @staticmethod
+    def distance(a, b):
+        return bin(a ^ b).count('1')
+
+    def add(self, hash_value, value):
+        if self.root is None:
+            self.root = [hash_value, [value], {}]
+            self.size = 1
+            return
+
+        node = self.root
+        while True:
+            d = self.distance(hash_value, node[0])
+            if d == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [hash_value, [value], {}]
+                self.size += 1
+                return
+            node = child
+
+    def search(self, hash_value, max_distance):
+        """返回[(距离, 值)]，按距离从小到大"""
+        results = []
+        if self.root is None:
+            return results
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = self.distance(hash_value, node[0])
+            if d <= max_distance:
+                results.extend((d, value) for value in node[1])
+            # 三角不等式：只有距离在[d-r, d+r]内的子树可能命中
+            for child_distance, child in node[2].items():
+                if d - max_distance <= child_distance <= d + max_distance:
+                    stack.append(child)
+
+        results.sort(key=lambda item: item[0])
+        return results
+
+
+class FaceHashIndex:
+    """近重复图片的人脸检测结果索引 - 重新压缩或截图后的照片直接复用人脸位置"""
+
+    def __init__(self, max_distance=None, max_entries=None, aspect_tolerance=None):
+        hash_config = Config.PERCEPTUAL_HASH
+        self.max_distance = max_distance if max_distance is not None else hash_config['max_distance']
+        self.max_entries = max_entries or hash_config['max_entries']
+        self.aspect_tolerance = aspect_tolerance if aspect_tolerance is not None else hash_config['aspect_tolerance']
+
+        self._tree = BKTree()
+        # 按插入顺序保存条目，超过上限时只保留较新的一半并重建BK树
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'entries': 0, 'rebuilds': 0}
+
+    @staticmethod
+    def compute_dhash(gray):
+        """64位差值哈希 - 缩小到9x8后比较相邻像素"""
+        small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+        diff = small[:, 1:] > small[:, :-1]
+        hash_value = 0
+        for bit in diff.flatten():
+            hash_value = (hash_value << 1) | int(bit)
+        return hash_value
+
+    def lookup(self, gray):
+        """查找近重复图片 - 返回(哈希, 记录)，记录包含相对人脸矩形和置信度，未命中时为None"""
+        hash_value = self.compute_dhash(gray)
+        height, width = gray.shape[:2]
+        aspect = width / height
+
+        with self._lock:
+            candidates = self._tree.search(hash_value, self.max_distance)
+
+        for distance, record in candidates:
+            # 宽高比不同说明被裁剪过，人脸位置不能直接换算
+            if abs(record['aspect'] - aspect) <= self.aspect_tolerance * aspect:
+                self.stats['hits'] += 1
+                print(f"🔁 命中近重复图片: 汉明距离{distance}")
+                return hash_value, record
+
+        self.stats['misses'] += 1
+        return hash_value, None
+
+    def add(self, hash_value, gray_shape, face_rect, confidence):
+        """记录检测结果 - 人脸矩形按图片尺寸归一化保存"""
+        height, width = gray_shape[:2]
+        x, y, w, h = [int(v) for v in face_rect]
+        record = {
+            'aspect': width / height,
+            'rect': (x / width, y / height, w / width, h / height),
+            'confidence': float(confidence)
+        }
+
+        with self._lock:
+            key = (hash_value, record['rect'])
+            if key in self._entries:
+                return
+            self._entries[key] = record
+            self._tree.add(hash_value, record)
+
+            if len(self._entries) > self.max_entries:
+                self._rebuild()
+            self.stats['entries'] = len(self._entries)
+
+    def _rebuild(self):
+        """淘汰较旧的一半条目并重建BK树（调用方持有锁）"""
+        keep = list(self._entries.items())[len(self._entries) // 2:]
+        self._entries = OrderedDict(keep)
+        self._tree = BKTree()
+        for (hash_value, _), record in keep:
+            self._tree.add(hash_value, record)
+        self.stats['rebuilds'] += 1
+
+    @staticmethod
+    def scale_rect(record, image_shape):
+        """把归一化人脸矩形换算到当前图片尺寸"""
+        height, width = image_shape[:2]
+        rx, ry, rw, rh = record['rect']
+        x, y = int(round(rx * width)), int(round(ry * height))
+        w, h = int(round(rw * width)), int(round(rh * height))
+        w = max(1, min(w, width - x))
+        h = max(1, min(h, height - y))
+        return x, y, w, h
@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import tracemalloc
+import itertools
+from collections import Counter
+from contextlib import contextmanager
+from config import Config
+
+# 当前线程正在记录的分析对象，未开启分析时为None
+_local = threading.local()
+
+
+def current_profile():
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def profile_stage(name):
+    """记录一个处理阶段的耗时，当前线程没有开启分析时不做任何事"""
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+
+    profile.enter_stage()
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.record_stage(name, time.perf_counter() - started_at)
+
+
+def profiled_stage(name):
+    """profile_stage 的装饰器形式，用在各模块的主入口方法上"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if current_profile() is None:
+                return func(*args, **kwargs)
+            with profile_stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RequestProfile:
+    """单个请求的性能分析 - 分阶段计时 + 采样调用栈 + 可选的分阶段峰值内存
+
+    采样线程按固定间隔读取被分析线程的当前调用栈（sys._current_frames），
+    不需要第三方依赖，对被分析代码的开销只有每次采样时的一次栈遍历。
+    trace_memory 使用tracemalloc记录每个阶段相对进入时的峰值分配；tracemalloc的峰值是进程级的，
+    因此记录内存的分析互相串行（其他请求不受影响，但其分配仍会计入峰值），
+    由本次分析开启的追踪在结束时关闭。
+    """
+
+    # 同一时间只允许一个请求记录分阶段内存峰值
+    _memory_lock = threading.Lock()
+
+    def __init__(self, name, interval=None, sample_stacks=True, trace_memory=False):
+        self.name = name
+        self.interval = interval or Config.PROFILING['interval']
+        self.sample_stacks = sample_stacks
+        self.trace_memory = trace_memory
+        self.stages = {}
+        # 进行中的阶段: [进入时的已分配字节, 嵌套子阶段的峰值]
+        self._memory_stack = []
+        self.samples = Counter()
+        self.sample_count = 0
+        self.started_at = None
+        self.elapsed = 0.0
+
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.trace_memory:
+            self._memory_lock.acquire()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+        self._thread_id = threading.get_ident()
+        _local.profile = self
+        self.started_at = time.perf_counter()
+        if self.sample_stacks:
+            self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+            self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.elapsed = time.perf_counter() - self.started_at
+        _local.profile = None
+        if self.trace_memory:
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+            self._memory_lock.release()
+        return False
+
+    def enter_stage(self):
+        if not self.trace_memory:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        # 重置峰值前把到目前为止的峰值计入外层阶段
+        if self._memory_stack:
+            self._memory_stack[-1][1] = max(self._memory_stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        self._memory_stack.append([current, 0])
+
+    def record_stage(self, name, seconds):
+        stage = self.stages.setdefault(name, {'ms': 0.0, 'calls': 0})
+        stage['ms'] += seconds * 1000
+        stage['calls'] += 1
+
+        if self.trace_memory and self._memory_stack:
+            start, nested_peak = self._memory_stack.pop()
+            peak = max(tracemalloc.get_traced_memory()[1], nested_peak)
+            if self._memory_stack:
+                self._memory_stack[-1][1] = max(self._memory_stack[-1][1], peak)
+            stage['peak_bytes'] = max(stage.get('peak_bytes', 0), peak - start)
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            # 从根到叶
+            self.samples[tuple(reversed(stack))] += 1
+            self.sample_count += 1
+
+    @staticmethod
+    def _frame_label(frame):
+        name, filename, line = frame
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+    def summary(self):
+        """分阶段耗时摘要"""
+        return {
+            'total_ms': round(self.elapsed * 1000, 2),
+            'stages': {name: dict(stage, ms=round(stage['ms'], 2)) for name, stage in self.stages.items()},
+            'samples': self.sample_count,
+            'interval_ms': self.interval * 1000
+        }
+
+    def collapsed(self):
+        """折叠栈格式（flamegraph.pl / speedscope 均可导入）"""
+        lines = []
+        for stack, count in self.samples.most_common():
+            lines.append(';'.join(self._frame_label(frame) for frame in stack) + f' {count}')
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self):
+        """speedscope JSON格式，阶段耗时放在profile名称中便于查看"""
+        frame_index = {}
+        frames = []
+        samples = []
+        weights = []
+        for stack, count in self.samples.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    name, filename, line = frame
+                    frames.append({'name': name, 'file': filename, 'line': line})
+                indexes.append(frame_index[frame])
+            samples.append(indexes)
+            weights.append(count * self.interval)
+
+        stage_text = ', '.join(f"{name} {stage['ms']:.1f}ms" for name, stage in self.stages.items())
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': self.name,
+            'exporter': 'emoji_master',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': f'{self.name} [{stage_text}]',
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights
+            }],
+            'stages': self.summary()
+        }
+
+    def save(self, folder=None):
+        """写入 speedscope JSON 和折叠栈两个文件 - 返回文件名（不含扩展名）"""
+        folder = folder or Config.PROFILING['output_folder']
+        os.makedirs(folder, exist_ok=True)
+
+        with open(os.path.join(folder, f'{self.name}.speedscope.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.speedscope(), f)
+        with open(os.path.join(folder, f'{self.name}.collapsed.txt'), 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+
+        self._prune(folder)
+        print(f"🔬 性能分析已保存: {self.name}, {self.summary()}")
+        return self.name
+
+    @staticmethod
+    def _prune(folder):
+        """只保留最新的 max_files 个文件"""
+        max_files = Config.PROFILING['max_files']
+        try:
+            entries = sorted(os.scandir(folder), key=lambda entry: entry.stat().st_mtime, reverse=True)
+            for entry in entries[max_files:]:
+                os.remove(entry.path)
+        except OSError as e:
+            print(f"⚠️ 清理性能分析目录失败: {e}")
+
+
+class ProfilingPolicy:
+    """决定一个请求是否需要分析：按需（需配置允许并匹配令牌）或按1/N比例采样"""
+
+    def __init__(self, profiling_config=None):
+        self.config = profiling_config or Config.PROFILING
+        self._counter = itertools.count(1)
+
+    def on_demand(self, flag):
+        if not flag or not self.config['allow_on_demand']:
+            return False
+        token = self.config['token']
+        return not token or flag == token
+
+    def sampled(self):
+        sample_every = self.config['sample_every']
+        return sample_every > 0 and next(self._counter) % sample_every == 0
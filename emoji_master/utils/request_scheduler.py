@@ -0,0 +1,174 @@
+import time
+import threading
+import itertools
+from collections import OrderedDict, deque
+from config import Config
+from utils.single_flight import RequestCancelled
+
+
+class SchedulerBusyError(Exception):
+    """等待队列已满"""
+
+
+class CostScheduler:
+    """按成本调度的生成队列 - 同时执行的任务数有上限，排队时便宜的交互式任务优先
+
+    排序依次按：
+    1. 类别：交互式（滑块调参重新生成）优先于普通上传和批量导出；
+       普通任务等待超过 aging_seconds 后提升为交互式，避免饿死
+    2. 客户端公平：每个客户端有自己的虚拟完成时间，
+       同一客户端连续提交的任务依次累加成本，不会挤占其他客户端
+    3. 提交顺序
+
+    队列满时抛出 SchedulerBusyError；等待中的请求取消后直接离开队列。
+    """
+
+    def __init__(self, scheduler_config=None):
+        self.scheduler_config = scheduler_config or Config.SCHEDULER
+        self.max_running = self.scheduler_config['max_running']
+        self.max_queue = self.scheduler_config['max_queue']
+
+        self._condition = threading.Condition()
+        self._running = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        # 虚拟时钟：已开始执行的任务中最大的开始标记
+        self._virtual_now = 0.0
+        self._client_finish = {}
+        # 最近见过的上传内容摘要 - 重复上传时人脸索引和模板缓存大概率命中
+        self._recent_uploads = OrderedDict()
+
+        self._wait_samples = {'interactive': deque(maxlen=500), 'bulk': deque(maxlen=500)}
+        self.stats = {'scheduled': 0, 'queued': 0, 'rejected': 0, 'cancelled': 0, 'promoted': 0}
+
+    def estimate_cost(self, megapixels, digest=None, styles=1, sizes=0, multi_face=False, animated=False):
+        """估算任务成本（相对单位，约等于处理的百万像素数）"""
+        costs = self.scheduler_config['costs']
+        cost = costs['base'] + megapixels * (costs['multi_face'] if multi_face else 1.0)
+        cost += styles * costs['per_style'] + sizes * costs['per_size']
+        if animated:
+            cost *= costs['animated']
+
+        if digest is not None:
+            with self._condition:
+                seen = digest in self._recent_uploads
+                self._recent_uploads[digest] = True
+                self._recent_uploads.move_to_end(digest)
+                while len(self._recent_uploads) > self.scheduler_config['recent_uploads']:
+                    self._recent_uploads.popitem(last=False)
+            if seen:
+                cost *= costs['repeat_discount']
+        return cost
+
+    def slot(self, client_id, cost, interactive=False, token=None):
+        """with scheduler.slot(...): ... 取得执行名额后进入，退出时让出名额"""
+        return _SchedulerSlot(self, client_id, cost, interactive, token)
+
+    def acquire(self, client_id, cost, interactive=False, token=None):
+        with self._condition:
+            start_tag = max(self._virtual_now, self._client_finish.get(client_id, 0.0))
+            finish_tag = start_tag + cost
+            entry = {
+                'interactive': interactive,
+                'start_tag': start_tag,
+                'finish_tag': finish_tag,
+                'sequence': next(self._sequence),
+                'enqueued_at': time.time()
+            }
+
+            if self._running < self.max_running and not self._waiting:
+                self._client_finish[client_id] = finish_tag
+                self._start(entry)
+                return
+
+            if len(self._waiting) >= self.max_queue:
+                self.stats['rejected'] += 1
+                raise SchedulerBusyError('服务繁忙，请稍后重试')
+            self._client_finish[client_id] = finish_tag
+
+            self.stats['queued'] += 1
+            self._waiting.append(entry)
+            wake = self._notify_all
+            if token is not None:
+                token.add_callback(wake)
+            try:
+                while True:
+                    if token is not None and token.cancelled:
+                        self._waiting.remove(entry)
+                        self.stats['cancelled'] += 1
+                        self._condition.notify_all()
+                        raise RequestCancelled()
+                    if self._running < self.max_running and self._next() is entry:
+                        self._waiting.remove(entry)
+                        self._start(entry)
+                        return
+                    # 超时唤醒用于让等待较久的普通任务提升优先级
+                    self._condition.wait(timeout=self.scheduler_config['aging_seconds'])
+            finally:
+                if token is not None:
+                    token.remove_callback(wake)
+
+    def release(self):
+        with self._condition:
+            self._running -= 1
+            self._condition.notify_all()
+
+    def metrics(self):
+        """队列状态和各类别的排队等待时间（毫秒）"""
+        with self._condition:
+            wait_ms = {}
+            for category, samples in self._wait_samples.items():
+                ordered = sorted(samples)
+                if not ordered:
+                    wait_ms[category] = {'count': 0}
+                    continue
+                wait_ms[category] = {
+                    'count': len(ordered),
+                    'p50': round(ordered[len(ordered) // 2] * 1000, 1),
+                    'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+                    'max': round(ordered[-1] * 1000, 1)
+                }
+            return dict(self.stats, running=self._running, waiting=len(self._waiting), wait_ms=wait_ms)
+
+    def _notify_all(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def _next(self):
+        """下一个应执行的任务"""
+        now = time.time()
+        aging = self.scheduler_config['aging_seconds']
+
+        def key(entry):
+            promoted = entry['interactive'] or now - entry['enqueued_at'] >= aging
+            return 0 if promoted else 1, entry['finish_tag'], entry['sequence']
+
+        return min(self._waiting, key=key)
+
+    def _start(self, entry):
+        waited = time.time() - entry['enqueued_at']
+        if not entry['interactive'] and waited >= self.scheduler_config['aging_seconds']:
+            self.stats['promoted'] += 1
+        self._running += 1
+        self._virtual_now = max(self._virtual_now, entry['start_tag'])
+        self._wait_samples['interactive' if entry['interactive'] else 'bulk'].append(waited)
+        self.stats['scheduled'] += 1
+
+        # 不再排队的客户端不需要保留虚拟完成时间
+        if len(self._client_finish) > 4 * (self.max_running + self.max_queue):
+            self._client_finish = {client: tag for client, tag in self._client_finish.items()
+                                   if tag > self._virtual_now}
+
+
+class _SchedulerSlot:
+    def __init__(self, scheduler, client_id, cost, interactive, token):
+        self.scheduler = scheduler
+        self.args = (client_id, cost, interactive, token)
+
+    def __enter__(self):
+        self.scheduler.acquire(*self.args)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.scheduler.release()
+        return False
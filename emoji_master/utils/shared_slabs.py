@@ -0,0 +1,116 @@
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+
+# 数组在slab中按64字节对齐
+ALIGNMENT = 64
+
+
+def attach_shared_memory(name):
+    """在工作进程中按名称映射共享内存（Python 3.13+ 不向资源跟踪器重复登记）"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def describe_array(slab_name, offset, array):
+    """数组在slab中的描述符 - 只有名称、偏移、形状和类型，跨进程传递时开销很小"""
+    return {'slab': slab_name, 'offset': offset, 'shape': tuple(array.shape), 'dtype': array.dtype.str}
+
+
+def array_nbytes(shape, dtype):
+    return int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+
+class SlabView:
+    """已映射的slab - 在其中读写numpy数组视图（不复制）"""
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.name = shm.name
+        self.size = shm.size
+
+    def array(self, descriptor):
+        """按描述符取数组视图"""
+        return np.ndarray(descriptor['shape'], dtype=np.dtype(descriptor['dtype']),
+                          buffer=self.shm.buf, offset=descriptor['offset'])
+
+    def write(self, array, offset=0):
+        """把数组复制到slab的offset处 - 返回描述符，放不下时返回None"""
+        offset = align(offset)
+        if offset + array.nbytes > self.size:
+            return None
+        target = np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf, offset=offset)
+        target[...] = array
+        return describe_array(self.name, offset, array)
+
+    def end_of(self, descriptor):
+        """描述符所占区域之后的偏移（用于在同一slab中继续放置结果）"""
+        return align(descriptor['offset'] + array_nbytes(descriptor['shape'], descriptor['dtype']))
+
+
+class SlabPool:
+    """共享内存slab池 - 由服务进程创建，请求之间循环使用
+
+    每个请求租用一个slab放置解码后的上传图片和处理结果，请求结束时 release 归还；
+    超过 slab_bytes 的请求临时创建一个独立的slab，归还时直接释放。
+    """
+
+    def __init__(self, slab_count, slab_bytes):
+        self.slab_bytes = slab_bytes
+        self._slabs = [SlabView(shared_memory.SharedMemory(create=True, size=slab_bytes))
+                       for _ in range(slab_count)]
+        self._free = list(self._slabs)
+        self._condition = threading.Condition()
+        self.stats = {'leases': 0, 'oversize': 0, 'waits': 0}
+        print(f"✅ 共享内存slab池: {slab_count}个 x {slab_bytes / 1024 / 1024:.0f}MB")
+
+    def acquire(self, nbytes, timeout=None):
+        """租用一个至少nbytes的slab，池中暂无空闲时等待"""
+        if nbytes > self.slab_bytes:
+            self.stats['oversize'] += 1
+            return SlabView(shared_memory.SharedMemory(create=True, size=nbytes))
+
+        with self._condition:
+            if not self._free:
+                self.stats['waits'] += 1
+            if not self._condition.wait_for(lambda: self._free, timeout):
+                raise TimeoutError('等待共享内存slab超时')
+            self.stats['leases'] += 1
+            return self._free.pop()
+
+    def release(self, slab):
+        if not self.is_pooled(slab):
+            self._destroy(slab)
+            return
+        with self._condition:
+            self._free.append(slab)
+            self._condition.notify()
+
+    def is_pooled(self, slab):
+        """是否为池中循环使用的slab（超大请求的临时slab归还时直接释放）"""
+        return slab in self._slabs
+
+    def close(self):
+        for slab in self._slabs:
+            self._destroy(slab)
+        self._slabs = []
+        self._free = []
+
+    @staticmethod
+    def _destroy(slab):
+        try:
+            slab.shm.close()
+        except BufferError:
+            # 仍有数组视图引用时无法解除映射，只删除名称，进程退出时释放
+            pass
+        try:
+            slab.shm.unlink()
+        except FileNotFoundError:
+            pass
+
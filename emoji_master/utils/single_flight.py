@@ -0,0 +1,171 @@
+import threading
+
+
+class RequestCancelled(Exception):
+    """请求已被客户端取消或被同一会话的新请求取代"""
+
+
+class CancellationToken:
+    """协作式取消令牌 - 处理流程在各阶段之间调用check()"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def check(self):
+        """已取消时抛出RequestCancelled"""
+        if self._event.is_set():
+            raise RequestCancelled()
+
+    def add_callback(self, callback):
+        """注册取消回调，已取消时立即调用"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+class _Flight:
+    """一次正在进行的计算"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.token = CancellationToken()
+        self.participants = 0
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """合并并发的相同请求 - 同一键只计算一次，其余请求等待并共享结果
+
+    计算本身使用独立的取消令牌：只有所有等待者都取消后才会被取消，
+    某一个请求取消不会影响仍在等待同一结果的其他请求。
+    被放弃的计算立即从表中移除，之后到达的相同请求（如双击时取代旧请求的新请求）会重新开始计算。
+    """
+
+    def __init__(self, poll_interval=0.05):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.stats = {'executed': 0, 'coalesced': 0, 'cancelled': 0}
+
+    def do(self, key, fn, token=None):
+        """执行fn(flight_token)或等待相同键的计算完成 - 返回共享结果"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.stats['executed'] += 1
+            else:
+                self.stats['coalesced'] += 1
+                print(f"🔗 合并相同的生成请求，等待中: {flight.participants}")
+            flight.participants += 1
+
+        left = []
+
+        def leave():
+            with self._lock:
+                if left:
+                    return
+                left.append(True)
+                flight.participants -= 1
+                abandon = flight.participants == 0 and not flight.done.is_set()
+                if abandon:
+                    self.stats['cancelled'] += 1
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+            if abandon:
+                flight.token.cancel()
+
+        if token is not None:
+            token.add_callback(leave)
+
+        try:
+            if leader:
+                try:
+                    flight.result = fn(flight.token)
+                except Exception as e:
+                    flight.error = e
+                finally:
+                    with self._lock:
+                        # 被放弃后键可能已经属于新的计算
+                        if self._flights.get(key) is flight:
+                            del self._flights[key]
+                    flight.done.set()
+            else:
+                while not flight.done.wait(self.poll_interval):
+                    if token is not None:
+                        token.check()
+
+            if token is not None:
+                token.check()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        finally:
+            if token is not None:
+                token.remove_callback(leave)
+            leave()
+
+
+class RequestTracker:
+    """按会话跟踪进行中的请求 - 同一会话的新请求会取消旧请求"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._sessions = {}
+
+    def register(self, request_id, session_id=None):
+        """登记请求并返回其取消令牌"""
+        token = CancellationToken()
+        with self._lock:
+            self._requests[request_id] = token
+            superseded = None
+            if session_id:
+                superseded = self._sessions.get(session_id)
+                self._sessions[session_id] = request_id
+            previous = self._requests.get(superseded) if superseded != request_id else None
+
+        if previous is not None:
+            print(f"⏹️ 请求{superseded}被同一会话的新请求取代")
+            previous.cancel()
+        return token
+
+    def cancel(self, request_id):
+        """取消请求 - 请求不存在（已完成）时返回False"""
+        with self._lock:
+            token = self._requests.get(request_id)
+        if token is None:
+            return False
+        token.cancel()
+        return True
+
+    def finish(self, request_id, session_id=None):
+        with self._lock:
+            self._requests.pop(request_id, None)
+            if session_id and self._sessions.get(session_id) == request_id:
+                del self._sessions[session_id]
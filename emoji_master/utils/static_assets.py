@@ -0,0 +1,95 @@
+import os
+import gzip
+import hashlib
+import mimetypes
+from config import Config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class StaticAssets:
+    """静态资源指纹 - 启动时按内容哈希生成带指纹的文件名，并预先压缩gzip/brotli版本
+
+    文件内容变化后URL随之变化，浏览器可以长期缓存而不必每次重新验证；
+    生成的文件写入 output_folder，多个工作进程同时启动时结果相同，写入是原子的。
+    没有安装 brotli 时只生成gzip版本。
+    """
+
+    # 按 Accept-Encoding 选择时的优先顺序
+    ENCODINGS = ('br', 'gzip')
+
+    def __init__(self, assets_config=None, static_folder=None):
+        self.assets_config = assets_config or Config.STATIC_ASSETS
+        self.static_folder = static_folder or Config.STATIC_FOLDER
+        self.output_folder = self.assets_config['output_folder']
+        # 原始文件名 -> 指纹文件名
+        self._fingerprinted = {}
+        # 指纹文件名 -> {'mimetype', 'variants': {编码: 路径}}
+        self._assets = {}
+
+    def build(self):
+        """为配置的每个文件生成指纹版本和压缩版本"""
+        for filename in self.assets_config['files']:
+            source_path = os.path.join(self.static_folder, filename)
+            try:
+                with open(source_path, 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                print(f"⚠️ 静态资源不存在，使用原始地址: {filename} ({e})")
+                continue
+
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            stem, extension = os.path.splitext(filename)
+            fingerprinted = f'{stem}.{digest}{extension}'
+            target = os.path.join(self.output_folder, fingerprinted)
+
+            variants = {'identity': self._write_once(target, lambda: data)}
+            if len(data) >= self.assets_config['min_compress_bytes']:
+                variants['gzip'] = self._write_once(
+                    target + '.gz', lambda: gzip.compress(data, self.assets_config['gzip_level'], mtime=0))
+                if brotli is not None:
+                    variants['br'] = self._write_once(
+                        target + '.br', lambda: brotli.compress(data, quality=self.assets_config['brotli_quality']))
+
+            self._fingerprinted[filename] = fingerprinted
+            self._assets[fingerprinted] = {
+                'mimetype': mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                'variants': variants
+            }
+            sizes = ', '.join(f'{name} {os.path.getsize(path) / 1024:.1f}KB' for name, path in variants.items())
+            print(f"📦 静态资源: {filename} -> {fingerprinted} ({sizes})")
+
+    def fingerprinted(self, filename):
+        """原始文件名对应的指纹文件名，未生成时返回None"""
+        return self._fingerprinted.get(filename)
+
+    def resolve(self, fingerprinted, accept_encoding):
+        """按 Accept-Encoding 选择文件 - 返回(路径, 编码, MIME类型)，未知文件返回None"""
+        asset = self._assets.get(fingerprinted)
+        if asset is None:
+            return None
+
+        accepted = set()
+        for item in (accept_encoding or '').split(','):
+            name, _, params = item.partition(';')
+            # q=0 表示明确不接受
+            if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                accepted.add(name.strip().lower())
+        for encoding in self.ENCODINGS:
+            if encoding in accepted and encoding in asset['variants']:
+                return asset['variants'][encoding], encoding, asset['mimetype']
+        return asset['variants']['identity'], None, asset['mimetype']
+
+    @staticmethod
+    def _write_once(path, produce):
+        """文件已存在时直接使用（同一内容哈希的结果相同），否则写入临时文件后原子替换"""
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(produce())
+            os.replace(temp_path, path)
+        return path
@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+from config import Config
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class TempJanitor:
+    """临时文件清理 - 后台线程定期清理上传和结果目录
+
+    每轮用 os.scandir 一次遍历拿到大小和修改时间：先删除超过 max_age_hours 的文件，
+    总大小仍超过 quota_bytes 时从最旧的文件开始删除。最近 min_age_seconds 内写入的文件
+    可能仍在处理中，不会被删除。多个工作进程通过锁文件互斥，
+    距上一轮（任一进程）不足半个周期时跳过。
+    """
+
+    def __init__(self, janitor_config=None):
+        self.janitor_config = janitor_config or Config.TEMP_JANITOR
+        self.lock_path = self.janitor_config['lock_path']
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'sweeps': 0, 'skipped': 0, 'deleted_files': 0, 'reclaimed_bytes': 0,
+                      'last_sweep': None, 'total_bytes': None}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='temp-janitor', daemon=True)
+        self._thread.start()
+        print(f"🧹 临时文件清理已启动: 每{self.janitor_config['interval']}秒, "
+              f"上限{self.janitor_config['quota_bytes'] / 1024 / 1024:.0f}MB")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # 启动时先清理一轮（重启前遗留的文件）
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠️ 临时文件清理失败: {e}")
+            if self._stop.wait(self.janitor_config['interval']):
+                return
+
+    def sweep(self, force=False):
+        """执行一轮清理 - 返回(删除文件数, 回收字节数)；其他进程正在清理或刚清理过时返回None"""
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        with open(self.lock_path, 'a+') as lock_file:
+            if not self._try_lock(lock_file):
+                self.stats['skipped'] += 1
+                return None
+            try:
+                lock_file.seek(0)
+                try:
+                    last_sweep = float(lock_file.read().strip() or 0)
+                except ValueError:
+                    last_sweep = 0
+                now = time.time()
+                if not force and now - last_sweep < self.janitor_config['interval'] / 2:
+                    self.stats['skipped'] += 1
+                    return None
+
+                deleted, reclaimed = self._sweep_folders(now)
+
+                lock_file.seek(0)
+                lock_file.truncate()
+                lock_file.write(str(now))
+                lock_file.flush()
+            finally:
+                self._unlock(lock_file)
+
+        self.stats['sweeps'] += 1
+        self.stats['deleted_files'] += deleted
+        self.stats['reclaimed_bytes'] += reclaimed
+        self.stats['last_sweep'] = now
+        if deleted:
+            print(f"🧹 清理临时文件: {deleted}个, 回收{reclaimed / 1024 / 1024:.1f}MB")
+        return deleted, reclaimed
+
+    def _sweep_folders(self, now):
+        max_age = self.janitor_config['max_age_hours'] * 3600
+        min_age = self.janitor_config['min_age_seconds']
+
+        files = []
+        for folder in self.janitor_config['folders']:
+            files.extend(self._scan(folder))
+
+        deleted, reclaimed = 0, 0
+        remaining = []
+        for path, size, mtime in files:
+            if now - mtime > max_age and self._remove(path):
+                deleted += 1
+                reclaimed += size
+            else:
+                remaining.append((path, size, mtime))
+
+        total = sum(size for _, size, _ in remaining)
+        if total > self.janitor_config['quota_bytes']:
+            remaining.sort(key=lambda item: item[2])
+            for path, size, mtime in remaining:
+                if total <= self.janitor_config['quota_bytes'] or now - mtime < min_age:
+                    break
+                if self._remove(path):
+                    deleted += 1
+                    reclaimed += size
+                    total -= size
+
+        self.stats['total_bytes'] = total
+        return deleted, reclaimed
+
+    def _scan(self, folder):
+        """递归列出文件 - [(路径, 大小, 修改时间)]，stat信息来自 os.scandir"""
+        files = []
+        stack = [folder]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                stat = entry.stat(follow_symlinks=False)
+                                files.append((entry.path, stat.st_size, stat.st_mtime))
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return files
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _try_lock(lock_file):
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _unlock(lock_file):
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
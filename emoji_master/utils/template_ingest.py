@@ -0,0 +1,161 @@
+import os
+import hashlib
+import threading
+import numpy as np
+from PIL import Image
+from config import Config
+from models.style_synthesis import StyleSynthesizer
+
+
+class TemplateIngestor:
+    """模板上传规范化 - 上传时一次性完成校验、转换和衍生文件生成"""
+
+    def __init__(self):
+        self.styles_folder = Config.STYLES_FOLDER
+        self.thumbnails_folder = Config.THUMBNAILS_FOLDER
+        self.max_side = Config.TEMPLATE_MAX_SIDE
+        self.max_input_pixels = Config.TEMPLATE_MAX_INPUT_PIXELS
+        self.thumbnail_size = Config.TEMPLATE_THUMBNAIL_SIZE
+        # 缩略图路径 -> (修改时间, 大小, ETag)
+        self._etags = {}
+        self._etag_lock = threading.Lock()
+
+    @staticmethod
+    def raw_path_for(template_path):
+        """模板PNG对应的预解码文件路径 (.npy, HxWx4 uint8)"""
+        return os.path.splitext(str(template_path))[0] + '.npy'
+
+    def thumbnail_path_for(self, filename):
+        """模板对应的缩略图路径"""
+        return os.path.join(self.thumbnails_folder, os.path.splitext(filename)[0] + '.webp')
+
+    def ensure_thumbnail(self, template_path, filename):
+        """缩略图不存在或比模板旧时重新生成（系统模板没有经过上传流程） - 返回缩略图路径，失败时返回None"""
+        thumbnail_path = self.thumbnail_path_for(filename)
+        try:
+            template_mtime = os.path.getmtime(template_path)
+        except OSError:
+            return None
+        try:
+            if os.path.getmtime(thumbnail_path) >= template_mtime:
+                return thumbnail_path
+        except OSError:
+            pass
+
+        try:
+            with Image.open(template_path) as template:
+                template = self._to_rgba8(template)
+                os.makedirs(self.thumbnails_folder, exist_ok=True)
+                # 先写临时文件再原子替换，多个工作进程同时生成时不会读到半个文件
+                temp_path = f'{thumbnail_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+                self._write_thumbnail(template, temp_path)
+                os.replace(temp_path, thumbnail_path)
+        except Exception as e:
+            print(f"⚠️ 缩略图生成失败 {filename}: {e}")
+            return None
+        return thumbnail_path
+
+    def thumbnail_etag(self, thumbnail_path):
+        """缩略图内容的SHA-256（强ETag），按修改时间和大小缓存，文件未变化时不重新读取"""
+        stat = os.stat(thumbnail_path)
+        with self._etag_lock:
+            cached = self._etags.get(thumbnail_path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+
+        with open(thumbnail_path, 'rb') as f:
+            etag = hashlib.sha256(f.read()).hexdigest()
+        with self._etag_lock:
+            self._etags[thumbnail_path] = (stat.st_mtime_ns, stat.st_size, etag)
+        return etag
+
+    def ingest(self, file, filename):
+        """规范化上传的模板并写入PNG、预解码文件和缩略图
+
+        返回模板信息 {'width', 'height', 'layout'}，文件无效时抛出ValueError
+        """
+        template = self._open_and_validate(file)
+        template = self._to_rgba8(template)
+        template = self._cap_dimensions(template)
+
+        # 重新构建图像，丢弃EXIF/ICC/文本块等元数据
+        template = Image.frombytes('RGBA', template.size, template.tobytes())
+
+        template_path = os.path.join(self.styles_folder, filename)
+        os.makedirs(self.styles_folder, exist_ok=True)
+        os.makedirs(self.thumbnails_folder, exist_ok=True)
+
+        try:
+            template.save(template_path, format='PNG', optimize=True)
+            np.save(self.raw_path_for(template_path), np.asarray(template))
+            self._write_thumbnail(template, self.thumbnail_path_for(filename))
+        except Exception:
+            self.remove_template_files(filename)
+            raise
+
+        layout = StyleSynthesizer.compute_template_layout(template.size)
+        print(f"✅ 模板规范化完成: {filename} ({template.size})")
+        return {
+            'width': template.width,
+            'height': template.height,
+            'layout': layout
+        }
+
+    def _open_and_validate(self, file):
+        """只读取文件头校验格式和尺寸，避免先解码超大图像"""
+        try:
+            template = Image.open(file.stream if hasattr(file, 'stream') else file)
+        except Exception:
+            raise ValueError('无法识别的图像文件')
+
+        if template.format != 'PNG':
+            raise ValueError('模板必须是PNG格式')
+
+        width, height = template.size
+        if width <= 0 or height <= 0:
+            raise ValueError('模板尺寸无效')
+        if width * height > self.max_input_pixels:
+            raise ValueError(f'模板尺寸过大: {width}x{height}')
+
+        try:
+            template.load()
+        except Exception:
+            raise ValueError('模板文件已损坏')
+        return template
+
+    @staticmethod
+    def _to_rgba8(template):
+        """转换为8位RGBA - 16位灰度需要先缩放到8位，否则convert会直接截断"""
+        if template.mode in ('I', 'I;16', 'I;16L', 'I;16B'):
+            values = np.asarray(template, dtype=np.uint32)
+            if values.max() > 255:
+                values = values >> 8
+            template = Image.fromarray(values.astype(np.uint8), 'L')
+
+        if template.mode != 'RGBA':
+            template = template.convert('RGBA')
+        return template
+
+    def _cap_dimensions(self, template):
+        """限制模板最长边"""
+        if max(template.size) > self.max_side:
+            original_size = template.size
+            template.thumbnail((self.max_side, self.max_side), Image.LANCZOS, reducing_gap=3.0)
+            print(f"📏 模板尺寸限制: {original_size} -> {template.size}")
+        return template
+
+    def _write_thumbnail(self, template, thumbnail_path):
+        """生成画廊缩略图"""
+        thumbnail = template.copy()
+        thumbnail.thumbnail((self.thumbnail_size, self.thumbnail_size), Image.LANCZOS)
+        thumbnail.save(thumbnail_path, format='WEBP', quality=80, method=4)
+
+    def remove_template_files(self, filename):
+        """删除模板PNG及其衍生文件"""
+        template_path = os.path.join(self.styles_folder, filename)
+        for path in (template_path, self.raw_path_for(template_path), self.thumbnail_path_for(filename)):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                print(f"⚠️ 无法删除模板文件 {path}: {e}")
@@ -0,0 +1,207 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from config import Config
+
+
+class TemplateRegistry:
+    """自定义模板注册表 - 基于SQLite(WAL模式)，支持多进程并发读写"""
+
+    # 后续版本新增的列，旧数据库启动时自动补齐
+    OPTIONAL_COLUMNS = {
+        'width': 'INTEGER',
+        'height': 'INTEGER',
+        'layout': 'TEXT'
+    }
+
+    def __init__(self, db_path=None, legacy_json_path=None):
+        self.db_path = str(db_path or Config.TEMPLATE_DB_PATH)
+        self.legacy_json_path = legacy_json_path or Config.CUSTOM_TEMPLATES_JSON
+        # sqlite3连接不能跨线程共享，每个线程各自持有一个连接
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._initialize_schema()
+        self._migrate_from_json()
+
+    def _connect(self):
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: 由代码显式控制事务
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _initialize_schema(self):
+        """创建数据表和索引"""
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS custom_templates (
+                style_name TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                description TEXT NOT NULL DEFAULT '',
+                created_at TEXT NOT NULL,
+                type TEXT NOT NULL DEFAULT 'custom',
+                width INTEGER,
+                height INTEGER,
+                layout TEXT
+            )
+        ''')
+        existing_columns = {row['name'] for row in conn.execute('PRAGMA table_info(custom_templates)')}
+        for column, column_type in self.OPTIONAL_COLUMNS.items():
+            if column not in existing_columns:
+                try:
+                    conn.execute(f'ALTER TABLE custom_templates ADD COLUMN {column} {column_type}')
+                except sqlite3.OperationalError:
+                    # 其他进程已经添加
+                    pass
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_custom_templates_created '
+            'ON custom_templates (created_at, style_name)'
+        )
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS registry_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
+
+    def _migrate_from_json(self):
+        """一次性从旧的custom_templates.json迁移数据"""
+        json_path = self.legacy_json_path
+        if not json_path or not os.path.exists(json_path):
+            return
+
+        conn = self._connect()
+        try:
+            # 多个进程同时启动时，只有拿到写锁的进程执行迁移
+            conn.execute('BEGIN IMMEDIATE')
+            migrated = conn.execute(
+                "SELECT value FROM registry_meta WHERE key = 'json_migrated'"
+            ).fetchone()
+            if migrated:
+                conn.execute('COMMIT')
+                return
+
+            with open(json_path, 'r', encoding='utf-8') as f:
+                templates = json.load(f)
+
+            for style_name, info in templates.items():
+                conn.execute(
+                    'INSERT OR IGNORE INTO custom_templates '
+                    '(style_name, filename, description, created_at, type) VALUES (?, ?, ?, ?, ?)',
+                    (style_name, info['filename'], info.get('description', ''),
+                     info.get('created_at', str(datetime.now())), info.get('type', 'custom'))
+                )
+            conn.execute(
+                "INSERT INTO registry_meta (key, value) VALUES ('json_migrated', ?)",
+                (str(datetime.now()),)
+            )
+            conn.execute('COMMIT')
+            print(f"✅ 已从 {json_path} 迁移 {len(templates)} 个自定义模板")
+        except Exception as e:
+            conn.execute('ROLLBACK')
+            print(f"❌ 迁移自定义模板配置失败: {e}")
+            return
+
+        # 保留旧文件作为备份，避免再次被读取
+        try:
+            os.replace(json_path, json_path + '.migrated')
+        except OSError as e:
+            print(f"⚠️ 无法重命名旧模板配置文件: {e}")
+
+    @staticmethod
+    def _row_to_info(row):
+        """数据库行转换为模板信息字典（与旧JSON格式一致）"""
+        info = {
+            'filename': row['filename'],
+            'description': row['description'],
+            'created_at': row['created_at'],
+            'type': row['type']
+        }
+        if row['width'] and row['height']:
+            info['width'] = row['width']
+            info['height'] = row['height']
+        if row['layout']:
+            info['layout'] = json.loads(row['layout'])
+        return info
+
+    def get(self, style_name):
+        """按风格名称查询模板信息"""
+        row = self._connect().execute(
+            'SELECT * FROM custom_templates WHERE style_name = ?', (style_name,)
+        ).fetchone()
+        return self._row_to_info(row) if row else None
+
+    def exists(self, style_name):
+        """检查风格名称是否已存在"""
+        row = self._connect().execute(
+            'SELECT 1 FROM custom_templates WHERE style_name = ?', (style_name,)
+        ).fetchone()
+        return row is not None
+
+    def add(self, style_name, filename, description='', template_type='custom',
+            width=None, height=None, layout=None):
+        """添加模板 - 名称已存在时返回False"""
+        try:
+            self._connect().execute(
+                'INSERT INTO custom_templates '
+                '(style_name, filename, description, created_at, type, width, height, layout) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (style_name, filename, description, str(datetime.now()), template_type,
+                 width, height, json.dumps(layout) if layout else None)
+            )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def delete(self, style_name):
+        """删除模板 - 返回被删除的模板信息，不存在时返回None"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT * FROM custom_templates WHERE style_name = ?', (style_name,)
+            ).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM custom_templates WHERE style_name = ?', (style_name,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self._row_to_info(row) if row else None
+
+    def count(self, template_type='custom'):
+        """统计模板数量"""
+        row = self._connect().execute(
+            'SELECT COUNT(*) FROM custom_templates WHERE type = ?', (template_type,)
+        ).fetchone()
+        return row[0]
+
+    def list_templates(self, page=1, page_size=None, template_type='custom'):
+        """分页列出模板 - 返回(模板字典, 总数)"""
+        page_size = page_size or Config.CUSTOM_TEMPLATES_PAGE_SIZE
+        page = max(1, int(page))
+        offset = (page - 1) * page_size
+
+        rows = self._connect().execute(
+            'SELECT * FROM custom_templates WHERE type = ? '
+            'ORDER BY created_at, style_name LIMIT ? OFFSET ?',
+            (template_type, page_size, offset)
+        ).fetchall()
+
+        templates = {row['style_name']: self._row_to_info(row) for row in rows}
+        return templates, self.count(template_type)
+
+    def get_all(self):
+        """获取所有模板（兼容旧的JSON读取接口）"""
+        rows = self._connect().execute(
+            'SELECT * FROM custom_templates ORDER BY created_at, style_name'
+        ).fetchall()
+        return {row['style_name']: self._row_to_info(row) for row in rows}
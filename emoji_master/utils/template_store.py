@@ -0,0 +1,231 @@
+import os
+import json
+import uuid
+import threading
+from contextlib import contextmanager
+import numpy as np
+from PIL import Image
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只做进程内加锁
+    fcntl = None
+
+
+class TemplateStore:
+    """共享模板图集 - 解码后的RGBA模板写入内存映射文件，所有工作进程共享同一份只读页面
+
+    图集由两个文件组成:
+      - atlas_<version>.bin: 所有模板像素按64字节对齐依次排列
+      - index.json: 版本号、图集文件名以及每个模板的偏移、形状和源文件信息
+    重建时先写新图集再原子替换索引，其他进程在下次访问时发现索引变化并重新映射。
+    """
+
+    ALIGNMENT = 64
+
+    def __init__(self, template_registry):
+        self.template_registry = template_registry
+        self.styles_folder = Config.STYLES_FOLDER
+        self.folder = Config.TEMPLATE_ATLAS_FOLDER
+        self.index_path = os.path.join(self.folder, 'index.json')
+        self.lock_path = os.path.join(self.folder, 'atlas.lock')
+
+        self._index = None
+        self._index_stamp = None
+        self._atlas = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+        os.makedirs(self.folder, exist_ok=True)
+
+    @property
+    def version(self):
+        """当前映射的图集版本"""
+        return self._index['version'] if self._index else None
+
+    def ensure_built(self):
+        """启动时调用 - 图集缺失或过期时重建"""
+        self.refresh()
+        if not self._index_matches(self._collect_sources()):
+            self.rebuild()
+
+    def get_image(self, style_name, source_path=None, source_mtime=None):
+        """获取模板的零拷贝只读PIL视图 - 图集中没有或已过期时返回None"""
+        self.refresh()
+
+        pixels = self._get_view(style_name, source_path, source_mtime)
+        if pixels is None:
+            return None
+
+        height, width = pixels.shape[:2]
+        return Image.frombuffer('RGBA', (width, height), pixels, 'raw', 'RGBA', 0, 1)
+
+    def _get_view(self, style_name, source_path=None, source_mtime=None):
+        """获取模板在图集中的numpy视图 (HxWx4 uint8，只读)"""
+        index, atlas = self._index, self._atlas
+        if index is None or atlas is None:
+            return None
+
+        entry = index['entries'].get(style_name)
+        if entry is None:
+            return None
+        if source_path is not None and os.path.abspath(str(source_path)) != entry['source']:
+            return None
+        if source_mtime is not None and source_mtime != entry['mtime']:
+            return None
+
+        height, width, channels = entry['shape']
+        offset = entry['offset']
+        return atlas[offset:offset + height * width * channels].reshape(height, width, channels)
+
+    def refresh(self):
+        """索引文件变化时重新加载索引并重新映射图集"""
+        try:
+            stat = os.stat(self.index_path)
+        except OSError:
+            return
+
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._index_stamp:
+            return
+
+        with self._lock:
+            if stamp == self._index_stamp:
+                return
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+
+                atlas_path = os.path.join(self.folder, index['atlas'])
+                atlas = None
+                if index['entries'] and os.path.getsize(atlas_path) > 0:
+                    atlas = np.memmap(atlas_path, dtype=np.uint8, mode='r')
+            except Exception as e:
+                print(f"⚠️ 加载模板图集失败: {e}")
+                return
+
+            self._index, self._atlas, self._index_stamp = index, atlas, stamp
+            print(f"🗺️ 模板图集已映射: 版本{index['version'][:8]}, {len(index['entries'])}个模板")
+
+    def rebuild(self):
+        """重建图集 - 未变化的模板直接从旧图集复制，只解码新增或修改的模板"""
+        with self._file_lock():
+            # 拿到锁后重新检查，其他进程可能已经完成重建
+            self.refresh()
+            sources = self._collect_sources()
+            if self._index_matches(sources):
+                return
+
+            version = uuid.uuid4().hex
+            atlas_name = f'atlas_{version}.bin'
+            atlas_path = os.path.join(self.folder, atlas_name)
+            entries = {}
+            offset = 0
+
+            with open(atlas_path + '.tmp', 'wb') as f:
+                for style_name, (source, mtime) in sorted(sources.items()):
+                    pixels = self._get_pixels(style_name, source, mtime)
+                    if pixels is None:
+                        continue
+
+                    padding = (-offset) % self.ALIGNMENT
+                    f.write(b'\0' * padding)
+                    offset += padding
+
+                    f.write(pixels.tobytes())
+                    entries[style_name] = {
+                        'offset': offset,
+                        'shape': list(pixels.shape),
+                        'source': source,
+                        'mtime': mtime
+                    }
+                    offset += pixels.nbytes
+
+            os.replace(atlas_path + '.tmp', atlas_path)
+
+            index = {'version': version, 'atlas': atlas_name, 'entries': entries}
+            with open(self.index_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(self.index_path + '.tmp', self.index_path)
+
+            self.refresh()
+            self._remove_stale_atlases(atlas_name)
+            print(f"✅ 模板图集重建完成: {len(entries)}个模板, {offset / 1024 / 1024:.1f}MB")
+
+    def _collect_sources(self):
+        """收集系统模板和自定义模板的源文件及修改时间"""
+        sources = {}
+        for style_name, filename in Config.AVAILABLE_STYLES.items():
+            sources[style_name] = os.path.join(self.styles_folder, filename)
+
+        try:
+            for style_name, info in self.template_registry.get_all().items():
+                # 与StyleSynthesizer一致：系统模板优先
+                sources.setdefault(style_name, os.path.join(self.styles_folder, info['filename']))
+        except Exception as e:
+            print(f"⚠️ 读取自定义模板失败: {e}")
+
+        result = {}
+        for style_name, path in sources.items():
+            try:
+                result[style_name] = (os.path.abspath(path), os.stat(path).st_mtime)
+            except OSError:
+                continue
+        return result
+
+    def _index_matches(self, sources):
+        """检查当前索引是否与源文件一致"""
+        if self._index is None:
+            return False
+
+        entries = self._index['entries']
+        if set(entries) != set(sources):
+            return False
+        return all(
+            entries[name]['source'] == source and entries[name]['mtime'] == mtime
+            for name, (source, mtime) in sources.items()
+        )
+
+    def _get_pixels(self, style_name, source, mtime):
+        """获取模板像素 - 优先复用旧图集中的数据"""
+        view = self._get_view(style_name, source, mtime)
+        if view is not None:
+            return view
+
+        try:
+            raw_path = os.path.splitext(source)[0] + '.npy'
+            if os.path.exists(raw_path):
+                pixels = np.load(raw_path)
+            else:
+                with Image.open(source) as template:
+                    pixels = np.asarray(template.convert('RGBA'))
+
+            if pixels.ndim != 3 or pixels.shape[2] != 4 or pixels.dtype != np.uint8:
+                raise ValueError(f'无效的模板数据: {pixels.shape} {pixels.dtype}')
+            return np.ascontiguousarray(pixels)
+        except Exception as e:
+            print(f"⚠️ 模板写入图集失败 {style_name}: {e}")
+            return None
+
+    def _remove_stale_atlases(self, current_name):
+        """删除旧版本图集 - 仍在映射旧文件的进程不受影响（POSIX）"""
+        for entry in os.scandir(self.folder):
+            if entry.name.startswith('atlas_') and entry.name != current_name:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    # Windows下被映射的文件无法删除，下次重建时再清理
+                    pass
+
+    @contextmanager
+    def _file_lock(self):
+        """跨进程的重建锁"""
+        with self._build_lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)